@@ -1,80 +1,291 @@
 # ai_services.py
 
 import streamlit as st
-import openai
 import json
 import os
+import re
+import time
 import pandas as pd
 import kms_services
+import odoo_client
+import schema_cache
+import etl_runtime
+import code_executor
+import plan_validation
+import plan_cache
+import model_index
+import llm_metrics
+import llm_client
+import code_analysis
 import xmlrpc.client
 import traceback
 import logging
 import requests
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
 
 # Importe les templates de prompts (si vous avez créé le fichier prompts.py)
 # from prompts import VISUALIZATION_SUGGESTION_PROMPT_TEMPLATE, VISUALIZATION_GUIDE_PROMPT_TEMPLATE
 
-# --- Configuration Hybride de la Clé API ---
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY") or st.secrets.get("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    st.error("La clé API OpenAI n'est pas configurée.")
-    st.stop()
+# --- Client de l'IA (voir `llm_client`) ---
+# Créé au premier appel : la clé API n'est exigée que par les modes `openai` et `record`,
+# et son absence est signalée par l'appel qui échoue, sans interrompre l'import du module.
+client = None
 
-# Initialise le client OpenAI une seule fois
-client = openai.OpenAI(api_key=OPENAI_API_KEY)
 
+def _openai_api_key():
+    """Configuration hybride de la clé API : variable d'environnement, puis secrets Streamlit."""
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if api_key:
+        return api_key
+    try:
+        return st.secrets.get("OPENAI_API_KEY")
+    except Exception:
+        # Pas de fichier de secrets (exécution hors Streamlit Cloud)
+        return None
+
+
+def get_client():
+    """Client de l'IA partagé (`LLM_CLIENT`), créé une seule fois."""
+    global client
+    if client is None:
+        client = llm_client.make_client(api_key=_openai_api_key())
+    return client
+
+# Lectures du schéma lancées pendant que l'IA rédige sa réponse
+SCHEMA_PREFETCH_WORKERS = int(os.getenv("SCHEMA_PREFETCH_WORKERS", "4"))
+# Attente maximale avant de lire le schéma des modèles repérés (regroupés en une seule requête)
+SCHEMA_PREFETCH_DEBOUNCE_SECONDS = float(os.getenv("SCHEMA_PREFETCH_DEBOUNCE_SECONDS", "0.5"))
+# Délai minimal entre deux rafraîchissements de la progression affichée pendant la réception
+STREAM_REFRESH_SECONDS = 0.2
+# Partagé entre les sessions : une lecture abandonnée alimente tout de même le cache du schéma
+_schema_prefetch_pool = ThreadPoolExecutor(max_workers=SCHEMA_PREFETCH_WORKERS, thread_name_prefix="schema-prefetch")
+
+# Chaîne JSON complète (guillemets échappés compris)
+_JSON_STRING = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+
+def _metrics_context(conn_key=None):
+    """Utilisateur et connexion Odoo auxquels sont rattachés les appels mesurés (`llm_metrics`)."""
+    conn_details = st.session_state.get('conn_details')
+    if conn_key is None and conn_details and st.session_state.get('uid'):
+        conn_key = schema_cache.connection_key(conn_details['url'], conn_details['db'], st.session_state.uid)
+    return {'user': st.session_state.get('firebase_uid'), 'connection': conn_key}
+
+
+def _stream_completion(messages, on_delta=None, metrics=None):
+    """
+    Appelle gpt-4o en flux (réponse JSON) : `on_delta(fragment)` reçoit chaque fragment dès
+    son arrivée. Retourne le texte complet de la réponse. Le délai avant le premier fragment et
+    les jetons (envoyés avec le dernier fragment) sont reportés dans `metrics`.
+    """
+    parts = []
+    stream = llm_client.create_completion(
+        get_client(), metrics,
+        model="gpt-4o",
+        messages=messages,
+        response_format={"type": "json_object"},
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    for chunk in stream:
+        if metrics is not None and getattr(chunk, 'usage', None):
+            metrics.usage(chunk.usage)
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            if metrics is not None:
+                metrics.first_token()
+            parts.append(delta)
+            if on_delta:
+                on_delta(delta)
+    return ''.join(parts)
+
+
+class _StreamedModels:
+    """
+    Repère, dans une réponse JSON reçue en flux, les noms de modèles connus dès que leur chaîne
+    est complète, et appelle `on_model(modèle)` une seule fois pour chacun.
+    """
+
+    def __init__(self, known_models, on_model):
+        self.known_models = set(known_models)
+        self.on_model = on_model
+        self.found = []
+        self.text = ''
+        self.position = 0
+
+    def feed(self, delta):
+        self.text += delta
+        for match in _JSON_STRING.finditer(self.text, self.position):
+            self.position = match.end()
+            model_name = match.group(1)
+            if model_name in self.known_models and model_name not in self.found:
+                self.found.append(model_name)
+                self.on_model(model_name)
+
+
+class _SchemaPrefetcher:
+    """
+    Lit le schéma des modèles repérés dans la réponse de l'IA par lots, chacun en une requête
+    `ir.model.fields` groupée (`fetch(noms)`, voir `schema_cache.get_fields`) : un lot part dès
+    qu'il atteint `etl_runtime.FIELDS_BATCH_SIZE` modèles, `SCHEMA_PREFETCH_DEBOUNCE_SECONDS`
+    après l'arrivée de son premier modèle (`poll`), ou à la fin de la réponse (`flush`).
+    """
+
+    def __init__(self, fetch):
+        self.fetch = fetch
+        self.pending = []
+        self.pending_since = None
+        self.requested = set()
+        self.batches = []
+
+    def add(self, model_name):
+        if model_name in self.requested:
+            return
+        if not self.pending:
+            self.pending_since = time.monotonic()
+        self.pending.append(model_name)
+        self.requested.add(model_name)
+        if len(self.pending) >= etl_runtime.FIELDS_BATCH_SIZE:
+            self.flush()
+
+    def poll(self):
+        if self.pending and time.monotonic() - self.pending_since >= SCHEMA_PREFETCH_DEBOUNCE_SECONDS:
+            self.flush()
 
-def get_ai_plan(user_prompt, document_text=None):
-    """Interroge l'IA en deux étapes pour obtenir le plan de transformation."""
+    def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        self.batches.append((batch, _schema_prefetch_pool.submit(self.fetch, batch)))
+
+    def wait(self):
+        self.flush()
+        wait([future for _, future in self.batches])
+        for batch, future in self.batches:
+            if future.exception() is not None:
+                logging.warning(f"Préchargement du schéma de {', '.join(batch)} impossible ({future.exception()}).")
+
+
+def _schema_for_prompt(fields_by_model):
+    """
+    Schéma compact envoyé à l'IA : pour chaque champ, son type, le modèle lié pour les
+    champs relationnels et les drapeaux utiles (`requis`, `non stocké`).
+    """
+    schema = {}
+    for model_name, fields in fields_by_model.items():
+        described = {}
+        for field_name in sorted(fields):
+            meta = fields[field_name]
+            description = meta.get('type') or '?'
+            if meta.get('relation'):
+                description += f"({meta['relation']})"
+            if meta.get('required'):
+                description += ", requis"
+            if meta.get('store') is False:
+                description += ", non stocké"
+            described[field_name] = description
+        schema[model_name] = described
+    return schema
+
+
+def get_ai_plan(user_prompt, document_text=None, use_cache=True):
+    """
+    Interroge l'IA en deux étapes pour obtenir le plan de transformation.
+    Les réponses de chaque étape sont mises en cache (`plan_cache`) : une demande identique sur
+    le même schéma est servie sans appel à l'IA, sauf si `use_cache` est faux (régénération).
+    """
     ai_response_text = None
     try:
-        url = st.session_state.conn_details['url']
-        logging.info(f"Tentative de connexion réseau brute à l'URL Odoo : {url}")
-        try:
-            requests.get(url, timeout=10)
-        except requests.exceptions.RequestException as net_err:
-            logging.error(f"--- ERREUR RÉSEAU DÉTECTÉE ---\n{traceback.format_exc()}")
-            st.error(f"Erreur de connexion réseau au serveur Odoo : {net_err}. Le serveur est peut-être inaccessible ou bloqué par un pare-feu.")
-            return None
-        
-        clean_url = url.rstrip('/')
+        clean_url = st.session_state.conn_details['url'].rstrip('/')
         password_decrypted = kms_services.decrypt_password(st.session_state.conn_details['encrypted_password'])
+        # Client partagé : les appels réutilisent les connexions HTTP ouvertes à la connexion
+        models_proxy = odoo_client.get_client(
+            clean_url, st.session_state.conn_details['db'], st.session_state.uid,
+            protocol=st.session_state.conn_details.get('protocol')
+        )
+        db = st.session_state.conn_details['db']
+        uid = st.session_state.uid
+        conn_key = schema_cache.connection_key(clean_url, db, uid)
+        metrics_context = _metrics_context(conn_key)
+
+        # Le schéma des modèles est lu dès que leurs noms apparaissent dans la réponse de l'IA,
+        # pendant qu'elle rédige la suite : latences réseau et IA se recouvrent
+        prefetcher = _SchemaPrefetcher(
+            lambda model_names: schema_cache.get_fields(models_proxy, db, uid, password_decrypted, conn_key, model_names)
+        )
+
+        def stream_with_progress(messages, progress, label, metrics):
+            """Réponse de l'IA reçue en flux : modèles repérés préchargés et progression affichée."""
+            last_refresh = [0.0]
+
+            def on_delta(delta):
+                watcher.feed(delta)
+                prefetcher.poll()
+                now = time.monotonic()
+                if now - last_refresh[0] >= STREAM_REFRESH_SECONDS:
+                    last_refresh[0] = now
+                    found = ', '.join(f"`{model_name}`" for model_name in watcher.found)
+                    progress.caption(f"{label} ({len(watcher.text)} caractères reçus){' — modèles : ' + found if found else ''}")
+
+            watcher = _StreamedModels(st.session_state.models, prefetcher.add)
+            response_text = _stream_completion(messages, on_delta, metrics)
+            prefetcher.flush()
+            progress.empty()
+            return response_text
 
         with st.spinner("L'IA analyse votre besoin et le schéma Odoo (étape 1/2)..."):
-            fresh_models_proxy_s1 = xmlrpc.client.ServerProxy(f'{clean_url}/xmlrpc/2/object')
-            if 'models' not in st.session_state or not st.session_state.models:
-                model_data = fresh_models_proxy_s1.execute_kw(
-                    st.session_state.conn_details['db'], st.session_state.uid, password_decrypted,
-                    'ir.model', 'search_read', [[]], {'fields': ['model']}
-                )
-                st.session_state.models = sorted([m['model'] for m in model_data if m.get('model')])
+            # Liste des modèles servie par le cache persistant du schéma (partagé entre sessions)
+            st.session_state.models = schema_cache.get_models(models_proxy, db, uid, password_decrypted, conn_key)
 
-            system_message_step1 = "Tu es un expert Odoo. À partir de l'objectif de l'utilisateur et de la liste complète des modèles, réponds UNIQUEMENT avec un objet JSON contenant une seule clé 'relevant_models' qui est une liste de noms de modèles pertinents."
+            system_message_step1 = "Tu es un expert Odoo. À partir de l'objectif de l'utilisateur et de la liste des modèles disponibles, réponds UNIQUEMENT avec un objet JSON contenant une seule clé 'relevant_models' qui est une liste de noms de modèles pertinents. Si aucun modèle de la liste ne convient, réponds avec une liste vide."
             full_prompt_for_ai = f"Objectif de l'utilisateur: {user_prompt}\n\nContenu du document fourni:\n{document_text or 'Aucun'}"
-            
-            response_step1 = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_message_step1},
-                    {"role": "user", "content": f"{full_prompt_for_ai}\n\nModèles disponibles: {st.session_state.models}"}
-                ],
-                response_format={"type": "json_object"}
-            )
-            relevant_models = json.loads(response_step1.choices[0].message.content)['relevant_models']
+            normalized_request = [plan_cache.normalize_text(user_prompt), plan_cache.normalize_text(document_text)]
 
-        with st.spinner("L'IA génère le code de transformation (étape 2/2)..."):
-            targeted_schema = {}
-            fresh_models_proxy_s2 = xmlrpc.client.ServerProxy(f'{clean_url}/xmlrpc/2/object')
-            for model_name in relevant_models:
-                if model_name in st.session_state.models:
-                    try:
-                        fields_data = fresh_models_proxy_s2.execute_kw(
-                            st.session_state.conn_details['db'], st.session_state.uid, password_decrypted,
-                            model_name, 'fields_get', [], {}
+            def select_models(available_models):
+                step1_key = plan_cache.content_key(conn_key, 'relevant_models', system_message_step1, normalized_request, available_models)
+                sections = {
+                    'system': system_message_step1, 'request': user_prompt,
+                    'document': document_text, 'models': str(available_models),
+                }
+                with llm_metrics.track('plan.models', "gpt-4o", sections=sections, **metrics_context) as metrics:
+                    selected = plan_cache.get(step1_key) if use_cache else None
+                    metrics.cache_hit(selected is not None)
+                    if selected is None:
+                        response_step1 = stream_with_progress(
+                            [
+                                {"role": "system", "content": system_message_step1},
+                                {"role": "user", "content": f"{full_prompt_for_ai}\n\nModèles disponibles: {available_models}"}
+                            ],
+                            st.empty(), "Sélection des modèles", metrics
                         )
-                        targeted_schema[model_name] = sorted(fields_data.keys())
-                    except:
-                        continue
+                        selected = json.loads(response_step1)['relevant_models']
+                        plan_cache.store(step1_key, selected)
+                return [model_name for model_name in selected if model_name in st.session_state.models]
+
+            # Présélection locale (BM25) : l'IA ne reçoit que les meilleurs candidats, avec leur libellé
+            relevant_models = []
+            try:
+                catalog = schema_cache.get_model_catalog(models_proxy, db, uid, password_decrypted, conn_key)
+                candidates, confident = model_index.shortlist(
+                    f"{conn_key}|{catalog['built_at']}", catalog['models'], f"{user_prompt}\n{(document_text or '')[:5000]}"
+                )
+            except Exception as e:
+                logging.warning(f"Présélection locale des modèles indisponible ({e}), la liste complète est envoyée à l'IA.")
+                candidates, confident = [], False
+            if confident:
+                relevant_models = select_models({model_name: catalog['models'][model_name][0] for model_name in candidates})
+            # Présélection peu fiable ou jugée insuffisante par l'IA : liste complète
+            if not relevant_models:
+                relevant_models = select_models(st.session_state.models)
+
+        with st.spinner("L'IA génère le code de transformation (étape 2/2)..."):
+            prefetcher.wait()
+            fields_by_model = schema_cache.get_fields(
+                models_proxy, db, uid, password_decrypted, conn_key,
+                [model_name for model_name in relevant_models if model_name in st.session_state.models]
+            )
+            targeted_schema = _schema_for_prompt(fields_by_model)
             
             schema_str = json.dumps(targeted_schema, indent=2)
             
@@ -82,23 +293,41 @@ def get_ai_plan(user_prompt, document_text=None):
             system_message_step2 = """
             Tu es un expert Odoo et Python/Pandas. Ton rôle est de générer un plan d'extraction et un code de transformation robustes.
             Tu dois répondre UNIQUEMENT avec un bloc de code JSON valide.
-            Le JSON doit contenir deux clés : "models_and_fields" et "python_code".
+            Le JSON doit contenir cinq clés : "models_and_fields", "domains", "aggregations", "streaming_fact_model" et "python_code".
 
             La valeur de "python_code" DOIT être une chaîne de caractères contenant une unique fonction Python nommée `transform_data` qui prend un seul argument : `dfs`.
-            Cet argument `dfs` est un dictionnaire où les clés sont les noms des modèles et les valeurs sont les DataFrames Pandas bruts correspondants.
+            Cet argument `dfs` est un dictionnaire où les clés sont les noms des modèles et les valeurs sont les DataFrames Pandas correspondants, déjà typés (voir TYPES DES DONNÉES REÇUES).
             La fonction DOIT retourner un unique DataFrame Pandas.
 
-            TACHES DE NETTOYAGE OBLIGATOIRES : Au début de ta fonction `transform_data`, tu DOIS effectuer les opérations de nettoyage suivantes sur chaque DataFrame reçu dans `dfs`:
-            1. Pour toute colonne contenant 'date' dans son nom, tu dois la convertir en datetime UTC de manière robuste. Utilise `pd.to_datetime(df[col], errors='coerce')` puis gère la localisation en UTC.
-            2. Pour les colonnes numériques, convertis-les avec `pd.to_numeric(df[col], errors='coerce')`.
-
             ---
             RÈGLE FONDAMENTALE SUR L'ACCÈS AUX DONNÉES :
             Tu ne dois JAMAIS tenter d'accéder à des champs de modèles liés qui n'ont pas été explicitement listés dans le schéma fourni. Ton code doit fonctionner **uniquement** avec les colonnes présentes dans les dataframes du dictionnaire `dfs`.
             - **Exemple de ce qu'il ne faut PAS faire :** Pour un DataFrame `account_move_line_df`, le code NE DOIT PAS faire `df['move_id']['state']` ou chercher un champ inventé comme `parent_state`. CELA PROVOQUERA UNE ERREUR.
-            - **Exemple de ce qu'il FAUT faire :** Si tu as besoin de l'état de la facture, ton plan d'extraction initial (`models_and_fields`) DOIT inclure le modèle `account.move` avec le champ `state`. Ensuite, dans ton code Python, tu DOIS effectuer une jointure explicite : `pd.merge(account_move_line_df, account_move_df, left_on='move_id', right_on='id')`.
+            - **Exemple de ce qu'il FAUT faire :** Si tu as besoin de l'état de la facture, ton plan d'extraction initial (`models_and_fields`) DOIT inclure le modèle `account.move` avec le champ `state`. Ensuite, dans ton code Python, tu DOIS effectuer une jointure explicite : `lookup(account_move_line_df, 'move_id', dfs['account.move'], ['state'])` (voir RÈGLE SUR LES JOINTURES).
             ---
 
+            RÈGLE SUR LES FILTRES ("domains") :
+            La valeur de "domains" est un dictionnaire {nom_du_modèle: domaine Odoo} qui permet de filtrer les enregistrements directement dans Odoo, avant leur téléchargement.
+            - Un domaine est une liste de conditions `[champ, opérateur, valeur]` (notation Odoo, éventuellement combinées avec '&', '|', '!' en notation préfixée). Exemple pour les factures clients de 2024 : `[["move_type", "=", "out_invoice"], ["invoice_date", ">=", "2024-01-01"], ["invoice_date", "<=", "2024-12-31"]]`.
+            - Utilise UNIQUEMENT des champs stockés présents dans le schéma fourni. Les dates s'écrivent 'YYYY-MM-DD' et les dates-heures 'YYYY-MM-DD HH:MM:SS'.
+            - Ne mets un domaine que pour les modèles dont les filtres demandés par l'utilisateur peuvent s'exprimer ainsi ; sinon omets le modèle ou utilise `[]`.
+            - Les domaines sont une optimisation : ton code `transform_data` doit rester correct même s'ils ne sont pas appliqués (garde les filtres pandas équivalents).
+
+            TYPES DES DONNÉES REÇUES : les DataFrames de `dfs` sont déjà typés d'après Odoo, aucun nettoyage n'est nécessaire. Les ids et many2one sont des entiers nullables (`Int32`/`Int64`), les champs selection sont de type `category` (utilise `observed=True` dans tes `groupby`), les dates et dates-heures sont en `datetime64[ns, UTC]`, les montants en `float64` et les textes en `object`. Les valeurs vides d'Odoo (`False`) sont déjà des valeurs manquantes (NA/None), sauf pour les champs booléens. N'appelle PAS `pd.to_datetime`, `pd.to_numeric` ni `tz_localize` sur ces colonnes et ne teste jamais `== False` pour détecter une valeur vide : utilise `isna()` / `notna()`.
+
+            RÈGLE SUR LES AGRÉGATIONS ("aggregations") :
+            Quand l'utilisateur ne veut que des totaux ou agrégats d'un modèle (ex : somme des ventes par commercial et par mois), fais calculer l'agrégation par Odoo : la valeur de "aggregations" est un dictionnaire {nom_du_modèle: {"groupby": [...], "aggregates": [...]}}.
+            - "groupby" : champs de regroupement, avec une granularité pour les dates (`day`, `week`, `month`, `quarter`, `year`). Exemple : `["invoice_user_id", "invoice_date:month"]`.
+            - "aggregates" : `champ:fonction` avec la fonction parmi `sum`, `avg`, `min`, `max` (champs numériques), `count`, `count_distinct`. Exemple : `["amount_untaxed:sum"]`.
+            - Pour un modèle agrégé, `dfs[nom_du_modèle]` contient alors directement une ligne par groupe avec les colonnes : chaque champ de regroupement (l'id pour un many2one, le début de la période en datetime UTC pour une date), `<champ>_<fonction>` pour chaque agrégat (ex : `amount_untaxed_sum`) et `__count` (nombre d'enregistrements du groupe). Ton code ne doit PAS refaire l'agrégation de ce modèle.
+            - N'utilise une agrégation que si aucune ligne détaillée de ce modèle n'est nécessaire ; sinon mets `{}`.
+
+            RÈGLE SUR LES JOINTURES : pour récupérer des champs d'un modèle lié par un many2one, n'utilise PAS `pd.merge` mais la fonction `lookup`, déjà disponible (ne l'importe pas et ne la redéfinis pas) :
+            `lookup(df, colonne_many2one, dfs[modele_lie], champs)` renvoie `df` avec, pour chaque ligne, les `champs` de l'enregistrement lié ; `champs` est une liste (colonnes nommées `<colonne_many2one>_<champ>`) ou un dictionnaire {champ: nom_de_colonne}. Exemple : `lignes = lookup(lignes, 'partner_id', dfs['res.partner'], {'name': 'client', 'country_id': 'pays_id'})`. Les DataFrames des modèles liés sont déjà indexés par id : la jointure est immédiate et conserve les lignes de `df`. Pour enchaîner (pays du client), refais un `lookup` sur la nouvelle colonne. Les champs many2many et one2many sont du texte : ne joins jamais sur eux.
+
+            RÈGLE SUR L'EXÉCUTION EN FLUX ("streaming_fact_model") :
+            Si ta transformation est purement ligne à ligne sur un modèle principal (filtres, renommages, colonnes calculées, jointures many2one vers les autres modèles), sans agrégation, tri, dédoublonnage, ni calcul qui dépend d'autres lignes de ce modèle, donne le nom de ce modèle comme valeur de "streaming_fact_model" : `transform_data` sera alors appelée sur des lots successifs de ce modèle, avec les autres modèles complets. Sinon, mets `null`.
+
             RÈGLE CRUCIALE SUR LES DATES : Pour toute comparaison ou création de date, utilise OBLIGATOIREMENT `pd.Timestamp` avec un fuseau horaire UTC (`tz='UTC'`).
 
             RÈGLE CRUCIALE SUR LE CODE PANDAS : N'utilise JAMAIS `DataFrame.append()`. Utilise OBLIGATOIREMENT `pd.concat()`.
@@ -107,14 +336,56 @@ def get_ai_plan(user_prompt, document_text=None):
             final_user_prompt = f"{full_prompt_for_ai}\n\nSchéma des modèles pertinents:\n{schema_str}"
             st.session_state.conversation_history = [{"role": "system", "content": system_message_step2}, {"role": "user", "content": final_user_prompt}]
             
-            response_step2 = client.chat.completions.create(
-                model="gpt-4o",
-                messages=st.session_state.conversation_history,
-                response_format={"type": "json_object"}
+            step2_key = plan_cache.content_key(conn_key, 'plan', system_message_step2, normalized_request, targeted_schema)
+            sections = {
+                'system': system_message_step2, 'request': user_prompt,
+                'document': document_text, 'schema': schema_str,
+            }
+            with llm_metrics.track('plan.transform', "gpt-4o", sections=sections, **metrics_context) as metrics:
+                ai_response_text = plan_cache.get(step2_key) if use_cache else None
+                from_cache = ai_response_text is not None
+                metrics.cache_hit(from_cache)
+                if not from_cache:
+                    ai_response_text = stream_with_progress(
+                        st.session_state.conversation_history, st.empty(), "Rédaction du plan", metrics
+                    )
+            ai_plan = json.loads(ai_response_text)
+            # Réponse brute mise en cache : validation et élagage sont refaits sur le schéma actuel
+            if not from_cache:
+                plan_cache.store(step2_key, ai_response_text)
+            ai_plan['from_cache'] = from_cache
+
+            # Les domaines ne sont transmis à Odoo qu'après validation contre le schéma réel
+            models_fields = ai_plan.get('models_and_fields') or {}
+            prefetcher.wait()
+            plan_schema = schema_cache.get_fields(
+                models_proxy, db, uid, password_decrypted, conn_key,
+                sorted(set(models_fields) | set(fields_by_model))
+            )
+            ai_plan['domains'], rejected_domains = plan_validation.validate_plan_domains(
+                ai_plan.get('domains'), models_fields, plan_schema
+            )
+            for model_name, errors in rejected_domains.items():
+                st.warning(f"Filtre ignoré pour `{model_name}` (les données seront filtrées après extraction) : {'; '.join(errors)}")
+
+            ai_plan['aggregations'], rejected_aggregations = plan_validation.validate_plan_aggregations(
+                ai_plan.get('aggregations'), models_fields, plan_schema
+            )
+            for model_name, errors in rejected_aggregations.items():
+                st.warning(f"Agrégation ignorée pour `{model_name}` (le modèle sera extrait ligne à ligne, vérifiez le code sur un échantillon) : {'; '.join(errors)}")
+
+            # On n'extrait que les champs réellement lus par le code généré
+            ai_plan['models_and_fields'], ai_plan['pruned_fields'], _ = code_analysis.prune_unused_fields(
+                ai_plan.get('python_code'), models_fields
             )
-            ai_response_text = response_step2.choices[0].message.content
-            return json.loads(ai_response_text)
+            # Relations many2one du plan : leurs modèles cibles sont indexés par id pour `lookup`
+            ai_plan['joins'] = etl_runtime.join_graph(ai_plan['models_and_fields'], plan_schema)
+            return ai_plan
 
+    except requests.exceptions.RequestException as net_err:
+        logging.error(f"--- ERREUR RÉSEAU DÉTECTÉE ---\n{traceback.format_exc()}")
+        st.error(f"Erreur de connexion réseau au serveur Odoo : {net_err}. Le serveur est peut-être inaccessible ou bloqué par un pare-feu.")
+        return None
     except xmlrpc.client.ProtocolError as p_err:
         st.error(f"Erreur de protocole Odoo ({p_err.errcode}): {p_err.errmsg}")
         logging.error(f"--- ODOO PROTOCOL ERROR in get_ai_plan ---\n{traceback.format_exc()}")
@@ -127,24 +398,79 @@ def get_ai_plan(user_prompt, document_text=None):
         return None
 
 
+@contextmanager
+def _transform_controls():
+    """
+    Affiche la durée de la transformation en cours et un bouton pour l'arrêter ; fournit le
+    `on_wait` de `code_executor`. Chaque mise à jour de la durée est un point où Streamlit traite
+    un arrêt ou une relance du script (ce bouton, le « Stop » de Streamlit, un autre widget) :
+    l'exception qu'il lève alors tue le processus de transformation.
+    """
+    status = st.empty()
+    stop = st.empty()
+    stop.button("⏹️ Arrêter la transformation", key="stop_transform_input")
+    started = time.monotonic()
+    shown_seconds = [-1]
+
+    def on_wait(_call_seconds):
+        # Durée totale (en flux, chaque lot est un appel distinct), affichée une fois par seconde
+        elapsed_seconds = int(time.monotonic() - started)
+        if elapsed_seconds != shown_seconds[0]:
+            shown_seconds[0] = elapsed_seconds
+            status.caption(f"⏳ Transformation en cours depuis {elapsed_seconds} s...")
+
+    try:
+        yield on_wait
+    finally:
+        status.empty()
+        stop.empty()
+
+
 def run_ai_code(ai_python_code, dataframes):
-    """Exécute le code python généré par l'IA."""
-    exec_scope = {'pd': pd, 'dfs': dataframes}
+    """
+    Exécute le code python généré par l'IA dans un processus isolé, limité en temps CPU et
+    en mémoire (voir `code_executor`), que l'utilisateur peut arrêter.
+    """
     try:
-        exec(ai_python_code, exec_scope)
-        if 'transform_data' not in exec_scope:
-            st.error("Erreur critique de l'IA : La fonction 'transform_data' est manquante.")
-            st.code(ai_python_code, language='python')
-            return None
-            
-        transform_function = exec_scope['transform_data']
-        result_df = transform_function(dataframes)
-        return result_df
-    except Exception as e:
+        with _transform_controls() as on_wait:
+            return code_executor.default_pool.run(ai_python_code, dataframes, on_wait=on_wait)
+    except code_executor.TransformError as e:
         st.error(f"Le code de l'IA a échoué lors de son exécution : {e}")
         st.code(ai_python_code, language='python')
         return None
 
+def run_ai_code_streaming(ai_python_code, dimension_frames, fact_model, fact_chunks, fact_columns=None, on_result=None):
+    """
+    Exécute le code python généré par l'IA lot par lot sur le modèle principal `fact_model`
+    (voir `etl_runtime.stream_transform`), pendant que ses lots sont encore extraits d'Odoo.
+    Les dimensions sont chargées une seule fois dans le processus isolé (voir `code_executor`),
+    puis chaque lot du modèle principal lui est transmis.
+    `on_result(lignes_lues, lot_résultat, lignes_produites)` est appelé après chaque lot.
+    """
+    result_chunks = []
+    rows_read = 0
+    rows_out = 0
+    try:
+        with _transform_controls() as on_wait, \
+                code_executor.default_pool.session(ai_python_code, dimension_frames, on_wait=on_wait) as session:
+            # `{}` : les dimensions sont déjà chargées par la session, seul le lot lui est transmis
+            for chunk_rows, result_chunk in etl_runtime.stream_transform(
+                lambda batch_dfs: session.run(fact_model, batch_dfs[fact_model]),
+                {}, fact_model, fact_chunks, fact_columns
+            ):
+                rows_read += chunk_rows
+                if result_chunk is None:
+                    continue
+                result_chunks.append(result_chunk)
+                rows_out += len(result_chunk)
+                if on_result:
+                    on_result(rows_read, result_chunk, rows_out)
+        return etl_runtime.concat_frames(result_chunks, columns=list(result_chunks[0].columns) if result_chunks else None)
+    except Exception as e:
+        st.error(f"Le code de l'IA a échoué lors de son exécution (après {rows_read} lignes de `{fact_model}`) : {e}")
+        st.code(ai_python_code, language='python')
+        return None
+
 # ==============================================================================
 # ▼▼▼ FONCTIONS POUR L'ASSISTANT DE VISUALISATION ▼▼▼
 # ==============================================================================
@@ -158,14 +484,17 @@ def get_ai_visualization_suggestion(user_prompt: str) -> dict:
         # Prompt à définir dans prompts.py si nécessaire
         prompt = f"Basé sur cet objectif: '{user_prompt}', suggère le meilleur outil de BI et type de graphique en JSON."
         
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "Tu es un expert en Business Intelligence. Réponds en JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"}
-        )
+        with llm_metrics.track('viz.suggestion', "gpt-4o", sections={'request': prompt}, **_metrics_context()) as metrics:
+            response = llm_client.create_completion(
+                get_client(), metrics,
+                model="gpt-4o",
+                messages=[
+                    {"role": "system", "content": "Tu es un expert en Business Intelligence. Réponds en JSON."},
+                    {"role": "user", "content": prompt}
+                ],
+                response_format={"type": "json_object"}
+            )
+            metrics.usage(getattr(response, 'usage', None))
         suggestion = json.loads(response.choices[0].message.content)
         return suggestion
     except Exception as e:
@@ -191,13 +520,17 @@ def get_ai_visualization_guide(context: dict) -> str:
             columns=context.get("columns")
         )
         
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "Tu es un formateur expert en Business Intelligence."},
-                {"role": "user", "content": prompt}
-            ]
-        )
+        sections = {'request': prompt, 'columns': str(context.get("columns"))}
+        with llm_metrics.track('viz.guide', "gpt-4o", sections=sections, **_metrics_context()) as metrics:
+            response = llm_client.create_completion(
+                get_client(), metrics,
+                model="gpt-4o",
+                messages=[
+                    {"role": "system", "content": "Tu es un formateur expert en Business Intelligence."},
+                    {"role": "user", "content": prompt}
+                ]
+            )
+            metrics.usage(getattr(response, 'usage', None))
         guide = response.choices[0].message.content
         return guide
     except Exception as e:
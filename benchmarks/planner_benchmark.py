@@ -0,0 +1,314 @@
+# benchmarks/planner_benchmark.py
+"""
+Mesure de bout en bout du planificateur (`ai_services.get_ai_plan`) sans Odoo ni OpenAI :
+latence totale, délai avant le premier fragment, jetons, taille des sections du prompt
+(liste des modèles, schéma JSON, document), relances et nombre d'appels RPC.
+
+- Odoo est remplacé par une base synthétique (`--models` modèles, dont les modèles comptables
+  et commerciaux usuels avec leurs libellés français), avec une latence par appel (`--odoo-latency`) ;
+- l'IA est fournie par `llm_client` (`--llm`) : `local` (remplaçant déterministe, défaut),
+  `replay` (fixtures enregistrées), `record` (API OpenAI réelle, réponses enregistrées) ou `openai`.
+
+Chaque demande est planifiée trois fois : à froid (caches vides), schéma en cache (plan régénéré)
+et plan en cache. Le code de sortie est non nul si une planification échoue (utilisable en CI).
+
+Exemples :
+    python benchmarks/planner_benchmark.py
+    python benchmarks/planner_benchmark.py --models 2000 --odoo-latency 0.08 --llm-first-token 0.6 --llm-tps 80
+    OPENAI_API_KEY=... python benchmarks/planner_benchmark.py --llm record
+    python benchmarks/planner_benchmark.py --llm replay --json resultats.json
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_REQUESTS = [
+    "Titre: Chiffre d'affaires par client\nSujet principal: factures clients validées de 2024\n"
+    "Colonnes: client, pays du client, mois de facturation, montant HT",
+    "Titre: Ventes par produit\nSujet principal: lignes de bons de commande confirmés\n"
+    "Colonnes: produit, quantité commandée, sous-total, vendeur",
+    "Titre: Portefeuille clients\nSujet principal: contacts clients\nColonnes: nom, ville, pays, email",
+]
+
+# Modèles usuels : {modèle: (libellé, {champ: (type, libellé[, modèle lié])})}
+CORE_MODELS = {
+    'account.move': ("Pièce comptable", {
+        'name': ('char', "Numéro"), 'partner_id': ('many2one', "Partenaire", 'res.partner'),
+        'invoice_date': ('date', "Date de facturation"), 'move_type': ('selection', "Type"),
+        'state': ('selection', "Statut"), 'amount_untaxed': ('monetary', "Montant HT"),
+        'amount_total': ('monetary', "Total"), 'invoice_user_id': ('many2one', "Vendeur", 'res.users'),
+        'currency_id': ('many2one', "Devise", 'res.currency'),
+        'line_ids': ('one2many', "Écritures comptables", 'account.move.line'),
+    }),
+    'account.move.line': ("Écriture comptable", {
+        'move_id': ('many2one', "Pièce comptable", 'account.move'), 'name': ('char', "Libellé"),
+        'account_id': ('many2one', "Compte", 'account.account'), 'partner_id': ('many2one', "Partenaire", 'res.partner'),
+        'product_id': ('many2one', "Produit", 'product.product'), 'quantity': ('float', "Quantité"),
+        'debit': ('monetary', "Débit"), 'credit': ('monetary', "Crédit"), 'date': ('date', "Date"),
+    }),
+    'account.account': ("Compte", {'code': ('char', "Code"), 'name': ('char', "Nom du compte")}),
+    'res.partner': ("Contact", {
+        'name': ('char', "Nom"), 'email': ('char', "Courriel"), 'city': ('char', "Ville"),
+        'country_id': ('many2one', "Pays", 'res.country'), 'customer_rank': ('integer', "Rang client"),
+        'is_company': ('boolean', "Est une société"),
+    }),
+    'res.country': ("Pays", {'name': ('char', "Nom du pays"), 'code': ('char', "Code du pays")}),
+    'res.currency': ("Devise", {'name': ('char', "Devise"), 'rate': ('float', "Taux actuel")}),
+    'res.users': ("Utilisateur", {'name': ('char', "Nom"), 'login': ('char', "Identifiant")}),
+    'product.product': ("Variante de produit", {
+        'name': ('char', "Nom"), 'default_code': ('char', "Référence interne"),
+        'list_price': ('float', "Prix de vente"), 'categ_id': ('many2one', "Catégorie de produits", 'product.category'),
+    }),
+    'product.category': ("Catégorie de produits", {'name': ('char', "Nom")}),
+    'sale.order': ("Bon de commande", {
+        'name': ('char', "Référence de la commande"), 'partner_id': ('many2one', "Client", 'res.partner'),
+        'date_order': ('datetime', "Date de commande"), 'state': ('selection', "Statut"),
+        'user_id': ('many2one', "Vendeur", 'res.users'), 'amount_untaxed': ('monetary', "Montant HT"),
+        'order_line': ('one2many', "Lignes de la commande", 'sale.order.line'),
+    }),
+    'sale.order.line': ("Ligne de bon de commande", {
+        'order_id': ('many2one', "Référence de la commande", 'sale.order'),
+        'product_id': ('many2one', "Produit", 'product.product'), 'product_uom_qty': ('float', "Quantité"),
+        'price_unit': ('float', "Prix unitaire"), 'price_subtotal': ('monetary', "Sous-total"),
+        'salesman_id': ('many2one', "Vendeur", 'res.users'),
+    }),
+}
+COMMON_FIELDS = {
+    'id': ('integer', "ID"), 'display_name': ('char', "Nom affiché"),
+    'create_date': ('datetime', "Créé le"), 'write_date': ('datetime', "Dernière mise à jour le"),
+}
+FILLER_TYPES = ('char', 'integer', 'float', 'date', 'selection', 'boolean', 'text', 'many2one')
+
+
+def synthetic_schema(model_count, fields_per_model):
+    """Modèles usuels complétés par des modèles techniques jusqu'à `model_count` modèles."""
+    schema = {}
+    for model_name, (label, fields) in CORE_MODELS.items():
+        schema[model_name] = (label, {**COMMON_FIELDS, **fields})
+    for position in range(max(0, model_count - len(schema))):
+        fields = dict(COMMON_FIELDS)
+        for field_position in range(fields_per_model):
+            field_type = FILLER_TYPES[field_position % len(FILLER_TYPES)]
+            relation = ('res.partner',) if field_type == 'many2one' else ()
+            fields[f"x_field_{field_position}"] = (field_type, f"Champ technique {field_position}", *relation)
+        schema[f"x_module{position // 10}.object{position % 10}"] = (f"Objet technique {position}", fields)
+    return schema
+
+
+class SyntheticOdoo:
+    """Répond aux appels de lecture du schéma comme `odoo_client.OdooClient`, avec une latence fixe."""
+
+    def __init__(self, schema, latency):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.model_rows = [
+            {'id': position, 'model': model_name, 'name': label}
+            for position, (model_name, (label, _)) in enumerate(schema.items(), start=1)
+        ]
+        self.field_rows = []
+        for model_name, (_, fields) in schema.items():
+            for field_name, (field_type, label, *relation) in fields.items():
+                self.field_rows.append({
+                    'id': len(self.field_rows) + 1, 'model': model_name, 'name': field_name, 'ttype': field_type,
+                    'field_description': label, 'relation': relation[0] if relation else False,
+                    'store': field_name != 'display_name', 'required': field_name == 'id',
+                })
+
+    def execute_kw(self, db, uid, password, model, method, args, kwargs=None):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        kwargs = kwargs or {}
+        domain = args[0] if args else []
+        if model == 'ir.module.module':
+            return [{'name': 'base', 'latest_version': '17.0.1.3'}]
+        if model == 'res.users':
+            return [{'id': uid, 'lang': 'fr_FR'}]
+        if model == 'ir.model':
+            return self.model_rows
+        if model == 'ir.model.fields':
+            rows = self.field_rows
+            for field_path, operator, value in domain:
+                if operator == 'in':
+                    rows = [row for row in rows if row[field_path] in value]
+                elif operator == '>':
+                    rows = [row for row in rows if row[field_path] > value]
+            return rows[:kwargs['limit']] if kwargs.get('limit') else rows
+        return []
+
+
+class _Placeholder:
+    def caption(self, text):
+        pass
+
+    def empty(self):
+        pass
+
+
+class _SessionState(dict):
+    __getattr__ = dict.get
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+
+class HeadlessStreamlit:
+    """Remplace `streamlit` dans `ai_services` : état de session en mémoire, messages conservés."""
+
+    def __init__(self):
+        self.session_state = _SessionState()
+        self.secrets = {}
+        self.messages = []
+
+    @contextmanager
+    def spinner(self, text=None):
+        yield
+
+    def empty(self):
+        return _Placeholder()
+
+    def caption(self, text):
+        pass
+
+    def warning(self, text):
+        self.messages.append(('warning', text))
+
+    def error(self, text):
+        self.messages.append(('error', text))
+
+    def code(self, text, language=None):
+        pass
+
+
+def _configure_environment(args):
+    """Variables lues à l'import des modules : caches et journal dans un dossier temporaire."""
+    workdir = tempfile.mkdtemp(prefix="planner_benchmark_")
+    os.environ['CACHE_DIR'] = os.path.join(workdir, 'cache')
+    os.environ['LLM_METRICS_LOG'] = os.path.join(workdir, 'llm_metrics.jsonl')
+    os.environ['LLM_CLIENT'] = args.llm
+    os.environ['LLM_LOCAL_FIRST_TOKEN_SECONDS'] = str(args.llm_first_token)
+    os.environ['LLM_LOCAL_TOKENS_PER_SECOND'] = str(args.llm_tps)
+    os.environ['LLM_RETRY_BACKOFF_SECONDS'] = str(args.retry_backoff)
+    if args.realtime:
+        os.environ['LLM_REPLAY_REALTIME'] = '1'
+    if args.fixtures:
+        os.environ['LLM_FIXTURES_DIR'] = os.path.abspath(args.fixtures)
+    sys.path.insert(0, REPO_ROOT)
+
+
+def _measure(ai_services, llm_metrics, odoo, headless, phase, request, use_cache):
+    """Une planification : durée, appels RPC et mesures des appels à l'IA qu'elle a produits."""
+    before = len(llm_metrics.load())
+    calls_before = odoo.calls
+    errors_before = len([message for message in headless.messages if message[0] == 'error'])
+    started = time.perf_counter()
+    plan = ai_services.get_ai_plan(request, use_cache=use_cache)
+    elapsed = time.perf_counter() - started
+    # Valeurs absentes (NaN du DataFrame) retirées : `record.get` renvoie alors None
+    records = [
+        {key: value for key, value in record.items() if not (isinstance(value, float) and math.isnan(value))}
+        for record in llm_metrics.load().iloc[before:].to_dict('records')
+    ]
+
+    def total(column):
+        return int(sum(record.get(column) or 0 for record in records))
+
+    step1 = [record for record in records if record['operation'] == 'plan.models' and not record.get('cache_hit')]
+    step2 = [record for record in records if record['operation'] == 'plan.transform']
+    return {
+        'phase': phase,
+        'request': request.splitlines()[0][:40],
+        'ok': plan is not None,
+        'errors': [text for level, text in headless.messages[errors_before:] if level == 'error'],
+        'total_s': round(elapsed, 3),
+        'llm_calls': len([record for record in records if not record.get('cache_hit')]),
+        'cache_hits': len([record for record in records if record.get('cache_hit')]),
+        'retries': total('retries'),
+        'prompt_tokens': total('prompt_tokens'),
+        'completion_tokens': total('completion_tokens'),
+        'first_token_s': step1[0].get('first_token_s') if step1 else None,
+        'models_chars': int(max((record.get('section_models') or 0 for record in step1), default=0)),
+        'schema_chars': int(max((record.get('section_schema') or 0 for record in step2), default=0)),
+        'odoo_calls': odoo.calls - calls_before,
+        'planned_models': sorted((plan or {}).get('models_and_fields') or {}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hors ligne du planificateur (get_ai_plan).")
+    parser.add_argument('--llm', default='local', choices=['local', 'replay', 'record', 'openai'])
+    parser.add_argument('--fixtures', help="Dossier des fixtures (défaut : benchmarks/fixtures/llm).")
+    parser.add_argument('--realtime', action='store_true', help="Mode replay : reproduire les délais enregistrés.")
+    parser.add_argument('--llm-first-token', type=float, default=0.0, help="Mode local : délai du premier fragment (s).")
+    parser.add_argument('--llm-tps', type=float, default=0.0, help="Mode local : jetons par seconde (0 = immédiat).")
+    parser.add_argument('--fail-first', type=int, default=0, help="Mode local : appels en erreur transitoire simulée.")
+    parser.add_argument('--retry-backoff', type=float, default=0.0, help="Attente avant la première relance (s).")
+    parser.add_argument('--models', type=int, default=300, help="Nombre de modèles de la base synthétique.")
+    parser.add_argument('--fields', type=int, default=40, help="Champs par modèle technique synthétique.")
+    parser.add_argument('--odoo-latency', type=float, default=0.05, help="Latence de chaque appel RPC (s).")
+    parser.add_argument('--request', action='append', help="Demande à planifier (répétable).")
+    parser.add_argument('--repeat', type=int, default=1, help="Planifications par phase et par demande.")
+    parser.add_argument('--json', help="Écrit les mesures détaillées dans ce fichier.")
+    args = parser.parse_args()
+
+    _configure_environment(args)
+    import ai_services
+    import kms_services
+    import llm_client
+    import llm_metrics
+    import odoo_client
+
+    odoo = SyntheticOdoo(synthetic_schema(args.models, args.fields), args.odoo_latency)
+    headless = HeadlessStreamlit()
+    ai_services.st = headless
+    odoo_client.get_client = lambda *client_args, **client_kwargs: odoo
+    kms_services.decrypt_password = lambda encrypted_password: 'benchmark'
+    if args.llm == 'local':
+        ai_services.client = llm_client.LocalClient(fail_first=args.fail_first)
+    headless.session_state.update({
+        'conn_details': {'url': 'https://odoo.benchmark.invalid', 'db': 'benchmark', 'encrypted_password': b''},
+        'uid': 2,
+        'firebase_uid': 'benchmark',
+    })
+
+    results = []
+    for request in args.request or DEFAULT_REQUESTS:
+        results.append(_measure(ai_services, llm_metrics, odoo, headless, 'à froid', request, use_cache=True))
+        for _ in range(args.repeat):
+            results.append(_measure(ai_services, llm_metrics, odoo, headless, 'schéma en cache', request, use_cache=False))
+        for _ in range(args.repeat):
+            results.append(_measure(ai_services, llm_metrics, odoo, headless, 'plan en cache', request, use_cache=True))
+
+    print(f"Base synthétique : {args.models} modèles, latence RPC {args.odoo_latency * 1000:.0f} ms, IA : {args.llm}")
+    columns = ['phase', 'request', 'total_s', 'first_token_s', 'llm_calls', 'cache_hits', 'retries',
+               'prompt_tokens', 'completion_tokens', 'models_chars', 'schema_chars', 'odoo_calls']
+    print(' | '.join(columns))
+    for result in results:
+        print(' | '.join('-' if result[column] is None else str(result[column]) for column in columns))
+    for phase in ('à froid', 'schéma en cache', 'plan en cache'):
+        durations = [result['total_s'] for result in results if result['phase'] == phase and result['ok']]
+        if durations:
+            print(f"{phase} : médiane {statistics.median(durations):.3f} s sur {len(durations)} planification(s)")
+
+    failures = [result for result in results if not result['ok']]
+    for result in failures:
+        print(f"ÉCHEC [{result['phase']}] {result['request']} : {'; '.join(result['errors'])}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
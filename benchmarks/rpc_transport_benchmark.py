@@ -0,0 +1,134 @@
+# benchmarks/rpc_transport_benchmark.py
+"""
+Compare XML-RPC et JSON-RPC sur un lot identique de `search_read` (2000 enregistrements par défaut) :
+taille de la réponse (octets) et temps de décodage côté Python.
+
+Deux modes :
+- hors ligne (par défaut) : un lot synthétique imitant `account.move.line` est sérialisé dans
+  les deux formats de réponse d'Odoo, puis décodé avec les mêmes parseurs que `odoo_client` ;
+- en ligne (`--url`, `--db`, `--user`, `--password`) : le même `search_read` est envoyé aux
+  points d'entrée `/xmlrpc/2/object` et `/jsonrpc` du serveur, et les réponses brutes sont mesurées.
+
+Exemples :
+    python benchmarks/rpc_transport_benchmark.py
+    python benchmarks/rpc_transport_benchmark.py --url https://mon.odoo.com --db prod \\
+        --user admin@example.com --password $ODOO_API_KEY --model account.move.line
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+import xmlrpc.client
+
+import requests
+
+
+def synthetic_batch(size, seed=42):
+    """Lot représentatif d'un `search_read` sur `account.move.line`."""
+    rng = random.Random(seed)
+    records = []
+    for record_id in range(1, size + 1):
+        records.append({
+            'id': record_id,
+            'move_id': [rng.randint(1, size // 3 + 1), f"INV/2024/{rng.randint(1, 99999):05d}"],
+            'partner_id': [rng.randint(1, 500), f"Client {rng.randint(1, 500)}"] if rng.random() > 0.1 else False,
+            'account_id': [rng.randint(1, 300), f"{rng.randint(100000, 799999)} Compte"],
+            'name': f"Ligne de facture {record_id}" if rng.random() > 0.2 else False,
+            'date': f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            'debit': round(rng.uniform(0, 10000), 2),
+            'credit': round(rng.uniform(0, 10000), 2),
+            'balance': round(rng.uniform(-10000, 10000), 2),
+            'quantity': float(rng.randint(1, 50)),
+            'parent_state': rng.choice(['draft', 'posted', 'cancel']),
+            'tax_ids': [rng.randint(1, 40) for _ in range(rng.randint(0, 3))],
+            'reconciled': rng.random() > 0.5,
+        })
+    return records
+
+
+def decode_xmlrpc(body):
+    """Décodage identique à `odoo_client.PooledTransport`."""
+    parser, unmarshaller = xmlrpc.client.getparser()
+    parser.feed(body)
+    parser.close()
+    return unmarshaller.close()[0]
+
+
+def decode_jsonrpc(body):
+    return json.loads(body)['result']
+
+
+def time_decode(decoder, body, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decoder(body)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def offline_bodies(size):
+    records = synthetic_batch(size)
+    xml_body = xmlrpc.client.dumps((records,), methodresponse=True, allow_none=True).encode('utf-8')
+    json_body = json.dumps({'jsonrpc': '2.0', 'id': 1, 'result': records}).encode('utf-8')
+    return xml_body, json_body
+
+
+def live_bodies(args):
+    url = args.url.rstrip('/')
+    session = requests.Session()
+    uid = xmlrpc.client.ServerProxy(f'{url}/xmlrpc/2/common').authenticate(args.db, args.user, args.password, {})
+    if not uid:
+        raise SystemExit("Échec de l'authentification Odoo.")
+    call_args = [args.db, uid, args.password, args.model, 'search_read', [[]],
+                 {'fields': args.fields.split(',') if args.fields else [], 'limit': args.size, 'order': 'id asc'}]
+
+    xml_request = xmlrpc.client.dumps(tuple(call_args), 'execute_kw', allow_none=True).encode('utf-8')
+    xml_response = session.post(f'{url}/xmlrpc/2/object', data=xml_request, headers={'Content-Type': 'text/xml'}, timeout=300)
+    xml_response.raise_for_status()
+
+    json_request = {'jsonrpc': '2.0', 'method': 'call', 'id': 1,
+                    'params': {'service': 'object', 'method': 'execute_kw', 'args': call_args}}
+    json_response = session.post(f'{url}/jsonrpc', json=json_request, timeout=300)
+    json_response.raise_for_status()
+    return xml_response.content, json_response.content
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark XML-RPC vs JSON-RPC sur un lot search_read.")
+    parser.add_argument('--size', type=int, default=2000, help="Nombre d'enregistrements du lot (défaut : 2000).")
+    parser.add_argument('--repeat', type=int, default=5, help="Nombre de décodages mesurés (médiane).")
+    parser.add_argument('--url')
+    parser.add_argument('--db')
+    parser.add_argument('--user')
+    parser.add_argument('--password')
+    parser.add_argument('--model', default='account.move.line')
+    parser.add_argument('--fields', default='', help="Champs séparés par des virgules (défaut : tous).")
+    args = parser.parse_args()
+
+    if args.url:
+        xml_body, json_body = live_bodies(args)
+        source = f"{args.url} / {args.model}"
+    else:
+        xml_body, json_body = offline_bodies(args.size)
+        source = "lot synthétique (account.move.line)"
+
+    xml_records = len(decode_xmlrpc(xml_body))
+    json_records = len(decode_jsonrpc(json_body))
+    if xml_records != json_records:
+        raise SystemExit(f"Les deux réponses ne contiennent pas le même lot ({xml_records} vs {json_records}).")
+
+    xml_time = time_decode(decode_xmlrpc, xml_body, args.repeat)
+    json_time = time_decode(decode_jsonrpc, json_body, args.repeat)
+
+    print(f"Source : {source} — {xml_records} enregistrements")
+    print(f"{'Protocole':<10} {'Octets':>12} {'Décodage (ms)':>15}")
+    print(f"{'xmlrpc':<10} {len(xml_body):>12,} {xml_time * 1000:>15.1f}")
+    print(f"{'jsonrpc':<10} {len(json_body):>12,} {json_time * 1000:>15.1f}")
+    print(f"Gain JSON-RPC : {len(xml_body) / len(json_body):.1f}x moins d'octets, "
+          f"{xml_time / json_time:.1f}x plus rapide à décoder")
+
+
+if __name__ == '__main__':
+    main()
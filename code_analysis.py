@@ -0,0 +1,328 @@
+# code_analysis.py
+"""
+Analyse statique (AST) du code `transform_data` généré par l'IA, sans l'exécuter.
+"""
+import ast
+import builtins
+
+# Méthodes pandas dont le résultat dépend de l'ensemble des lignes d'un DataFrame :
+# appliquées lot par lot, elles donneraient un résultat différent.
+CROSS_ROW_METHODS = {
+    'groupby', 'agg', 'aggregate', 'transform', 'pivot', 'pivot_table', 'crosstab', 'unstack',
+    'sum', 'mean', 'median', 'count', 'min', 'max', 'prod', 'std', 'var', 'quantile', 'describe',
+    'mode', 'nunique', 'unique', 'value_counts', 'any', 'all', 'idxmax', 'idxmin', 'corr', 'cov',
+    'sort_values', 'sort_index', 'rank', 'nlargest', 'nsmallest', 'head', 'tail', 'sample',
+    'drop_duplicates', 'duplicated', 'cumsum', 'cumprod', 'cummax', 'cummin', 'cumcount',
+    'shift', 'diff', 'pct_change', 'rolling', 'expanding', 'ewm', 'resample', 'ffill', 'bfill',
+    'iloc', 'iat', 'shape', 'size',
+}
+# Fonctions Python natives qui agrègent toutes les lignes
+CROSS_ROW_BUILTINS = {'len', 'sum', 'min', 'max', 'sorted'}
+# Jointures qui ajoutent des lignes de l'autre côté à chaque lot
+CROSS_ROW_JOIN_TYPES = {'right', 'outer', 'cross'}
+
+
+def parse_code(ai_python_code):
+    """Arbre syntaxique du code généré, ou None s'il n'est pas du Python valide."""
+    try:
+        return ast.parse(ai_python_code or '')
+    except SyntaxError:
+        return None
+
+
+def streaming_blockers(ai_python_code):
+    """
+    Raisons pour lesquelles `transform_data` ne peut pas être exécutée lot par lot
+    (liste vide si le code ne fait que des opérations ligne à ligne : filtres, renommages,
+    colonnes calculées, jointures vers des dimensions). L'analyse est volontairement prudente :
+    une agrégation sur une dimension suffit à refuser l'exécution en flux.
+    """
+    tree = parse_code(ai_python_code)
+    if tree is None:
+        return ["le code généré n'est pas du Python valide"]
+
+    blockers = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and node.attr in CROSS_ROW_METHODS:
+            blockers.append(f"`.{node.attr}` (ligne {node.lineno})")
+        elif isinstance(node, ast.Call):
+            if isinstance(node.func, ast.Name) and node.func.id in CROSS_ROW_BUILTINS:
+                blockers.append(f"`{node.func.id}()` (ligne {node.lineno})")
+            for keyword in node.keywords:
+                if not isinstance(keyword.value, ast.Constant):
+                    continue
+                if keyword.arg == 'how' and keyword.value.value in CROSS_ROW_JOIN_TYPES:
+                    blockers.append(f"jointure `how='{keyword.value.value}'` (ligne {node.lineno})")
+                elif keyword.arg == 'method' and keyword.value.value in ('ffill', 'bfill', 'pad', 'backfill'):
+                    blockers.append(f"`method='{keyword.value.value}'` (ligne {node.lineno})")
+    return list(dict.fromkeys(blockers))
+
+
+def streaming_fact_model(ai_python_code, models_fields, declared_model, aggregated_models=()):
+    """
+    Vérifie le modèle principal déclaré par l'IA (`streaming_fact_model` du plan).
+    Un modèle agrégé par Odoo (`aggregated_models`) est déjà réduit : il n'est jamais traité en flux.
+    Retourne (modèle à exécuter en flux ou None, raisons du refus).
+    """
+    if not declared_model:
+        return None, ["le plan ne désigne pas de modèle principal traité ligne à ligne"]
+    if declared_model not in (models_fields or {}):
+        return None, [f"le modèle principal `{declared_model}` n'est pas extrait par le plan"]
+    if declared_model in (aggregated_models or ()):
+        return None, [f"le modèle principal `{declared_model}` est agrégé côté serveur"]
+    blockers = streaming_blockers(ai_python_code)
+    if blockers:
+        return None, blockers
+    return declared_model, []
+
+
+# Méthodes qui ne changent pas la liste des colonnes d'un DataFrame
+COLUMN_PRESERVING_METHODS = {
+    'rename', 'sort_values', 'sort_index', 'reset_index', 'fillna', 'astype', 'round', 'copy',
+    'drop_duplicates', 'head', 'tail', 'dropna', 'query', 'set_index',
+}
+
+
+def _find_transform_function(tree):
+    for node in ast.walk(tree):
+        if isinstance(node, ast.FunctionDef) and node.name == 'transform_data':
+            return node
+    return None
+
+
+def _is_string_list(node):
+    return isinstance(node, (ast.List, ast.Tuple)) and all(
+        isinstance(e, ast.Constant) and isinstance(e.value, str) for e in node.elts
+    )
+
+
+def _is_column_mapping(node):
+    """Liste de noms de colonnes, ou dictionnaire {champ: nom} à clés littérales (`lookup`)."""
+    if isinstance(node, ast.Dict):
+        return all(isinstance(k, ast.Constant) and isinstance(k.value, str) for k in node.keys)
+    return _is_string_list(node)
+
+
+def _is_explicit_columns(node, assignments, line, frames_arg='dfs', depth=0):
+    """
+    Vrai si l'expression (évaluée à la ligne `line`) produit un DataFrame dont les colonnes
+    sont listées explicitement dans le code. Un DataFrame de `dfs` (`frames_arg`) qui atteint le
+    résultat sans projection (`dfs['modèle']`, éventuellement renommé ou filtré) n'est pas explicite.
+    """
+    if depth > 20:
+        return False
+
+    def explicit(child, child_line=line):
+        return _is_explicit_columns(child, assignments, child_line, frames_arg, depth + 1)
+
+    if isinstance(node, ast.Call):
+        func = node.func
+        function_name = func.attr if isinstance(func, ast.Attribute) else func.id if isinstance(func, ast.Name) else None
+        if function_name == 'lookup':
+            # Colonnes du DataFrame de départ, plus celles listées pour le modèle lié
+            return len(node.args) >= 4 and explicit(node.args[0]) and _is_column_mapping(node.args[3])
+        if function_name == 'merge':
+            # Les deux côtés de la jointure apportent leurs colonnes au résultat
+            if isinstance(func, ast.Attribute) and not (isinstance(func.value, ast.Name) and func.value.id == 'pd'):
+                sides = [func.value] + list(node.args[:1])
+            else:
+                sides = list(node.args[:2])
+            sides += [keyword.value for keyword in node.keywords if keyword.arg in ('left', 'right')]
+            return len(sides) == 2 and all(explicit(side) for side in sides)
+        if function_name == 'concat':
+            frames = node.args[0] if node.args else None
+            return isinstance(frames, (ast.List, ast.Tuple)) and bool(frames.elts) and all(explicit(e) for e in frames.elts)
+        if not isinstance(func, ast.Attribute):
+            return False
+        if func.attr in COLUMN_PRESERVING_METHODS:
+            return explicit(func.value)
+        if func.attr in ('agg', 'aggregate') and (node.args or node.keywords):
+            return True
+        if func.attr == 'DataFrame' and node.args and isinstance(node.args[0], ast.Dict):
+            return True
+        return False
+    if isinstance(node, ast.Subscript):
+        selector = node.slice
+        if _is_string_list(selector):
+            return True
+        if isinstance(node.value, ast.Name) and node.value.id == frames_arg:
+            # `dfs['modèle']` : DataFrame complet du modèle
+            return False
+        if isinstance(selector, ast.Constant) and isinstance(selector.value, str):
+            # Une seule colonne (Series)
+            return True
+        if isinstance(node.value, ast.Attribute) and node.value.attr == 'loc':
+            if isinstance(selector, ast.Tuple) and len(selector.elts) == 2 and _is_string_list(selector.elts[1]):
+                return True
+            return explicit(node.value.value)
+        # Filtre de lignes (`df[masque]`) : les colonnes sont celles du DataFrame filtré
+        return explicit(node.value)
+    if isinstance(node, ast.Name):
+        previous = [(lineno, value) for lineno, value in assignments.get(node.id, []) if lineno < line]
+        if previous:
+            lineno, value = previous[-1]
+            return explicit(value, lineno)
+    return False
+
+
+# Attributs et méthodes qui parcourent ou sélectionnent les colonnes sans les nommer
+DYNAMIC_COLUMN_ATTRIBUTES = {'columns', 'dtypes', 'keys', 'items', 'select_dtypes'}
+# Noms globaux du code généré qui ne désignent pas un DataFrame
+KNOWN_GLOBALS = {'pd', 'np', 'lookup'} | set(dir(builtins))
+
+
+def _is_dynamic_string(node):
+    """f-string ou concaténation de chaînes : nom de colonne calculé à l'exécution."""
+    if isinstance(node, ast.JoinedStr):
+        return True
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Mod)):
+        # `df['a'] + ' ' + df['b']` concatène des colonnes, pas des noms de colonnes
+        if any(isinstance(child, (ast.Subscript, ast.Attribute)) for child in ast.walk(node)):
+            return False
+        return any(
+            _is_dynamic_string(side) or (isinstance(side, ast.Constant) and isinstance(side.value, str))
+            for side in (node.left, node.right)
+        )
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == 'format':
+        return isinstance(node.func.value, ast.Constant) and isinstance(node.func.value.value, str)
+    return False
+
+
+def _contains_dynamic_string(node):
+    return any(_is_dynamic_string(child) for child in ast.walk(node))
+
+
+def _dynamic_column_uses(function):
+    """
+    Colonnes utilisées sans être nommées littéralement dans `transform_data` : parcours de
+    `df.columns`, `df.filter(like=...)`/`regex=`, `select_dtypes`, noms calculés (f-string,
+    concaténation), sélection par position (`iloc[:, ...]`).
+    Générateur de (ligne, expression du DataFrame concerné ou None si elle est inconnue).
+    """
+    for node in ast.walk(function):
+        if isinstance(node, ast.Attribute) and node.attr in DYNAMIC_COLUMN_ATTRIBUTES:
+            yield node.lineno, node.value
+        elif isinstance(node, ast.Subscript):
+            receiver = node.value
+            if isinstance(receiver, ast.Attribute) and receiver.attr in ('loc', 'iloc'):
+                if receiver.attr == 'iloc' and isinstance(node.slice, ast.Tuple):
+                    yield node.lineno, receiver.value
+                    continue
+                receiver = receiver.value
+            if _contains_dynamic_string(node.slice):
+                yield node.lineno, receiver
+        elif isinstance(node, ast.Call):
+            func = node.func
+            arguments = list(node.args) + [keyword.value for keyword in node.keywords]
+            if isinstance(func, ast.Attribute) and func.attr == 'filter':
+                if any(keyword.arg in ('like', 'regex') for keyword in node.keywords) or not all(
+                    _is_string_list(argument) for argument in arguments
+                ):
+                    yield node.lineno, func.value
+                    continue
+            if isinstance(func, ast.Name) and func.id == 'getattr' and len(node.args) >= 2:
+                if not isinstance(node.args[1], ast.Constant):
+                    yield node.lineno, node.args[0]
+                continue
+            if not any(_contains_dynamic_string(argument) for argument in arguments):
+                continue
+            if isinstance(func, ast.Attribute):
+                yield node.lineno, func.value
+            elif isinstance(func, ast.Name) and func.id == 'lookup':
+                for receiver in node.args[:1] + node.args[2:3]:
+                    yield node.lineno, receiver
+            elif not (isinstance(func, ast.Name) and func.id in KNOWN_GLOBALS):
+                # `print(f"...")`, `ValueError(f"...")` : sans effet sur les colonnes
+                yield node.lineno, None
+
+
+def _source_models(node, assignments, line, frames_arg='dfs', depth=0):
+    """
+    Modèles de `dfs` (`frames_arg`) dont peut provenir l'expression (évaluée à la ligne `line`),
+    ou None si son origine n'est pas déterminable (variable de boucle, `dfs` parcouru en entier...).
+    """
+    if node is None or depth > 20:
+        return None
+    models = set()
+    model_subscripts = set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Subscript) and isinstance(child.value, ast.Name) and child.value.id == frames_arg:
+            if not (isinstance(child.slice, ast.Constant) and isinstance(child.slice.value, str)):
+                return None
+            models.add(child.slice.value)
+            model_subscripts.add(id(child.value))
+        elif isinstance(child, ast.Name) and id(child) not in model_subscripts:
+            if child.id == frames_arg:
+                return None
+            if child.id in KNOWN_GLOBALS and child.id not in assignments:
+                continue
+            previous = [(lineno, value) for lineno, value in assignments.get(child.id, []) if lineno < line]
+            if not previous:
+                return None
+            lineno, value = previous[-1]
+            sources = _source_models(value, assignments, lineno, frames_arg, depth + 1)
+            if sources is None:
+                return None
+            models |= sources
+    return models
+
+
+def referenced_names(ai_python_code):
+    """Chaînes littérales et noms d'attributs du code : noms de colonnes potentiellement utilisés."""
+    tree = parse_code(ai_python_code)
+    if tree is None:
+        return None
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            names.add(node.value)
+        elif isinstance(node, ast.Attribute):
+            names.add(node.attr)
+    return names
+
+
+def prune_unused_fields(ai_python_code, models_fields):
+    """
+    Retire du plan d'extraction les champs que `transform_data` ne lit jamais (sélections de
+    colonnes, clés de jointure, renommages...). Par prudence, rien n'est retiré si un DataFrame
+    retourné n'est pas projeté sur une liste littérale de colonnes (`df[['a', 'b']]`, champs
+    listés dans `lookup`) : toutes ses colonnes pourraient se retrouver dans le résultat. Rien
+    n'est retiré non plus pour un modèle dont aucun champ n'est cité, ni pour un modèle dont les
+    colonnes sont utilisées sans être nommées (`df.columns`, `filter(like=...)`, f-string...,
+    voir `_dynamic_column_uses`) ; si le DataFrame concerné n'est pas identifiable, rien n'est retiré.
+    Retourne (plan élagué, {modèle: champs retirés}, raison si rien n'a été retiré).
+    """
+    tree = parse_code(ai_python_code)
+    function = _find_transform_function(tree) if tree else None
+    if function is None:
+        return models_fields, {}, "fonction `transform_data` introuvable"
+
+    # Affectations de chaque variable dans l'ordre du code (suffisant pour le code linéaire généré par l'IA)
+    assignments = {}
+    for node in sorted((n for n in ast.walk(function) if isinstance(n, ast.Assign)), key=lambda n: n.lineno):
+        for target in node.targets:
+            if isinstance(target, ast.Name):
+                assignments.setdefault(target.id, []).append((node.lineno, node.value))
+    returns = [node for node in ast.walk(function) if isinstance(node, ast.Return) and node.value is not None]
+    frames_arg = function.args.args[0].arg if function.args.args else 'dfs'
+    if not returns or not all(_is_explicit_columns(node.value, assignments, node.lineno, frames_arg) for node in returns):
+        return models_fields, {}, "les colonnes du résultat ne sont pas listées explicitement"
+
+    dynamic_models = set()
+    for line, receiver in _dynamic_column_uses(function):
+        models = _source_models(receiver, assignments, line, frames_arg)
+        if models is None:
+            return models_fields, {}, f"colonnes utilisées dynamiquement (ligne {line})"
+        dynamic_models |= models
+
+    names = referenced_names(ai_python_code)
+    pruned_plan = {}
+    removed = {}
+    for model_name, fields in models_fields.items():
+        kept = [field for field in fields if field in names]
+        if (fields and not kept) or model_name in dynamic_models:
+            kept = list(fields)
+        pruned_plan[model_name] = kept
+        if len(kept) < len(fields):
+            removed[model_name] = [field for field in fields if field not in kept]
+    return pruned_plan, removed, None
@@ -0,0 +1,388 @@
+# code_executor.py
+"""
+Exécution isolée du code `transform_data` généré par l'IA.
+
+Le code tourne dans un pool de processus de travail (démarrés avec `spawn`, sans Streamlit) :
+une transformation lente ou gourmande ne bloque ni le GIL ni la mémoire du serveur partagé
+par toutes les sessions. Chaque tâche est limitée en temps CPU (RLIMIT_CPU), en mémoire
+(RLIMIT_AS dans le processus de travail, RSS surveillée par le processus parent) et en durée,
+et peut être interrompue par l'appelant (`on_wait`) : le processus fautif est alors tué puis
+remplacé.
+
+Les DataFrames sont transmis par fichiers Arrow IPC mappés en mémoire (les modèles déjà
+écrits sur disque par `etl_runtime.ModelFrames` sont relus directement depuis leur Parquet),
+jamais par pickle ; seuls les résultats qu'Arrow ne sait pas représenter sont picklés.
+"""
+import contextlib
+import gc
+import math
+import multiprocessing
+import os
+import pickle
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import traceback
+
+import pandas as pd
+
+import etl_runtime
+
+try:
+    import resource
+except ImportError:  # Windows : pas de limite de temps CPU
+    resource = None
+
+# Désactiver l'isolation (TRANSFORM_ISOLATED=0) exécute le code dans le processus courant
+TRANSFORM_ISOLATED = os.getenv("TRANSFORM_ISOLATED", "1").lower() in ("1", "true", "yes")
+TRANSFORM_WORKERS = int(os.getenv("TRANSFORM_WORKERS", "2"))
+TRANSFORM_CPU_SECONDS = int(os.getenv("TRANSFORM_CPU_SECONDS", "600"))
+TRANSFORM_MAX_RSS_MB = float(os.getenv("TRANSFORM_MAX_RSS_MB", "2048"))
+# Durée maximale d'un appel à `transform_data` (un lot en flux, ou la transformation entière)
+TRANSFORM_TIMEOUT_SECONDS = float(os.getenv("TRANSFORM_TIMEOUT_SECONDS", "900"))
+# Fréquence de surveillance du processus de travail
+POLL_INTERVAL_SECONDS = 0.2
+
+
+class TransformError(RuntimeError):
+    """Échec du code généré, ou tâche arrêtée pour dépassement d'une limite."""
+
+
+def _write_frame(df, path, preserve_index=False):
+    """Écrit un DataFrame en Arrow IPC (pickle en dernier recours). Retourne l'entrée du manifeste."""
+    if isinstance(df, pd.DataFrame):
+        import pyarrow as pa
+
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=preserve_index)
+            with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+            return ('arrow', path)
+        except (pa.ArrowException, TypeError, ValueError):
+            # Colonnes d'objets hétérogènes que le code généré peut produire
+            pass
+    with open(path, 'wb') as f:
+        pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return ('pickle', path)
+
+
+def _read_frame(entry):
+    kind, path = entry
+    if kind == 'parquet':
+        return etl_runtime.read_spilled_frame(path)
+    if kind == 'arrow':
+        import pyarrow as pa
+
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).read_all().to_pandas()
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _limit_cpu(cpu_seconds):
+    """Le processus reçoit SIGXCPU (et s'arrête) après `cpu_seconds` secondes CPU supplémentaires."""
+    if resource is None or not cpu_seconds:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = math.ceil(usage.ru_utime + usage.ru_stime) + int(cpu_seconds)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _address_space_bytes():
+    """Espace d'adressage du processus courant (Linux), ou None s'il n'est pas mesurable."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _limit_memory(memory_bytes):
+    """
+    Borne l'espace d'adressage (RLIMIT_AS) à sa taille actuelle plus `memory_bytes` : au-delà, les
+    allocations échouent aussitôt (MemoryError) au lieu d'attendre la surveillance du parent.
+    Sans argument, retire la limite posée pour la session précédente.
+    """
+    if resource is None:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    current = _address_space_bytes() if memory_bytes else None
+    soft = hard if current is None else current + int(memory_bytes)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+
+def _worker_main(conn):
+    """Boucle d'un processus de travail : une session (code + modèles) à la fois."""
+    state = None
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        command = message[0]
+        try:
+            if command == 'start':
+                _, ai_python_code, manifest, indexed_models, cpu_seconds, memory_bytes = message
+                state = None
+                gc.collect()
+                _limit_memory(None)
+                _limit_cpu(cpu_seconds)
+                exec_scope = {'pd': pd, 'lookup': etl_runtime.lookup}
+                exec(ai_python_code, exec_scope)
+                if 'transform_data' not in exec_scope:
+                    raise TransformError("la fonction 'transform_data' est manquante")
+                frames = {}
+                for model_name, entry in manifest.items():
+                    df = _read_frame(entry)
+                    frames[model_name] = etl_runtime.index_by_id(df) if model_name in indexed_models else df
+                exec_scope['dfs'] = frames
+                state = {'transform': exec_scope['transform_data'], 'frames': frames}
+                # Les modèles sont chargés : la limite ne porte que sur la transformation elle-même
+                _limit_memory(memory_bytes)
+                conn.send(('ok', None))
+            elif command == 'run':
+                _, fact_model, fact_entry, result_path = message
+                # Copies superficielles : une modification « inplace » ne doit pas se répéter d'un appel à l'autre
+                dfs = {model_name: df.copy(deep=False) for model_name, df in state['frames'].items()}
+                if fact_model:
+                    dfs[fact_model] = _read_frame(fact_entry)
+                result = state['transform'](dfs)
+                conn.send(('ok', _write_frame(result, result_path, preserve_index=None)))
+            elif command == 'end':
+                state = None
+                gc.collect()
+                conn.send(('ok', None))
+        except Exception as e:
+            message = str(e) if isinstance(e, TransformError) else f"{type(e).__name__}: {e}"
+            conn.send(('error', message, traceback.format_exc()))
+
+
+def _rss_bytes(pid):
+    """Mémoire résidente d'un processus (Linux), ou None si elle n'est pas mesurable."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _Worker:
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), name='transform-worker', daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class TransformSession:
+    """
+    Code généré chargé dans un processus de travail avec ses modèles : `run()` exécute
+    `transform_data`, une fois (tous les modèles) ou par lot du modèle principal.
+    """
+
+    def __init__(self, pool, worker, directory, on_wait=None):
+        self.pool = pool
+        self.worker = worker
+        self.directory = directory
+        self.on_wait = on_wait
+        self.broken = False
+        self._calls = 0
+
+    def _path(self, name):
+        self._calls += 1
+        return os.path.join(self.directory, f"{self._calls}_{name}")
+
+    def _death_reason(self):
+        exitcode = self.worker.process.exitcode
+        if exitcode == -getattr(signal, 'SIGXCPU', 0):
+            return f"temps CPU maximal dépassé ({self.pool.cpu_seconds} s)"
+        if exitcode == -signal.SIGKILL:
+            return "processus de transformation tué par le système (mémoire insuffisante ?)"
+        return f"le processus de transformation s'est arrêté (code {exitcode})"
+
+    def _call(self, message, timeout=None):
+        if self.broken:
+            raise TransformError("la session de transformation a été interrompue")
+        worker = self.worker
+        started = time.monotonic()
+        deadline = started + timeout if timeout else None
+        try:
+            worker.conn.send(message)
+            while not worker.conn.poll(POLL_INTERVAL_SECONDS):
+                if self.on_wait:
+                    # Peut lever une exception pour interrompre l'attente (arrêt du script Streamlit)
+                    self.on_wait(time.monotonic() - started)
+                if not worker.process.is_alive():
+                    worker.process.join(timeout=1)
+                    raise TransformError(self._death_reason())
+                rss = _rss_bytes(worker.process.pid)
+                if self.pool.max_rss_bytes and rss and rss > self.pool.max_rss_bytes:
+                    raise TransformError(
+                        f"mémoire maximale dépassée ({rss / 1024**2:.0f} Mo > {self.pool.max_rss_bytes / 1024**2:.0f} Mo)"
+                    )
+                if deadline and time.monotonic() > deadline:
+                    raise TransformError(f"durée maximale dépassée ({timeout:.0f} s)")
+            reply = worker.conn.recv()
+        except (EOFError, BrokenPipeError, ConnectionResetError):
+            self._kill()
+            raise TransformError(self._death_reason())
+        except BaseException:
+            # Limite dépassée, ou attente interrompue par `on_wait` : le processus est tué
+            self._kill()
+            raise
+        if reply[0] == 'error':
+            print(f"Erreur dans le code de transformation :\n{reply[2]}")
+            raise TransformError(reply[1])
+        return reply[1]
+
+    def start(self, ai_python_code, frames):
+        manifest = {}
+        indexed_models = set(getattr(frames, 'indexed_models', ()))
+        for model_name in frames:
+            spill_path = frames.spill_path(model_name) if isinstance(frames, etl_runtime.ModelFrames) else None
+            if spill_path:
+                manifest[model_name] = ('parquet', spill_path)
+                continue
+            df = frames[model_name]
+            if df.index.name == etl_runtime.ID_INDEX_NAME:
+                indexed_models.add(model_name)
+            manifest[model_name] = _write_frame(df, self._path('input.arrow'))
+        self._call(
+            ('start', ai_python_code, manifest, indexed_models, self.pool.cpu_seconds, self.pool.max_rss_bytes),
+            self.pool.timeout_seconds
+        )
+
+    def run(self, fact_model=None, fact_df=None):
+        """Résultat de `transform_data` ; `fact_df` remplace le modèle `fact_model` (exécution en flux)."""
+        fact_entry = _write_frame(fact_df, self._path('fact.arrow')) if fact_model else None
+        result_path = self._path('result.arrow')
+        try:
+            entry = self._call(('run', fact_model, fact_entry, result_path), self.pool.timeout_seconds)
+            return _read_frame(entry)
+        finally:
+            for path in (fact_entry[1] if fact_entry else None, result_path):
+                if path and os.path.exists(path):
+                    os.remove(path)
+
+    def _kill(self):
+        self.broken = True
+        self.worker.kill()
+
+
+class _LocalSession:
+    """Même interface que `TransformSession`, dans le processus courant (TRANSFORM_ISOLATED=0)."""
+
+    def start(self, ai_python_code, frames):
+        exec_scope = {'pd': pd, 'lookup': etl_runtime.lookup, 'dfs': frames}
+        try:
+            exec(ai_python_code, exec_scope)
+        except Exception as e:
+            # Même message que le processus de travail (`_worker_main`)
+            raise TransformError(f"{type(e).__name__}: {e}") from e
+        if 'transform_data' not in exec_scope:
+            raise TransformError("la fonction 'transform_data' est manquante")
+        self.transform = exec_scope['transform_data']
+        self.frames = frames
+
+    def run(self, fact_model=None, fact_df=None):
+        try:
+            if not fact_model:
+                return self.transform(self.frames)
+            dfs = {model_name: df.copy(deep=False) for model_name, df in self.frames.items()}
+            dfs[fact_model] = fact_df
+            return self.transform(dfs)
+        except Exception as e:
+            raise TransformError(f"{type(e).__name__}: {e}") from e
+
+
+class TransformPool:
+    """
+    Pool borné de processus de travail. Au-delà de `max_workers` tâches simultanées, les
+    suivantes attendent qu'un processus se libère ; un processus tué est remplacé à la demande.
+    """
+
+    def __init__(self, max_workers=None, cpu_seconds=None, max_rss_mb=None, timeout_seconds=None, isolated=None):
+        self.max_workers = max(1, max_workers or TRANSFORM_WORKERS)
+        self.cpu_seconds = TRANSFORM_CPU_SECONDS if cpu_seconds is None else cpu_seconds
+        self.max_rss_bytes = int((TRANSFORM_MAX_RSS_MB if max_rss_mb is None else max_rss_mb) * 1024 * 1024)
+        self.timeout_seconds = TRANSFORM_TIMEOUT_SECONDS if timeout_seconds is None else timeout_seconds
+        self.isolated = TRANSFORM_ISOLATED if isolated is None else isolated
+        self._context = multiprocessing.get_context('spawn')
+        self._slots = threading.BoundedSemaphore(self.max_workers)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        self._slots.acquire()
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.process.is_alive():
+                    return worker
+        try:
+            return _Worker(self._context)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, worker, healthy):
+        if healthy and worker.process.is_alive():
+            with self._lock:
+                self._idle.append(worker)
+        else:
+            worker.kill()
+        self._slots.release()
+
+    @contextlib.contextmanager
+    def session(self, ai_python_code, frames, on_wait=None):
+        """
+        Charge le code et les modèles `frames` ({modèle: DataFrame} ou `etl_runtime.ModelFrames`)
+        dans un processus de travail. Lève `TransformError` si le code échoue ou dépasse une limite.
+        `on_wait(secondes écoulées)` est appelé pendant chaque attente du processus de travail ;
+        une exception levée par `on_wait` tue le processus et interrompt la session (sans effet
+        sans isolation, où le code tourne dans le thread appelant).
+        """
+        if not self.isolated:
+            session = _LocalSession()
+            session.start(ai_python_code, frames)
+            yield session
+            return
+        directory = tempfile.mkdtemp(prefix='odoo_transform_', dir=etl_runtime.SPILL_DIR)
+        worker = self._acquire()
+        session = TransformSession(self, worker, directory, on_wait)
+        try:
+            session.start(ai_python_code, frames)
+            yield session
+            if not session.broken:
+                session._call(('end',), self.timeout_seconds)
+        finally:
+            self._release(worker, not session.broken)
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def run(self, ai_python_code, frames, on_wait=None):
+        """Exécute `transform_data(frames)` une fois et retourne son résultat."""
+        with self.session(ai_python_code, frames, on_wait) as session:
+            return session.run()
+
+    def shutdown(self):
+        with self._lock:
+            workers, self._idle = self._idle, []
+        for worker in workers:
+            worker.kill()
+
+
+# Pool partagé par toutes les sessions de l'instance
+default_pool = TransformPool()
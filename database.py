@@ -15,7 +15,7 @@ def get_firestore_client():
         st.error(f"Erreur de connexion à Firestore : {e}")
         return None
 
-def save_connection(name, url, db_name, username, encrypted_password):
+def save_connection(name, url, db_name, username, encrypted_password, protocol="xmlrpc"):
     """Sauvegarde ou met à jour une connexion Odoo pour l'utilisateur connecté dans Firestore."""
     try:
         user_id = st.session_state.get('firebase_uid')
@@ -32,7 +32,7 @@ def save_connection(name, url, db_name, username, encrypted_password):
         
         connection_data = {
             "name": name, "url": url, "db_name": db_name, "username": username,
-            "encrypted_password": encrypted_password, "timestamp": firestore.SERVER_TIMESTAMP
+            "encrypted_password": encrypted_password, "protocol": protocol, "timestamp": firestore.SERVER_TIMESTAMP
         }
 
         if existing_docs:
@@ -0,0 +1,94 @@
+# disk_cache.py
+"""
+Petit cache clé/valeur JSON sur le disque local de l'instance, avec expiration (TTL)
+et éviction LRU. Utilisé pour conserver entre les sessions Streamlit des résultats
+coûteux à recalculer (schéma Odoo, plans de l'IA...).
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+CACHE_ROOT = os.getenv("CACHE_DIR", os.path.join(tempfile.gettempdir(), "odoo_ai_transformer"))
+
+
+class JsonDiskCache:
+    """
+    Cache persistant d'un espace de noms (`namespace`) : une entrée = un fichier JSON.
+    La date de dernier accès (mtime du fichier) sert à l'éviction LRU quand `max_entries` est dépassé.
+    """
+
+    def __init__(self, namespace, ttl_seconds=None, max_entries=None, root=None):
+        self.directory = os.path.join(root or CACHE_ROOT, namespace)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def get(self, key):
+        """Retourne la valeur associée à `key`, ou None si elle est absente ou expirée."""
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('key') != key:
+            return None
+        if self.ttl_seconds is not None and time.time() - entry.get('stored_at', 0) > self.ttl_seconds:
+            self.delete(key)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry.get('value')
+
+    def set(self, key, value):
+        path = self._path(key)
+        entry = {'key': key, 'stored_at': time.time(), 'value': value}
+        # Écriture atomique : un lecteur concurrent ne voit jamais un fichier à moitié écrit
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def _evict(self):
+        if not self.max_entries:
+            return
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    path = os.path.join(self.directory, name)
+                    try:
+                        entries.append((os.path.getmtime(path), path))
+                    except OSError:
+                        continue
+            entries.sort()
+            for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
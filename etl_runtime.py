@@ -0,0 +1,759 @@
+# etl_runtime.py
+"""
+Fonctions de traitement des données Odoo partagées entre l'application Streamlit
+et la Cloud Function générée par `gcp.generate_gcp_function_code`.
+
+Ce fichier est recopié tel quel dans le `main.py` généré : il ne doit dépendre que
+de la bibliothèque standard et de pandas (pas de Streamlit, pas d'import local).
+"""
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import weakref
+import xmlrpc.client
+from collections.abc import Mapping
+
+import pandas as pd
+
+# Types de champs Odoo qui demandent une normalisation particulière
+MANY2ONE_TYPES = ('many2one',)
+X2MANY_TYPES = ('one2many', 'many2many')
+STRUCTURED_TYPES = ('json', 'properties', 'properties_definition')
+
+# Types Odoo convertis en dtypes compacts par `compact_frame`
+INTEGER_TYPES = ('integer',)
+FLOAT_TYPES = ('float', 'monetary')
+CATEGORY_TYPES = ('selection',)
+# Champs texte : Odoo renvoie False pour une valeur vide
+TEXT_TYPES = ('char', 'text', 'html', 'reference')
+DATE_FORMATS = {'date': '%Y-%m-%d', 'datetime': '%Y-%m-%d %H:%M:%S'}
+# Dtypes Arrow (pyarrow requis) plutôt que les dtypes nullables de pandas pour les colonnes numériques
+USE_ARROW_DTYPES = os.getenv("ODOO_ARROW_DTYPES", "0").lower() in ("1", "true", "yes")
+INT32_MIN, INT32_MAX = -2**31, 2**31 - 1
+
+# Agrégations calculées par Odoo (`read_group`) : fonctions et granularités de dates acceptées
+AGGREGATE_FUNCTIONS = {'sum': 'sum', 'avg': 'mean', 'min': 'min', 'max': 'max', 'count': 'count', 'count_distinct': 'nunique'}
+DATE_GRANULARITIES = {'day': 'D', 'week': 'W-SUN', 'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+
+# Mémoire allouée aux DataFrames extraits avant de basculer les modèles suivants sur disque (Parquet)
+MEMORY_BUDGET_BYTES = int(float(os.getenv("ODOO_MEMORY_BUDGET_MB", "512")) * 1024 * 1024)
+SPILL_DIR = os.getenv("ODOO_SPILL_DIR") or tempfile.gettempdir()
+
+# Nom de l'index posé sur les DataFrames des modèles liés par un many2one (voir `lookup`)
+ID_INDEX_NAME = '_odoo_id'
+
+# Métadonnées conservées pour chaque champ (mêmes clés que `fields_get`)
+FIELD_ATTRIBUTES = ['type', 'relation', 'string', 'store', 'required']
+# Nombre de modèles par requête groupée sur `ir.model.fields`
+FIELDS_BATCH_SIZE = 50
+
+# Bornes de la pagination adaptative (surchargeables par variables d'environnement)
+PAGE_MIN_SIZE = int(os.getenv("ODOO_PAGE_MIN_SIZE", "100"))
+PAGE_MAX_SIZE = int(os.getenv("ODOO_PAGE_MAX_SIZE", "20000"))
+PAGE_TARGET_SECONDS = float(os.getenv("ODOO_PAGE_TARGET_SECONDS", "4"))
+PAGE_MAX_BYTES = int(os.getenv("ODOO_PAGE_MAX_BYTES", str(16 * 1024 * 1024)))
+PAGE_MAX_RETRIES = int(os.getenv("ODOO_PAGE_MAX_RETRIES", "6"))
+# Codes HTTP renvoyés par Odoo ou un proxy quand une réponse est trop lente ou trop lourde
+RETRYABLE_HTTP_CODES = (408, 413, 502, 503, 504)
+
+
+def get_field_types(models_proxy, db, uid, password, model_name, fields=None):
+    """Retourne un dictionnaire {champ: type Odoo} à partir de `fields_get`."""
+    fields_data = models_proxy.execute_kw(
+        db, uid, password, model_name, 'fields_get',
+        [list(fields)] if fields else [], {'attributes': ['type']}
+    )
+    return {name: meta.get('type') for name, meta in fields_data.items()}
+
+
+def field_types_from_schema(fields_meta):
+    """{champ: type} à partir des métadonnées {champ: {type, relation, ...}} d'un modèle."""
+    return {name: meta.get('type') for name, meta in (fields_meta or {}).items()}
+
+
+def fetch_fields_bulk(models_proxy, db, uid, password, model_names, batch_size=FIELDS_BATCH_SIZE):
+    """
+    Définitions des champs de plusieurs modèles en une seule lecture de `ir.model.fields`
+    (découpée par lots de `batch_size` modèles) au lieu d'un `fields_get` par modèle.
+    Retourne {modèle: {champ: {type, relation, string, store, required}}}.
+    """
+    model_names = list(model_names)
+    schema = {model_name: {} for model_name in model_names}
+    for start in range(0, len(model_names), batch_size):
+        rows = models_proxy.execute_kw(
+            db, uid, password, 'ir.model.fields', 'search_read',
+            [[('model', 'in', model_names[start:start + batch_size])]],
+            {'fields': ['model', 'name', 'ttype', 'relation', 'field_description', 'store', 'required']}
+        )
+        for row in rows:
+            meta = {
+                'type': row['ttype'],
+                'string': row.get('field_description'),
+                'store': row.get('store'),
+                'required': row.get('required'),
+            }
+            if row.get('relation'):
+                meta['relation'] = row['relation']
+            schema[row['model']][row['name']] = meta
+    return {model_name: fields for model_name, fields in schema.items() if fields}
+
+
+def fetch_schema(models_proxy, db, uid, password, model_names):
+    """
+    Schéma des modèles demandés via `fetch_fields_bulk`, avec repli sur un `fields_get`
+    par modèle si l'utilisateur ne peut pas lire `ir.model.fields`.
+    """
+    try:
+        return fetch_fields_bulk(models_proxy, db, uid, password, model_names)
+    except Exception as e:
+        print(f"Lecture groupée de ir.model.fields impossible ({e}), repli sur fields_get par modèle.")
+
+    schema = {}
+    for model_name in model_names:
+        try:
+            schema[model_name] = models_proxy.execute_kw(
+                db, uid, password, model_name, 'fields_get', [], {'attributes': FIELD_ATTRIBUTES}
+            )
+        except Exception as e:
+            print(f"fields_get impossible pour le modèle {model_name} : {e}")
+    return schema
+
+
+def _normalize_untyped_column(values):
+    """Normalisation valeur par valeur, utilisée uniquement si le type du champ est inconnu."""
+    normalized = []
+    for value in values:
+        if isinstance(value, list) and len(value) == 2 and isinstance(value[0], int):
+            normalized.append(value[0])
+        elif isinstance(value, (dict, list)):
+            normalized.append(str(value))
+        else:
+            normalized.append(value)
+    return normalized
+
+
+def records_to_frame(records, field_types=None, columns=None):
+    """
+    Construit un DataFrame à partir d'un lot de `search_read`, colonne par colonne.
+    Les types Odoo (`field_types`) indiquent directement quelles colonnes sont des many2one
+    (on garde l'id), des x2many / champs structurés (convertis en texte) ou des scalaires
+    (recopiés sans aucun test par valeur).
+    """
+    if not records:
+        return pd.DataFrame(columns=columns or [])
+
+    field_types = field_types or {}
+    # search_read renvoie les mêmes clés pour tous les enregistrements d'un lot
+    names = list(records[0].keys())
+    data = {}
+    for name in names:
+        values = [record[name] for record in records]
+        field_type = field_types.get(name)
+        if field_type in MANY2ONE_TYPES:
+            data[name] = [value[0] if value else value for value in values]
+        elif field_type in X2MANY_TYPES:
+            data[name] = [str(value) for value in values]
+        elif field_type in STRUCTURED_TYPES:
+            data[name] = [str(value) if isinstance(value, (dict, list)) else value for value in values]
+        elif field_type is None and name != 'id':
+            data[name] = _normalize_untyped_column(values)
+        else:
+            data[name] = values
+    return pd.DataFrame(data, columns=names)
+
+
+def _integer_dtype(series, use_arrow):
+    """Int32 si toutes les valeurs tiennent sur 32 bits, Int64 sinon."""
+    fits_int32 = series.isna().all() or (series.min() >= INT32_MIN and series.max() <= INT32_MAX)
+    if use_arrow:
+        return 'int32[pyarrow]' if fits_int32 else 'int64[pyarrow]'
+    return 'Int32' if fits_int32 else 'Int64'
+
+
+def _false_to_na(series):
+    """
+    Remplace les `False` renvoyés par Odoo pour un champ vide par des valeurs manquantes (None).
+    Un lot où le champ est vide partout arrive en dtype `bool` : il est traité comme un lot `object`.
+    """
+    if series.dtype != bool and series.dtype != object:
+        return series
+    return series.astype(object).where(series.map(lambda value: value is not False), None)
+
+
+def compact_frame(df, field_types=None, use_arrow=None):
+    """
+    Convertit les colonnes d'un DataFrame issu de `records_to_frame` en dtypes compacts
+    d'après les types Odoo :
+    - `id`, entiers et many2one : entiers nullables (32 bits si possible, sinon 64 bits) ;
+    - selection : `category` ;
+    - date / datetime : `datetime64[ns, UTC]` (Odoo stocke les dates-heures en UTC) ;
+    - float / monetary : `float64` ;
+    - textes : valeurs manquantes à la place des `False`.
+    Les `False` renvoyés par Odoo pour une valeur vide deviennent des valeurs manquantes
+    (les booléens gardent bien sûr leurs `False`).
+    Les autres colonnes sont laissées telles quelles. `use_arrow` (défaut : ODOO_ARROW_DTYPES)
+    utilise les dtypes Arrow pour les colonnes numériques.
+    """
+    if df.empty:
+        return df
+    field_types = field_types or {}
+    use_arrow = USE_ARROW_DTYPES if use_arrow is None else use_arrow
+    columns = {}
+    for name in df.columns:
+        series = df[name]
+        field_type = 'integer' if name == 'id' else field_types.get(name)
+        if field_type in MANY2ONE_TYPES or field_type in INTEGER_TYPES:
+            if series.dtype == bool or series.dtype == object:
+                # Pour un many2one, False signifie « vide » (les ids commencent à 1)
+                series = pd.to_numeric(_false_to_na(series), errors='coerce')
+            columns[name] = series.astype(_integer_dtype(series, use_arrow))
+        elif field_type in FLOAT_TYPES:
+            series = pd.to_numeric(series, errors='coerce')
+            columns[name] = series.astype('double[pyarrow]' if use_arrow else 'float64')
+        elif field_type in DATE_FORMATS:
+            columns[name] = pd.to_datetime(
+                _false_to_na(series), format=DATE_FORMATS[field_type], utc=True, errors='coerce'
+            ).astype('datetime64[ns, UTC]')
+        elif field_type in CATEGORY_TYPES:
+            columns[name] = _false_to_na(series).astype('category')
+        elif field_type in TEXT_TYPES and (series.dtype == bool or series.dtype == object):
+            # Même dtype texte que pandas choisirait sans les False (`str` avec pandas 3, `object` avant)
+            columns[name] = _false_to_na(series).infer_objects()
+    if not columns:
+        return df
+    return df.assign(**columns)
+
+
+def concat_frames(frames, columns=None):
+    """
+    `pd.concat` de lots compactés : les colonnes `category` dont les catégories diffèrent
+    d'un lot à l'autre sont unifiées au préalable (sinon pandas les repasse en `object`).
+    """
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=columns or [])
+    if len(frames) == 1:
+        return frames[0]
+    for name in frames[0].columns:
+        if isinstance(frames[0][name].dtype, pd.CategoricalDtype):
+            categories = list(dict.fromkeys(
+                category for frame in frames if name in frame.columns for category in frame[name].cat.categories
+            ))
+            frames = [
+                frame.assign(**{name: frame[name].cat.set_categories(categories)}) if name in frame.columns else frame
+                for frame in frames
+            ]
+    return pd.concat(frames, ignore_index=True)
+
+
+def frame_memory_bytes(df):
+    """Empreinte mémoire réelle d'un DataFrame (chaînes Python comprises)."""
+    return int(df.memory_usage(deep=True).sum())
+
+
+class MemoryBudget:
+    """Compteur d'octets partagé entre les threads d'extraction."""
+
+    def __init__(self, limit_bytes):
+        self.limit_bytes = limit_bytes
+        self.used_bytes = 0
+        self._lock = threading.Lock()
+
+    def try_reserve(self, size):
+        with self._lock:
+            if self.used_bytes + size > self.limit_bytes:
+                return False
+            self.used_bytes += size
+            return True
+
+    def release(self, size):
+        with self._lock:
+            self.used_bytes = max(0, self.used_bytes - size)
+
+
+def _arrow_type(series, field_type):
+    """Type Arrow stable (identique pour tous les lots) d'une colonne compactée."""
+    import pyarrow as pa
+
+    if field_type in MANY2ONE_TYPES or field_type in INTEGER_TYPES:
+        return pa.int64()
+    if field_type in FLOAT_TYPES:
+        return pa.float64()
+    if field_type in DATE_FORMATS:
+        return pa.timestamp('ns', tz='UTC')
+    if field_type in CATEGORY_TYPES:
+        value_type = pa.array(list(series.cat.categories)).type
+        return pa.dictionary(pa.int32(), pa.string() if pa.types.is_null(value_type) else value_type)
+    if field_type == 'boolean' or (field_type is None and series.dtype != object):
+        try:
+            return pa.Array.from_pandas(series.iloc[:0]).type
+        except (TypeError, ValueError, pa.ArrowException):
+            pass
+    return pa.string()
+
+
+def _to_arrow(series, arrow_type):
+    """Colonne d'un lot convertie au type Arrow `arrow_type` fixé par le premier lot."""
+    import pyarrow as pa
+
+    try:
+        return pa.Array.from_pandas(series, type=arrow_type)
+    except (TypeError, ValueError, pa.ArrowException):
+        return pa.Array.from_pandas(series).cast(arrow_type)
+
+
+class ParquetChunkSink:
+    """
+    Écrit les lots compactés d'un modèle dans un fichier Parquet, un groupe de lignes par lot.
+    Le schéma Arrow est fixé par le premier lot et les lots suivants y sont convertis ; les
+    textes `False` d'Odoo y sont stockés comme nuls.
+    `metadata` ({str: str}) est enregistré dans le schéma du fichier.
+    """
+
+    def __init__(self, path, field_types=None, metadata=None):
+        self.path = path
+        self.field_types = field_types or {}
+        self.metadata = metadata
+        self.schema = None
+        self._writer = None
+        self.rows = 0
+
+    def write(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self._writer is None:
+            self.schema = pa.schema([
+                pa.field(name, _arrow_type(df[name], 'integer' if name == 'id' else self.field_types.get(name)))
+                for name in df.columns
+            ], metadata=self.metadata)
+            self._writer = pq.ParquetWriter(self.path, self.schema, compression='snappy')
+        # Chaque lot est converti au schéma du premier : un lot peut avoir un autre dtype pour la
+        # même colonne (champ vide partout, entiers 32 ou 64 bits, autres catégories)
+        arrays = []
+        for field in self.schema:
+            series = df[field.name] if field.name in df.columns else pd.Series(None, index=df.index, dtype=object)
+            if pa.types.is_string(field.type) and (series.dtype == object or series.dtype == bool):
+                series = series.map(lambda value: None if value is None or value is False else str(value))
+            arrays.append(_to_arrow(series, field.type))
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.rows += len(df)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def arrow_to_frame(table):
+    """Table (ou lot) Arrow écrite par `ParquetChunkSink` -> DataFrame aux mêmes dtypes que `compact_frame`."""
+    import pyarrow as pa
+
+    df = table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype(), pa.int32(): pd.Int32Dtype()}.get)
+    for name in df.columns:
+        if isinstance(df[name].dtype, pd.Int64Dtype):
+            df[name] = df[name].astype(_integer_dtype(df[name], False))
+    return df
+
+
+def read_spilled_frame(path):
+    """Relit un fichier écrit par `ParquetChunkSink`."""
+    import pyarrow.parquet as pq
+
+    return arrow_to_frame(pq.read_table(path, memory_map=True))
+
+
+def join_graph(models_fields, schema):
+    """
+    Relations many2one entre les modèles du plan, d'après les métadonnées `fields_get` :
+    liste de (modèle, champ, modèle lié) pour chaque champ extrait qui pointe vers un autre modèle du plan.
+    """
+    joins = []
+    for model_name, fields in models_fields.items():
+        fields_meta = (schema or {}).get(model_name) or {}
+        for field in fields:
+            meta = fields_meta.get(field) or {}
+            if meta.get('type') in MANY2ONE_TYPES and meta.get('relation') in models_fields:
+                joins.append((model_name, field, meta['relation']))
+    return joins
+
+
+def index_by_id(df):
+    """
+    Indexe un DataFrame par ses ids Odoo (index `ID_INDEX_NAME`, la colonne `id` est conservée).
+    La table de hachage de l'index est construite une fois puis réutilisée par chaque `lookup`,
+    y compris sur les copies et les sous-ensembles du DataFrame.
+    """
+    if 'id' not in df.columns or df.index.name == ID_INDEX_NAME:
+        return df
+    return df.set_index(pd.Index(df['id'].to_numpy(dtype='int64', na_value=0), name=ID_INDEX_NAME))
+
+
+def lookup(df, column, dimension, fields, prefix=None):
+    """
+    Jointure many2one indexée : ajoute à `df` les colonnes `fields` du modèle lié `dimension`
+    pour l'id contenu dans `df[column]`, sans `merge` (temps linéaire en `len(df)`).
+    `fields` : liste de champs (colonnes nommées `<prefix><champ>`, `prefix` valant `<column>_`
+    par défaut) ou dictionnaire {champ: nom de colonne}. Les ids vides ou inconnus donnent des
+    valeurs manquantes ; le nombre et l'ordre des lignes de `df` sont conservés.
+    """
+    if not isinstance(fields, dict):
+        prefix = f"{column}_" if prefix is None else prefix
+        fields = {field: f"{prefix}{field}" for field in fields}
+    dimension = index_by_id(dimension)
+    keys = df[column]
+    if keys.dtype == object:
+        # many2one brut ([id, nom]) ou False
+        keys = keys.map(lambda value: value[0] if isinstance(value, (list, tuple)) and value else value or None)
+    keys = pd.to_numeric(keys, errors='coerce').astype('Int64').to_numpy(dtype='int64', na_value=0)
+    positions = dimension.index.get_indexer(keys)
+
+    result = df.copy(deep=False)
+    for field, name in fields.items():
+        result[name] = pd.Series(dimension[field].array.take(positions, allow_fill=True), index=df.index)
+    return result
+
+
+class ModelFrames(Mapping):
+    """
+    Dictionnaire {modèle: DataFrame} passé à `transform_data`, à mémoire bornée.
+
+    Les modèles sont gardés en mémoire tant que le budget partagé (`memory_budget`, en octets)
+    le permet ; au-delà, les lots du modèle en cours sont écrits dans un fichier Parquet du
+    répertoire de travail et le DataFrame n'est chargé qu'au premier accès (`dfs[modèle]`).
+    `table(modèle)` donne accès à la table Arrow (mappée en mémoire) sans conversion pandas.
+    Le répertoire de travail est supprimé par `close()` (ou à la destruction de l'objet).
+    Les modèles de `indexed_models` (cibles de many2one, voir `join_graph`) sont indexés par id
+    pour les jointures de `lookup`.
+    """
+
+    def __init__(self, model_names, memory_budget=None, spill_dir=None, indexed_models=()):
+        self.model_names = list(model_names)
+        self.indexed_models = set(indexed_models or ())
+        self.budget = MemoryBudget(MEMORY_BUDGET_BYTES if memory_budget is None else memory_budget)
+        self.directory = tempfile.mkdtemp(prefix='odoo_etl_', dir=spill_dir or SPILL_DIR)
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.directory, True)
+        self._frames = {}
+        self._spilled = {}
+
+    def collect(self, model_name, frames, field_types=None, columns=None):
+        """
+        Consomme un itérable de lots compactés pour `model_name`.
+        Retourne (nombre de lignes, octets des lots en mémoire, True si le modèle est sur disque).
+        """
+        chunks = []
+        held_bytes = 0
+        total_bytes = 0
+        sink = None
+        for df in frames:
+            if df.empty:
+                continue
+            size = frame_memory_bytes(df)
+            total_bytes += size
+            if sink is None and self.budget.try_reserve(size):
+                chunks.append(df)
+                held_bytes += size
+                continue
+            if sink is None:
+                print(f"Budget mémoire atteint : le modèle {model_name} est écrit sur disque (Parquet).")
+                sink = ParquetChunkSink(os.path.join(self.directory, f"{model_name}.parquet"), field_types)
+                for chunk in chunks:
+                    sink.write(chunk)
+                chunks = []
+                self.budget.release(held_bytes)
+            sink.write(df)
+
+        if sink is None:
+            self._frames[model_name] = self._prepare(model_name, concat_frames(chunks, columns=columns))
+            return sum(len(chunk) for chunk in chunks), total_bytes, False
+        sink.close()
+        self._spilled[model_name] = sink.path
+        return sink.rows, total_bytes, True
+
+    def is_spilled(self, model_name):
+        return model_name in self._spilled
+
+    def spill_path(self, model_name):
+        """Fichier Parquet d'un modèle écrit sur disque (None s'il est en mémoire)."""
+        return self._spilled.get(model_name)
+
+    def table(self, model_name):
+        """Table Arrow du modèle (mappée en mémoire si le modèle est sur disque)."""
+        if model_name in self._spilled:
+            import pyarrow.parquet as pq
+            return pq.read_table(self._spilled[model_name], memory_map=True)
+        import pyarrow as pa
+        return pa.Table.from_pandas(self[model_name], preserve_index=False)
+
+    def __getitem__(self, model_name):
+        if model_name not in self._frames and model_name in self._spilled:
+            self._frames[model_name] = self._prepare(model_name, read_spilled_frame(self._spilled[model_name]))
+        return self._frames[model_name]
+
+    def _prepare(self, model_name, df):
+        return index_by_id(df) if model_name in self.indexed_models else df
+
+    def __iter__(self):
+        return (m for m in self.model_names if m in self._frames or m in self._spilled)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def copy(self):
+        return dict(self.items())
+
+    def close(self):
+        self._frames.clear()
+        self._finalizer()
+
+
+def parse_aggregation(spec, field_types=None):
+    """
+    Décompose une agrégation du plan {"groupby": ["user_id", "invoice_date:month"], "aggregates": ["amount_total:sum"]}
+    en ([(champ, granularité ou None)], [(champ, fonction)]). Comme dans Odoo, un champ date
+    regroupé sans granularité l'est par mois.
+    """
+    field_types = field_types or {}
+    groupbys = []
+    for entry in spec.get('groupby') or []:
+        field, _, granularity = entry.partition(':')
+        if not granularity and field_types.get(field) in DATE_FORMATS:
+            granularity = 'month'
+        groupbys.append((field, granularity or None))
+    aggregates = []
+    for entry in spec.get('aggregates') or []:
+        field, _, function = entry.partition(':')
+        aggregates.append((field, function or 'sum'))
+    return groupbys, aggregates
+
+
+def aggregation_columns(spec):
+    """Colonnes du DataFrame agrégé : champs de regroupement, `<champ>_<fonction>` et `__count`."""
+    groupbys, aggregates = parse_aggregation(spec)
+    return [field for field, _ in groupbys] + [f"{field}_{function}" for field, function in aggregates] + ['__count']
+
+
+def _period_start(series, granularity):
+    """
+    Début (UTC) de la période `granularity` contenant chaque date, les périodes étant découpées
+    en UTC comme celles de `read_group_frame` (appelé avec le fuseau UTC).
+    """
+    naive = series.dt.tz_convert(None) if series.dt.tz is not None else series
+    return naive.dt.to_period(DATE_GRANULARITIES[granularity]).dt.start_time.dt.tz_localize('UTC').astype('datetime64[ns, UTC]')
+
+
+def _finalize_aggregation(df, spec, field_types):
+    groupbys, aggregates = parse_aggregation(spec, field_types)
+    group_types = {field: field_types.get(field) for field, granularity in groupbys if not granularity}
+    df = compact_frame(df, group_types)
+    counts = ['__count'] + [f"{field}_{function}" for field, function in aggregates if function in ('count', 'count_distinct')]
+    for column in aggregation_columns(spec)[len(groupbys):]:
+        values = pd.to_numeric(df[column], errors='coerce')
+        if column in counts:
+            values = values.astype('Int64')
+            df[column] = values.astype(_integer_dtype(values, USE_ARROW_DTYPES))
+        else:
+            df[column] = values.astype('float64')
+    return df[aggregation_columns(spec)]
+
+
+def read_group_frame(models_proxy, db, uid, password, model_name, spec, domain=None, field_types=None):
+    """
+    Agrégation calculée dans la base d'Odoo (`read_group`, tous les niveaux de regroupement à la fois).
+    Les groupes de dates sont ramenés au début de leur période (UTC) grâce à `__range`.
+    Odoo découpe les périodes des champs datetime dans le fuseau du contexte (celui de
+    l'utilisateur par défaut) : le fuseau UTC est imposé pour obtenir les mêmes groupes que
+    l'agrégation locale (`aggregate_frame`).
+    """
+    field_types = field_types or {}
+    groupbys, aggregates = parse_aggregation(spec, field_types)
+    groups = models_proxy.execute_kw(
+        db, uid, password, model_name, 'read_group',
+        [list(domain or []), [f"{field}_{function}:{function}({field})" for field, function in aggregates],
+         [f"{field}:{granularity}" if granularity else field for field, granularity in groupbys]],
+        {'lazy': False, 'context': {'tz': 'UTC'}}
+    )
+    rows = []
+    for group in groups:
+        row = {'__count': group.get('__count')}
+        for field, granularity in groupbys:
+            key = f"{field}:{granularity}" if granularity else field
+            value = group.get(key)
+            if granularity:
+                if value and key not in (group.get('__range') or {}):
+                    raise ValueError(f"read_group ne renvoie pas les bornes du groupe {key} (version d'Odoo trop ancienne)")
+                value = (group['__range'][key] or {}).get('from') if value else None
+                row[field] = pd.Timestamp(value, tz='UTC') if value else pd.NaT
+            else:
+                row[field] = value[0] if field_types.get(field) in MANY2ONE_TYPES and value else value
+        for field, function in aggregates:
+            row[f"{field}_{function}"] = group.get(f"{field}_{function}")
+        rows.append(row)
+    df = pd.DataFrame(rows, columns=aggregation_columns(spec))
+    for field, granularity in groupbys:
+        if granularity:
+            df[field] = pd.to_datetime(df[field], utc=True).astype('datetime64[ns, UTC]')
+    return _finalize_aggregation(df, spec, field_types)
+
+
+def aggregate_frame(df, spec, field_types=None):
+    """Même agrégation que `read_group_frame`, calculée par pandas sur les enregistrements bruts (compactés)."""
+    field_types = field_types or {}
+    groupbys, aggregates = parse_aggregation(spec, field_types)
+    if df.empty:
+        return _finalize_aggregation(pd.DataFrame(columns=aggregation_columns(spec)), spec, field_types)
+
+    grouped = pd.DataFrame({
+        field: _period_start(df[field], granularity) if granularity else df[field]
+        for field, granularity in groupbys
+    }, index=df.index)
+    for field, function in aggregates:
+        grouped[f"{field}_{function}"] = df[field]
+    named_aggregations = {
+        f"{field}_{function}": (f"{field}_{function}", AGGREGATE_FUNCTIONS[function]) for field, function in aggregates
+    }
+
+    group_fields = [field for field, _ in groupbys]
+    if group_fields:
+        named_aggregations['__count'] = (group_fields[0], 'size')
+        result = grouped.groupby(group_fields, dropna=False, observed=True, sort=True).agg(**named_aggregations).reset_index()
+    else:
+        # Sans regroupement, read_group renvoie une seule ligne de totaux
+        row = {column: grouped[source].agg(function) for column, (source, function) in named_aggregations.items()}
+        row['__count'] = len(grouped)
+        result = pd.DataFrame([row])
+    return _finalize_aggregation(result, spec, field_types)
+
+
+def extract_aggregation(models_proxy, db, uid, password, model_name, spec, domain=None, field_types=None):
+    """
+    DataFrame agrégé d'un modèle : `read_group` côté Odoo, ou à défaut (champ non stocké,
+    version d'Odoo, droits...) `search_read` des seuls champs utiles puis agrégation locale.
+    """
+    try:
+        return read_group_frame(models_proxy, db, uid, password, model_name, spec, domain, field_types)
+    except Exception as e:
+        print(f"read_group impossible pour {model_name} ({e}) : agrégation locale après search_read.")
+    groupbys, aggregates = parse_aggregation(spec, field_types)
+    fields = list(dict.fromkeys([field for field, _ in groupbys] + [field for field, _ in aggregates]))
+    field_types = field_types or get_field_types(models_proxy, db, uid, password, model_name, fields)
+    chunks = [
+        compact_frame(records_to_frame(records, field_types, columns=fields), field_types)
+        for records in iter_search_read(models_proxy, db, uid, password, model_name, domain=domain, fields=fields)
+    ]
+    return aggregate_frame(concat_frames(chunks, columns=['id'] + fields), spec, field_types)
+
+
+def stream_transform(transform_function, frames, fact_model, fact_chunks, fact_columns=None):
+    """
+    Exécute `transform_function` lot par lot sur le modèle principal `fact_model`, les autres
+    modèles de `frames` (dimensions) étant passés en entier à chaque appel.
+    Réservé aux transformations ligne à ligne (voir `code_analysis.streaming_blockers`).
+    Générateur de (lignes lues, DataFrame résultat) ; si le modèle principal est vide, la
+    transformation est exécutée une fois sur un DataFrame vide (`fact_columns`).
+    """
+    dimensions = dict(frames.items())
+    processed = False
+    for chunk in fact_chunks:
+        if chunk.empty:
+            continue
+        processed = True
+        # Copies superficielles : une modification « inplace » d'une dimension ne doit pas
+        # se répéter d'un lot à l'autre
+        batch_dfs = {model_name: df.copy(deep=False) for model_name, df in dimensions.items()}
+        batch_dfs[fact_model] = chunk
+        yield len(chunk), transform_function(batch_dfs)
+    if not processed:
+        batch_dfs = {model_name: df.copy(deep=False) for model_name, df in dimensions.items()}
+        batch_dfs[fact_model] = pd.DataFrame(columns=fact_columns or [])
+        yield 0, transform_function(batch_dfs)
+
+
+def _is_page_too_large_error(error):
+    """Erreurs qui justifient de réessayer le même lot avec moins d'enregistrements."""
+    if isinstance(error, (socket.timeout, TimeoutError)):
+        return True
+    if isinstance(error, xmlrpc.client.ProtocolError):
+        return error.errcode in RETRYABLE_HTTP_CODES
+    if isinstance(error, xmlrpc.client.Fault):
+        return 'MemoryError' in str(error.faultString) or 'timeout' in str(error.faultString).lower()
+    # requests.exceptions.Timeout / ReadTimeout, sans dépendre de requests ici
+    return 'Timeout' in type(error).__name__
+
+
+def iter_search_read(models_proxy, db, uid, password, model_name, domain=None, fields=None, order=None,
+                     initial_size=2000, min_size=None, max_size=None,
+                     target_seconds=None, max_bytes=None, max_retries=None, context=None):
+    """
+    Générateur de lots bruts de `search_read` dont la taille s'adapte au modèle.
+
+    - Pagination par curseur sur l'`id` (`id > dernier_id_vu`) par défaut ; par `offset`
+      uniquement si un autre tri (`order`) est demandé.
+    - Après chaque lot, la taille est ajustée (facteur 0,5 à 2, dans [min_size, max_size]) pour
+      viser `target_seconds` par appel et rester sous `max_bytes` de réponse (si le client
+      expose `last_response_bytes`, comme `odoo_client.OdooClient`).
+    - Après un timeout ou une réponse refusée par un proxy, le même lot est redemandé avec
+      une taille divisée par deux, au plus `max_retries` fois de suite.
+    `context` (ex. {'lang': 'fr_FR'}) est transmis à chaque appel.
+    """
+    domain = list(domain or [])
+    min_size = min_size or PAGE_MIN_SIZE
+    max_size = max_size or PAGE_MAX_SIZE
+    target_seconds = target_seconds or PAGE_TARGET_SECONDS
+    max_bytes = max_bytes or PAGE_MAX_BYTES
+    max_retries = PAGE_MAX_RETRIES if max_retries is None else max_retries
+
+    use_cursor = order is None or order.strip().lower() in ('id', 'id asc')
+    size = max(min_size, min(max_size, initial_size))
+    last_id = 0
+    offset = 0
+    retries = 0
+    print(f"Début de la récupération paginée pour le modèle {model_name} (mode {'curseur' if use_cursor else 'offset'}, lot initial {size})...")
+
+    while True:
+        if use_cursor:
+            call_domain = domain + [('id', '>', last_id)]
+            options = {'fields': fields or [], 'limit': size, 'order': 'id asc'}
+        else:
+            call_domain = domain
+            options = {'fields': fields or [], 'limit': size, 'offset': offset, 'order': order}
+        if context:
+            options['context'] = context
+
+        start = time.perf_counter()
+        try:
+            records = models_proxy.execute_kw(db, uid, password, model_name, 'search_read', [call_domain], options)
+        except Exception as e:
+            if not _is_page_too_large_error(e) or size <= min_size or retries >= max_retries:
+                print(f"Une erreur est survenue lors de la récupération du lot ({'id > ' + str(last_id) if use_cursor else 'offset ' + str(offset)}): {e}")
+                raise
+            retries += 1
+            size = max(min_size, size // 2)
+            print(f"Lot trop lourd pour {model_name} ({e}) : nouvel essai avec {size} enregistrements.")
+            continue
+        elapsed = time.perf_counter() - start
+        retries = 0
+
+        if not records:
+            print("Fin de la récupération : plus de données.")
+            return
+
+        yield records
+
+        if len(records) < options['limit']:
+            print("Fin de la récupération : dernier lot incomplet.")
+            return
+        last_id = records[-1]['id']
+        offset += len(records)
+
+        # Ajustement de la taille du prochain lot d'après ce lot-ci
+        factor = target_seconds / elapsed if elapsed > 0 else 2.0
+        response_bytes = getattr(models_proxy, 'last_response_bytes', 0) or 0
+        if response_bytes:
+            factor = min(factor, max_bytes / response_bytes)
+        new_size = max(min_size, min(max_size, int(size * max(0.5, min(2.0, factor)))))
+        if new_size != size:
+            print(f"Taille de lot ajustée pour {model_name} : {size} -> {new_size} ({elapsed:.2f}s, {response_bytes} octets)")
+            size = new_size
@@ -0,0 +1,170 @@
+# extraction_cache.py
+"""
+Cache disque des données extraites d'Odoo, au format Parquet (un fichier par extraction).
+
+Une entrée correspond à (connexion, modèle, champs triés, domaine) : relancer un plan dont
+seul le code de transformation a changé relit les données localement, sans appel réseau.
+Les entrées expirent après `EXTRACTION_CACHE_TTL` secondes et les moins récemment utilisées
+sont supprimées au-delà de `EXTRACTION_CACHE_MAX_MB` mégaoctets.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import pyarrow.parquet as pq
+
+import etl_runtime
+from disk_cache import CACHE_ROOT
+
+EXTRACTION_CACHE_TTL = int(os.getenv("EXTRACTION_CACHE_TTL", "1800"))
+EXTRACTION_CACHE_MAX_MB = float(os.getenv("EXTRACTION_CACHE_MAX_MB", "1024"))
+# Nombre de lignes par lot relu depuis le cache
+READ_BATCH_SIZE = 20000
+
+
+def extraction_key(conn_key, model_name, fields, domain):
+    """Clé d'une extraction : l'ordre des champs demandés n'a pas d'importance."""
+    return json.dumps([conn_key, model_name, sorted(fields or []), domain or []], default=str)
+
+
+class ExtractionCache:
+    """
+    Cache Parquet des extractions. La clé et la date d'écriture sont stockées dans les
+    métadonnées du fichier ; la date de dernier accès (mtime) sert à l'éviction LRU.
+    """
+
+    def __init__(self, namespace='extractions', ttl_seconds=None, max_bytes=None, root=None):
+        self.directory = os.path.join(root or CACHE_ROOT, namespace)
+        self.ttl_seconds = EXTRACTION_CACHE_TTL if ttl_seconds is None else ttl_seconds
+        self.max_bytes = int(EXTRACTION_CACHE_MAX_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{digest}.parquet")
+
+    @staticmethod
+    def _metadata(path):
+        return ExtractionCache._cache_metadata(pq.read_schema(path))
+
+    @staticmethod
+    def _cache_metadata(schema):
+        metadata = schema.metadata or {}
+        return {k.decode('utf-8'): v.decode('utf-8') for k, v in metadata.items() if k.startswith(b'cache_')}
+
+    def open(self, key):
+        """
+        Fichier Parquet ouvert (`pq.ParquetFile`) de l'extraction `key`, ou None si absente ou expirée.
+        Le fichier reste lisible par `read` même s'il est ensuite expulsé du cache.
+        """
+        path = self._path(key)
+        try:
+            entry = pq.ParquetFile(path, memory_map=True)
+            metadata = self._cache_metadata(entry.schema_arrow)
+        except (OSError, ValueError):
+            return None
+        if metadata.get('cache_key') != key:
+            return None
+        if self.ttl_seconds and time.time() - float(metadata.get('cache_stored_at', 0)) > self.ttl_seconds:
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def lookup(self, key):
+        """Chemin du fichier Parquet de l'extraction `key`, ou None si absente ou expirée."""
+        return self._path(key) if self.open(key) is not None else None
+
+    @staticmethod
+    def read(entry):
+        """Lots compactés d'une extraction ouverte par `open`."""
+        for batch in entry.iter_batches(batch_size=READ_BATCH_SIZE):
+            yield etl_runtime.arrow_to_frame(batch)
+
+    def chunks(self, key, produce_chunks, field_types=None):
+        """
+        Lots compactés de l'extraction `key` : relus depuis le cache s'il est à jour, sinon
+        produits par `produce_chunks` (itérable paresseux, qui n'interroge Odoo qu'à ce moment)
+        et enregistrés au passage. Une extraction interrompue n'est pas enregistrée.
+        """
+        entry = self.open(key)
+        if entry is not None:
+            print(f"Extraction servie depuis le cache : {self._path(key)}")
+            return self.read(entry)
+        return self.store(key, produce_chunks, field_types)
+
+    def store(self, key, produce_chunks, field_types=None):
+        """Lots produits par `produce_chunks`, enregistrés au passage sous la clé `key` (voir `chunks`)."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        sink = etl_runtime.ParquetChunkSink(
+            tmp_path, field_types, metadata={'cache_key': key, 'cache_stored_at': str(time.time())}
+        )
+        completed = False
+        try:
+            for df in produce_chunks:
+                if not df.empty:
+                    sink.write(df)
+                yield df
+            completed = True
+        finally:
+            sink.close()
+            if completed and sink.rows:
+                os.replace(tmp_path, self._path(key))
+                self._evict()
+            else:
+                self._remove(tmp_path)
+
+    def invalidate(self, conn_key=None):
+        """Supprime les extractions d'une connexion (toutes si `conn_key` est None)."""
+        for name in os.listdir(self.directory):
+            if not name.endswith('.parquet'):
+                continue
+            path = os.path.join(self.directory, name)
+            if conn_key is not None:
+                try:
+                    key = self._metadata(path).get('cache_key')
+                    if json.loads(key)[0] != conn_key:
+                        continue
+                except (OSError, ValueError, TypeError, IndexError):
+                    pass
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        if not self.max_bytes:
+            return
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith('.parquet'):
+                    path = os.path.join(self.directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+
+# Cache partagé par toutes les sessions de l'instance
+default_cache = ExtractionCache()
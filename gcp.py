@@ -2,9 +2,46 @@
 
 import re
 import datetime
+import inspect
 from io import StringIO
+import code_analysis
+import etl_runtime
+import odoo_client
 
-def generate_gcp_function_code(url, db, username, file_name_prefix, model_fields_dict, ai_python_code, license_key):
+def generate_gcp_function_code(url, db, username, file_name_prefix, model_fields_dict, ai_python_code, license_key,
+                               incremental_models=None, protocol="xmlrpc", model_domains=None, streaming_fact_model=None,
+                               model_aggregations=None):
+    """
+    Génère le code de la Cloud Function ETL.
+    `incremental_models` : modèles extraits en mode incrémental (filigrane `write_date` stocké dans GCS).
+    Seul le modèle principal `streaming_fact_model` peut l'être : les autres modèles (dimensions)
+    sont rechargés intégralement à chaque exécution car `transform_data` doit pouvoir faire ses
+    jointures sur des données complètes. Le mode incrémental exige aussi un code ligne à ligne
+    (`code_analysis.streaming_blockers` vide) : appliquée aux seules lignes modifiées, une agrégation
+    ou un tri donnerait un résultat faux. ValueError si l'une de ces conditions n'est pas remplie.
+    Limites : les suppressions dans Odoo ne sont pas propagées (une ligne supprimée reste dans la
+    vue BigQuery jusqu'au prochain chargement complet, `full_refresh`) et la modification d'une
+    dimension ne réémet pas les lignes du modèle principal qui y font référence (leurs colonnes
+    issues de la dimension ne sont mises à jour qu'au prochain chargement complet).
+    `protocol` : protocole RPC Odoo utilisé par la fonction ("xmlrpc" ou "jsonrpc").
+    `model_domains` : filtres Odoo validés du plan de l'IA ({modèle: domaine}), appliqués à l'extraction.
+    `streaming_fact_model` : modèle principal d'une transformation ligne à ligne (voir
+    `code_analysis.streaming_fact_model`), transformé et écrit dans GCS lot par lot.
+    `model_aggregations` : agrégations validées du plan ({modèle: {"groupby", "aggregates"}}) calculées
+    par Odoo (`read_group`) ; ces modèles sont toujours recalculés entièrement.
+    """
+    model_aggregations = {m: a for m, a in (model_aggregations or {}).items() if m in model_fields_dict}
+    streaming_fact_model = streaming_fact_model if streaming_fact_model in model_fields_dict and streaming_fact_model not in model_aggregations else None
+    incremental_models = list(dict.fromkeys(incremental_models or []))
+    if incremental_models:
+        if incremental_models != [streaming_fact_model]:
+            raise ValueError(
+                f"Mode incrémental réservé au modèle principal traité ligne à ligne ({streaming_fact_model or 'aucun dans le plan'}), "
+                f"modèles demandés : {', '.join(incremental_models)}. Les dimensions doivent être rechargées entièrement."
+            )
+        blockers = code_analysis.streaming_blockers(ai_python_code)
+        if blockers:
+            raise ValueError(f"Mode incrémental impossible, la transformation n'est pas ligne à ligne : {', '.join(blockers)}.")
     clean_url = url.rstrip('/')
     secret_name = f"api_key_{db.replace('-', '_')}"
     bucket_name = db.replace('_', '-')
@@ -17,9 +54,14 @@ def generate_gcp_function_code(url, db, username, file_name_prefix, model_fields
         fields_str = ", ".join([f"'{f}'" for f in fields])
         models_to_export_str += f"        '{model}': [{fields_str}],\n"
     models_to_export_str += "    }"
+    model_domains = {m: d for m, d in (model_domains or {}).items() if m in model_fields_dict and d}
+
+    # Les fonctions de normalisation sont partagées avec l'application : on recopie leur source
+    runtime_code = inspect.getsource(etl_runtime)
+    client_code = inspect.getsource(odoo_client)
     
     code = f"""# --- Google Cloud Function pour un ETL Odoo dynamique avec IA ---
-import xmlrpc.client, os, datetime, pandas as pd, re, requests, traceback
+import xmlrpc.client, os, datetime, json, pandas as pd, re, requests, traceback
 from google.cloud import storage, secretmanager
 import google.auth
 from io import StringIO
@@ -55,6 +97,48 @@ def check_license():
         print("---------------------------------------------------------")
         return False
 
+# --- Mode incrémental (filigrane write_date par modèle, stocké dans GCS) ---
+INCREMENTAL_MODELS = {incremental_models!r}
+STATE_BLOB_NAME = "_etl_state/{file_name_prefix}_watermarks.json"
+# Marge retranchée à l'heure de début d'exécution pour borner le filigrane : couvre les transactions
+# validées après la lecture avec un write_date antérieur et l'écart d'horloge avec le serveur Odoo
+WATERMARK_SAFETY_LAG_SECONDS = int(os.environ.get("WATERMARK_SAFETY_LAG_SECONDS", "300"))
+
+def is_full_refresh(request):
+    \"\"\"Rechargement complet forcé via `?full_refresh=1`, le corps JSON ou la variable d'environnement FULL_REFRESH.\"\"\"
+    if os.environ.get("FULL_REFRESH", "").lower() in ("1", "true", "yes"):
+        return True
+    flag = None
+    try:
+        flag = request.args.get("full_refresh")
+        if flag is None:
+            flag = (request.get_json(silent=True) or {{}}).get("full_refresh")
+    except Exception:
+        pass
+    return str(flag).lower() in ("1", "true", "yes")
+
+def load_watermarks(bucket):
+    blob = bucket.blob(STATE_BLOB_NAME)
+    if not blob.exists():
+        return {{}}
+    return json.loads(blob.download_as_text())
+
+def save_watermarks(bucket, watermarks):
+    bucket.blob(STATE_BLOB_NAME).upload_from_string(json.dumps(watermarks, indent=2), content_type='application/json')
+
+class ExtractionError(Exception):
+    \"\"\"Échec de l'extraction d'un modèle Odoo (lecture paginée ou typage d'un lot).\"\"\"
+
+    def __init__(self, model_name, error):
+        super().__init__(f"{{type(error).__name__}}: {{error}}")
+        self.model_name = model_name
+
+# --- Client RPC Odoo partagé avec l'application (odoo_client.py) ---
+{client_code}
+
+# --- Fonctions partagées avec l'application (etl_runtime.py) ---
+{runtime_code}
+
 # --- Code de transformation généré par l'IA ---
 {ai_python_code}
 
@@ -76,6 +160,7 @@ def odoo_etl_to_gcs(request):
         ODOO_URL = "{clean_url}"
         ODOO_DB = "{db}"
         ODOO_USER = "{username}"
+        ODOO_PROTOCOL = "{protocol}"
         SECRET_NAME = "{secret_name}"
         SECRET_VERSION_NAME = f"projects/{{PROJECT_ID}}/secrets/{{SECRET_NAME}}/versions/latest"
         
@@ -83,71 +168,217 @@ def odoo_etl_to_gcs(request):
         response = secret_client.access_secret_version(name=SECRET_VERSION_NAME)
         ODOO_PASSWORD = response.payload.data.decode("UTF-8")
         
-        common = xmlrpc.client.ServerProxy(f'{{ODOO_URL}}/xmlrpc/2/common')
-        uid = common.authenticate(ODOO_DB, ODOO_USER, ODOO_PASSWORD, {{}})
-        models = xmlrpc.client.ServerProxy(f'{{ODOO_URL}}/xmlrpc/2/object')
+        uid = get_client(ODOO_URL, ODOO_DB, protocol=ODOO_PROTOCOL).authenticate(ODOO_USER, ODOO_PASSWORD)
+        models = get_client(ODOO_URL, ODOO_DB, uid, protocol=ODOO_PROTOCOL)
     except Exception as e:
         return (f"ERREUR CRITIQUE (Connexion): {{e}}", 500)
 
-    MODELS_TO_EXTRACT = {models_to_export_str}
-    dfs = {{}}
-    for model_name, fields in MODELS_TO_EXTRACT.items():
-        try:
-            limit = 5000; offset = 0; all_data = []
-            while True:
-                data_batch = models.execute_kw(ODOO_DB, uid, ODOO_PASSWORD, model_name, 'search_read', [[]], {{'fields': fields, 'limit': limit, 'offset': offset}})
-                if not data_batch: break
-                all_data.extend(data_batch)
-                offset += limit
-            
-            processed_data = []
-            for record in all_data:
-                new_record = {{}}
-                for field, value in record.items():
-                    if isinstance(value, list) and len(value) == 2 and isinstance(value[0], int): new_record[field] = value[0]
-                    elif isinstance(value, (dict, list)): new_record[field] = str(value)
-                    else: new_record[field] = value
-                processed_data.append(new_record)
-            df = pd.DataFrame(processed_data)
-            dfs[model_name] = df
-        except Exception as e:
-            return (f"Erreur lors du chargement du modèle {{model_name}}: {{e}}", 500)
-            
-    try:
-        result_df = transform_data(dfs)
-    except Exception as e:
-        return (f"ERREUR CRITIQUE (Transformation IA): {{e}}", 500)
-
-    cleaned_columns = [re.sub(r'[^a-zA-Z0-9_]+', '_', str(col)).strip('_') for col in result_df.columns]
-    final_columns = ['_' + col if col and col[0].isdigit() else col for col in cleaned_columns]
-    result_df.columns = final_columns
-    
     try:
         GCS_BUCKET_NAME = "{bucket_name}"
         storage_client = storage.Client()
         bucket = storage_client.bucket(GCS_BUCKET_NAME)
         if not bucket.exists():
             storage_client.create_bucket(bucket, location="europe-west1")
-        
-        json_buffer = StringIO()
-        result_df.to_json(json_buffer, orient='records', lines=True, date_format='iso')
-        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        watermarks = load_watermarks(bucket) if INCREMENTAL_MODELS else {{}}
+    except Exception as e:
+        return (f"ERREUR CRITIQUE (Accès GCS): {{e}}", 500)
+
+    # Sans filigrane pour un modèle incrémental, on repart forcément d'un chargement complet
+    full_refresh = is_full_refresh(request) or any(m not in watermarks for m in INCREMENTAL_MODELS)
+    run_mode = 'full' if full_refresh else 'delta'
+    run_started = datetime.datetime.now(datetime.timezone.utc)
+    run_started_at = run_started.isoformat()
+    # Le filigrane ne dépasse jamais le début de l'exécution (moins la marge) : une ligne modifiée
+    # pendant l'extraction, ou validée plus tard avec un write_date antérieur, est relue au prochain delta
+    watermark_ceiling = (run_started - datetime.timedelta(seconds=WATERMARK_SAFETY_LAG_SECONDS)).strftime('%Y-%m-%d %H:%M:%S')
+    new_watermarks = dict(watermarks)
+    if INCREMENTAL_MODELS:
+        print(f"Exécution en mode {{run_mode}} (filigranes : {{watermarks}})")
+
+    MODELS_TO_EXTRACT = {models_to_export_str}
+    MODEL_DOMAINS = {model_domains!r}
+    STREAMING_FACT_MODEL = {streaming_fact_model!r}
+    AGGREGATIONS = {model_aggregations!r}
+    try:
+        # Types de tous les champs en une seule requête groupée sur ir.model.fields
+        SCHEMA = fetch_schema(models, ODOO_DB, uid, ODOO_PASSWORD, list(MODELS_TO_EXTRACT))
+    except Exception as e:
+        return (f"ERREUR CRITIQUE (Lecture du schéma Odoo): {{e}}", 500)
+    # Lots typés d'un modèle : pagination par curseur sur l'id, taille de lot adaptative
+    # (voir iter_search_read), sans garder les enregistrements bruts en mémoire
+    batch_watermarks = {{model_name: [] for model_name in INCREMENTAL_MODELS}}
+
+    def extracted_batches(model_name, fields):
+        incremental = model_name in INCREMENTAL_MODELS
+        fetch_fields = list(fields)
+        added_write_date = incremental and bool(fields) and 'write_date' not in fields
+        if added_write_date:
+            fetch_fields.append('write_date')
+        # On relit la seconde du filigrane (>=) : les doublons sont repliés côté BigQuery par la clé
+        base_domain = list(MODEL_DOMAINS.get(model_name, []))
+        if incremental and not full_refresh:
+            base_domain.append(('write_date', '>=', watermarks[model_name]))
+        field_types = field_types_from_schema(SCHEMA.get(model_name))
+        for data_batch in iter_search_read(models, ODOO_DB, uid, ODOO_PASSWORD, model_name, domain=base_domain, fields=fetch_fields, initial_size=5000):
+            if incremental:
+                batch_watermarks[model_name].append(max((r['write_date'] for r in data_batch if r.get('write_date')), default=None))
+            df = compact_frame(records_to_frame(data_batch, field_types, columns=fetch_fields), field_types)
+            if added_write_date:
+                df = df.drop(columns=['write_date'], errors='ignore')
+            yield df
+
+    def typed_batches(model_name, fields):
+        # En flux, les lots sont lus pendant la transformation : les erreurs d'extraction sont
+        # marquées pour ne pas être confondues avec celles de `transform_data`
+        batches = extracted_batches(model_name, fields)
+        while True:
+            try:
+                df = next(batches)
+            except StopIteration:
+                return
+            except Exception as e:
+                raise ExtractionError(model_name, e) from e
+            yield df
+
+    # Modèles gardés en mémoire dans la limite de ODOO_MEMORY_BUDGET_MB, écrits en Parquet au-delà.
+    # En flux, le modèle principal n'est pas chargé : il est transformé lot par lot plus bas.
+    # Les cibles des many2one du plan sont indexées par id pour les jointures de `lookup`
+    dfs = ModelFrames(
+        [m for m in MODELS_TO_EXTRACT if m != STREAMING_FACT_MODEL],
+        indexed_models={{target for _, _, target in join_graph(MODELS_TO_EXTRACT, SCHEMA)}}
+    )
+    for model_name in dfs.model_names:
+        try:
+            field_types = field_types_from_schema(SCHEMA.get(model_name))
+            if model_name in AGGREGATIONS:
+                # Agrégé par Odoo : seul le résultat (une ligne par groupe) est transféré
+                rows, compact_bytes, spilled = dfs.collect(model_name, [extract_aggregation(
+                    models, ODOO_DB, uid, ODOO_PASSWORD, model_name, AGGREGATIONS[model_name],
+                    MODEL_DOMAINS.get(model_name), field_types
+                )], field_types, columns=aggregation_columns(AGGREGATIONS[model_name]))
+            else:
+                rows, compact_bytes, spilled = dfs.collect(
+                    model_name, typed_batches(model_name, MODELS_TO_EXTRACT[model_name]),
+                    field_types, columns=list(MODELS_TO_EXTRACT[model_name])
+                )
+            print(f"{{model_name}} : {{rows}} lignes, {{compact_bytes / 1024**2:.1f}} Mo après typage{{' (écrit sur disque)' if spilled else ''}}")
+        except Exception as e:
+            dfs.close()
+            return (f"Erreur lors du chargement du modèle {{model_name}}: {{e}}", 500)
+
+    def transform_results():
+        if STREAMING_FACT_MODEL:
+            for _, result_df in stream_transform(
+                transform_data, dfs, STREAMING_FACT_MODEL,
+                typed_batches(STREAMING_FACT_MODEL, MODELS_TO_EXTRACT[STREAMING_FACT_MODEL]),
+                list(MODELS_TO_EXTRACT[STREAMING_FACT_MODEL])
+            ):
+                yield result_df
+        else:
+            yield transform_data(dfs)
+
+    result_chunks = transform_results()
+
+    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    if INCREMENTAL_MODELS and run_mode == 'delta':
+        file_name = f"{file_name_prefix}_delta_{{timestamp}}.jsonl"
+    else:
         file_name = f"{file_name_prefix}_{{timestamp}}.jsonl"
-        bucket.blob(file_name).upload_from_string(json_buffer.getvalue(), content_type='application/jsonl')
+    # Le fichier n'est ouvert qu'au premier résultat non vide, puis complété lot par lot ;
+    # en cas d'erreur il n'est pas finalisé (aucun fichier partiel dans GCS)
+    writer = None
+    rows_written = 0
+    try:
+        while True:
+            try:
+                result_df = next(result_chunks, None)
+            except ExtractionError as e:
+                return (f"ERREUR CRITIQUE (Extraction Odoo, modèle {{e.model_name}}): {{e}}", 500)
+            except Exception as e:
+                return (f"ERREUR CRITIQUE (Transformation IA): {{e}}", 500)
+            if result_df is None:
+                break
+            if result_df.empty:
+                continue
+
+            cleaned_columns = [re.sub(r'[^a-zA-Z0-9_]+', '_', str(col)).strip('_') for col in result_df.columns]
+            result_df.columns = ['_' + col if col and col[0].isdigit() else col for col in cleaned_columns]
+            if INCREMENTAL_MODELS:
+                # Colonnes techniques utilisées par la vue BigQuery pour replier les fichiers delta
+                result_df['_etl_run_at'] = run_started_at
+                result_df['_etl_mode'] = run_mode
+
+            try:
+                json_buffer = StringIO()
+                result_df.to_json(json_buffer, orient='records', lines=True, date_format='iso')
+                payload = json_buffer.getvalue()
+                if writer is None:
+                    writer = bucket.blob(file_name).open('w', content_type='application/jsonl')
+                writer.write(payload if payload.endswith('\\n') else payload + '\\n')
+                rows_written += len(result_df)
+            except Exception as e:
+                return (f"ERREUR CRITIQUE (Chargement GCS): {{e}}", 500)
+    finally:
+        dfs.close()
+
+    for model_name, model_watermarks in batch_watermarks.items():
+        max_seen = max((w for w in model_watermarks if w), default=None)
+        new_watermarks[model_name] = min(max_seen, watermark_ceiling) if max_seen else watermarks.get(model_name)
+
+    try:
+        if writer is None:
+            if INCREMENTAL_MODELS and run_mode == 'delta':
+                save_watermarks(bucket, new_watermarks)
+                return ("Aucune modification depuis la dernière exécution.", 200)
+            bucket.blob(file_name).upload_from_string('', content_type='application/jsonl')
+        else:
+            writer.close()
+        print(f"{{rows_written}} lignes écrites dans {{file_name}}")
+        # Le filigrane n'avance qu'une fois le fichier écrit
+        if INCREMENTAL_MODELS:
+            save_watermarks(bucket, new_watermarks)
     except Exception as e:
         return (f"ERREUR CRITIQUE (Chargement GCS): {{e}}", 500)
         
+    if INCREMENTAL_MODELS and run_mode == 'delta':
+        return ("ETL incrémental terminé avec succès.", 200)
     return ("ETL complet terminé avec succès.", 200)
 """
     return code
 
 
-def generate_bigquery_view_code(project_id, dataset_id, view_name, file_name_prefix):
-    """Génère le code SQL pour créer une vue BigQuery."""
+def bigquery_column_name(col):
+    """Reproduit le nettoyage des noms de colonnes effectué par la Cloud Function générée."""
+    cleaned = re.sub(r'[^a-zA-Z0-9_]+', '_', str(col)).strip('_')
+    return '_' + cleaned if cleaned and cleaned[0].isdigit() else cleaned
+
+
+def generate_bigquery_view_code(project_id, dataset_id, view_name, file_name_prefix, key_column=None):
+    """
+    Génère le code SQL pour créer une vue BigQuery.
+    En mode incrémental (`key_column` renseignée), la vue part du dernier chargement complet
+    et ne garde que la version la plus récente de chaque ligne apportée par les fichiers delta.
+    Les fichiers delta ne contiennent que des lignes créées ou modifiées : une ligne supprimée
+    dans Odoo reste visible jusqu'au prochain chargement complet.
+    """
     final_table_name = file_name_prefix
+    if key_column:
+        table = f"`{project_id}.{dataset_id}.{final_table_name}`"
+        return f"""
+-- Les suppressions dans Odoo ne sont prises en compte qu'au prochain chargement complet
+CREATE OR REPLACE VIEW `{project_id}.{dataset_id}.{view_name}` AS (
+  SELECT * EXCEPT(_etl_row_rank)
+  FROM (
+    SELECT *, ROW_NUMBER() OVER (PARTITION BY `{bigquery_column_name(key_column)}` ORDER BY _etl_run_at DESC) AS _etl_row_rank
+    FROM {table}
+    WHERE _etl_run_at >= (SELECT MAX(_etl_run_at) FROM {table} WHERE _etl_mode = 'full')
+  )
+  WHERE _etl_row_rank = 1
+);
+"""
     return f"""
 CREATE OR REPLACE VIEW `{project_id}.{dataset_id}.{view_name}` AS (
   SELECT *
   FROM `{project_id}.{dataset_id}.{final_table_name}`
 );
-"""
\ No newline at end of file
+"""
@@ -0,0 +1,340 @@
+# llm_client.py
+"""
+Client de l'IA utilisé par `ai_services`, choisi par `LLM_CLIENT` :
+- `openai` (défaut) : API OpenAI ;
+- `record` : API OpenAI, chaque réponse étant enregistrée comme fixture dans `LLM_FIXTURES_DIR` ;
+- `replay` : réponses servies depuis les fixtures, sans réseau (erreur si la requête est inconnue) ;
+- `local` : remplaçant déterministe hors ligne, qui construit une réponse plausible à partir du prompt.
+
+Tous exposent `client.chat.completions.create(...)` comme le client OpenAI (réponse complète ou
+en flux), ce qui permet de mesurer le planificateur sans clé ni réseau
+(voir `benchmarks/planner_benchmark.py`).
+"""
+import abc
+import ast
+import hashlib
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import model_index
+
+LLM_CLIENT = os.getenv("LLM_CLIENT", "openai")
+LLM_FIXTURES_DIR = os.getenv(
+    "LLM_FIXTURES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks", "fixtures", "llm")
+)
+# Mode `replay` : reproduire les délais enregistrés (premier fragment, durée totale)
+LLM_REPLAY_REALTIME = os.getenv("LLM_REPLAY_REALTIME", "0") == "1"
+# Mode `local` : latence simulée (0 = réponse immédiate)
+LLM_LOCAL_FIRST_TOKEN_SECONDS = float(os.getenv("LLM_LOCAL_FIRST_TOKEN_SECONDS", "0"))
+LLM_LOCAL_TOKENS_PER_SECOND = float(os.getenv("LLM_LOCAL_TOKENS_PER_SECOND", "0"))
+# Relances sur erreur transitoire (réseau, quota, erreur serveur), avec attente exponentielle
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BACKOFF_SECONDS = float(os.getenv("LLM_RETRY_BACKOFF_SECONDS", "1"))
+
+# Taille des fragments d'une réponse rejouée en flux, et approximation du nombre de jetons
+STREAM_CHUNK_CHARS = 16
+CHARS_PER_TOKEN = 4
+
+
+class LLMConfigurationError(RuntimeError):
+    """Client de l'IA inutilisable en l'état (clé API absente, mode inconnu)."""
+
+
+class TransientLLMError(RuntimeError):
+    """Erreur passagère simulée par le client local : l'appel est relancé."""
+
+
+class FixtureNotFound(LookupError):
+    """Mode `replay` : aucune réponse enregistrée pour cette requête."""
+
+
+def request_key(model, messages, response_format=None):
+    """Empreinte d'une requête : identifie sa fixture."""
+    payload = json.dumps([model, messages, response_format], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def estimate_tokens(text):
+    return max(1, len(text or '') // CHARS_PER_TOKEN)
+
+
+def _usage(prompt_tokens, completion_tokens):
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens
+    )
+
+
+def _usage_dict(usage):
+    if usage is None:
+        return None
+    return {name: getattr(usage, name, None) for name in ('prompt_tokens', 'completion_tokens', 'total_tokens')}
+
+
+def _completion(content, usage):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(role='assistant', content=content), finish_reason='stop')],
+        usage=usage
+    )
+
+
+def _chunks(content, usage, include_usage, first_token_seconds=0.0, total_seconds=0.0):
+    """Réponse découpée en fragments comme un flux OpenAI, étalée sur `total_seconds`."""
+    pieces = [content[start:start + STREAM_CHUNK_CHARS] for start in range(0, len(content), STREAM_CHUNK_CHARS)] or ['']
+    pause = max(0.0, total_seconds - first_token_seconds) / len(pieces)
+    if first_token_seconds:
+        time.sleep(first_token_seconds)
+    for position, piece in enumerate(pieces):
+        if position and pause:
+            time.sleep(pause)
+        yield SimpleNamespace(
+            choices=[SimpleNamespace(delta=SimpleNamespace(content=piece), finish_reason=None)], usage=None
+        )
+    if include_usage:
+        yield SimpleNamespace(choices=[], usage=usage)
+
+
+class _Completions:
+    def __init__(self, create):
+        self.create = create
+
+
+class _StandInClient(abc.ABC):
+    """Base des clients sans réseau : `respond` fournit (texte, usage, premier fragment, durée)."""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=_Completions(self._create))
+
+    def _create(self, model, messages, response_format=None, stream=False, stream_options=None, **kwargs):
+        content, usage, first_token_seconds, total_seconds = self.respond(model, messages, response_format)
+        if stream:
+            include_usage = bool((stream_options or {}).get('include_usage'))
+            return _chunks(content, usage, include_usage, first_token_seconds, total_seconds)
+        if total_seconds:
+            time.sleep(total_seconds)
+        return _completion(content, usage)
+
+    @abc.abstractmethod
+    def respond(self, model, messages, response_format):
+        """Réponse à la requête : (texte, usage, délai du premier fragment, durée totale) en secondes."""
+
+
+class ReplayClient(_StandInClient):
+    """Rejoue les réponses enregistrées par `RecordingClient` (mêmes modèle, messages et format)."""
+
+    def __init__(self, fixtures_dir=None, realtime=None):
+        super().__init__()
+        self.fixtures_dir = fixtures_dir or LLM_FIXTURES_DIR
+        self.realtime = LLM_REPLAY_REALTIME if realtime is None else realtime
+
+    def respond(self, model, messages, response_format):
+        key = request_key(model, messages, response_format)
+        try:
+            with open(os.path.join(self.fixtures_dir, f"{key}.json"), encoding='utf-8') as f:
+                fixture = json.load(f)
+        except OSError:
+            raise FixtureNotFound(
+                f"Aucune réponse enregistrée pour cette requête ({key}) dans {self.fixtures_dir} : "
+                "relancez avec LLM_CLIENT=record."
+            ) from None
+        usage = fixture.get('usage') or {}
+        timing = fixture.get('timing') or {}
+        return (
+            fixture['content'],
+            _usage(usage.get('prompt_tokens') or 0, usage.get('completion_tokens') or 0),
+            (timing.get('first_token_s') or 0.0) if self.realtime else 0.0,
+            (timing.get('total_s') or 0.0) if self.realtime else 0.0,
+        )
+
+
+class RecordingClient:
+    """Client OpenAI dont chaque réponse (texte, jetons, délais) est enregistrée comme fixture."""
+
+    def __init__(self, inner, fixtures_dir=None):
+        self.inner = inner
+        self.fixtures_dir = fixtures_dir or LLM_FIXTURES_DIR
+        self.chat = SimpleNamespace(completions=_Completions(self._create))
+
+    def _save(self, model, messages, response_format, content, usage, first_token_seconds, total_seconds):
+        os.makedirs(self.fixtures_dir, exist_ok=True)
+        path = os.path.join(self.fixtures_dir, f"{request_key(model, messages, response_format)}.json")
+        fixture = {
+            'model': model,
+            'messages': messages,
+            'response_format': response_format,
+            'content': content,
+            'usage': _usage_dict(usage),
+            'timing': {'first_token_s': round(first_token_seconds, 3), 'total_s': round(total_seconds, 3)},
+        }
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(fixture, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+
+    def _create(self, model, messages, response_format=None, stream=False, **kwargs):
+        started = time.monotonic()
+        if response_format is not None:
+            kwargs['response_format'] = response_format
+        response = self.inner.chat.completions.create(model=model, messages=messages, stream=stream, **kwargs)
+        if not stream:
+            elapsed = time.monotonic() - started
+            self._save(
+                model, messages, response_format, response.choices[0].message.content,
+                getattr(response, 'usage', None), elapsed, elapsed
+            )
+            return response
+        return self._record_stream(response, started, model, messages, response_format)
+
+    def _record_stream(self, stream, started, model, messages, response_format):
+        parts = []
+        usage = None
+        first_token_seconds = None
+        for chunk in stream:
+            if getattr(chunk, 'usage', None):
+                usage = chunk.usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                if first_token_seconds is None:
+                    first_token_seconds = time.monotonic() - started
+                parts.append(delta)
+            yield chunk
+        total_seconds = time.monotonic() - started
+        self._save(
+            model, messages, response_format, ''.join(parts), usage,
+            first_token_seconds if first_token_seconds is not None else total_seconds, total_seconds
+        )
+
+
+class LocalClient(_StandInClient):
+    """
+    Remplaçant déterministe de l'IA pour les prompts de `ai_services` : modèles choisis par BM25
+    (`model_index`) sur la liste proposée, plan extrayant quelques champs simples du schéma fourni.
+    `fail_first` premiers appels en erreur transitoire, pour mesurer les relances.
+    """
+
+    SIMPLE_TYPES = ('char', 'integer', 'float', 'monetary', 'date', 'datetime', 'selection', 'boolean', 'many2one')
+    FIELDS_PER_MODEL = 6
+
+    def __init__(self, first_token_seconds=None, tokens_per_second=None, fail_first=0):
+        super().__init__()
+        self.first_token_seconds = LLM_LOCAL_FIRST_TOKEN_SECONDS if first_token_seconds is None else first_token_seconds
+        self.tokens_per_second = LLM_LOCAL_TOKENS_PER_SECOND if tokens_per_second is None else tokens_per_second
+        self.failures_left = fail_first
+
+    def respond(self, model, messages, response_format):
+        if self.failures_left > 0:
+            self.failures_left -= 1
+            raise TransientLLMError("erreur transitoire simulée par le client local")
+        system = messages[0]['content'] if messages else ''
+        user = messages[-1]['content'] if messages else ''
+        if 'relevant_models' in system:
+            content = json.dumps({'relevant_models': self._relevant_models(user)})
+        elif 'models_and_fields' in system:
+            content = json.dumps(self._plan(user), ensure_ascii=False)
+        elif response_format and response_format.get('type') == 'json_object':
+            content = json.dumps({'recommendation_text': "Graphique en barres dans Looker Studio."}, ensure_ascii=False)
+        else:
+            content = "1. Ouvrez l'outil de visualisation.\n2. Connectez la vue BigQuery.\n3. Créez le graphique."
+
+        completion_tokens = estimate_tokens(content)
+        usage = _usage(sum(estimate_tokens(message.get('content')) for message in messages), completion_tokens)
+        total_seconds = self.first_token_seconds
+        if self.tokens_per_second:
+            total_seconds += completion_tokens / self.tokens_per_second
+        return content, usage, self.first_token_seconds, total_seconds
+
+    @staticmethod
+    def _relevant_models(user):
+        request, _, available = user.partition("\n\nModèles disponibles: ")
+        try:
+            candidates = ast.literal_eval(available.strip())
+        except (ValueError, SyntaxError):
+            return []
+        if isinstance(candidates, dict):
+            catalog = {model_name: [label or ''] for model_name, label in candidates.items()}
+        else:
+            catalog = {model_name: [''] for model_name in candidates}
+        results, _ = model_index.ModelIndex(catalog).search(request, 3)
+        return [model_name for model_name, _ in results]
+
+    def _plan(self, user):
+        try:
+            schema = json.loads(user.split("Schéma des modèles pertinents:\n", 1)[1])
+        except (IndexError, ValueError):
+            schema = {}
+        models_and_fields = {}
+        for model_name, fields in schema.items():
+            selected = [
+                field_name for field_name, description in sorted(fields.items())
+                if field_name != 'id' and description.split('(')[0].split(',')[0] in self.SIMPLE_TYPES
+                and 'non stocké' not in description
+            ][:self.FIELDS_PER_MODEL]
+            models_and_fields[model_name] = ['id'] + selected
+        if models_and_fields:
+            main_model = next(iter(models_and_fields))
+            python_code = (
+                "def transform_data(dfs):\n"
+                f"    return dfs[{main_model!r}][{models_and_fields[main_model]!r}].copy()\n"
+            )
+        else:
+            python_code = "def transform_data(dfs):\n    return pd.DataFrame()\n"
+        return {
+            'models_and_fields': models_and_fields,
+            'domains': {},
+            'aggregations': {},
+            'streaming_fact_model': None,
+            'python_code': python_code,
+        }
+
+
+_retryable_errors = None
+
+
+def retryable_errors():
+    """Erreurs pour lesquelles un appel est relancé (celles de `openai` si le paquet est installé)."""
+    global _retryable_errors
+    if _retryable_errors is None:
+        errors = [TransientLLMError]
+        try:
+            import openai
+            errors += [openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError]
+        except (ImportError, AttributeError):
+            # Paquet absent (modes hors ligne) ou antérieur à openai 1.0
+            pass
+        _retryable_errors = tuple(errors)
+    return _retryable_errors
+
+
+def create_completion(client, metrics=None, **kwargs):
+    """
+    `client.chat.completions.create(**kwargs)`, relancé jusqu'à `LLM_MAX_RETRIES` fois sur erreur
+    transitoire avec une attente exponentielle. Chaque relance est comptée dans `metrics`
+    (voir `llm_metrics.CallMetrics`). En flux, seule l'ouverture du flux est relancée.
+    """
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            return client.chat.completions.create(**kwargs)
+        except retryable_errors() as e:
+            if attempt >= LLM_MAX_RETRIES:
+                raise
+            if metrics is not None:
+                metrics.retry(e)
+            time.sleep(LLM_RETRY_BACKOFF_SECONDS * 2 ** attempt)
+
+
+def make_client(mode=None, api_key=None):
+    """Client de l'IA pour le mode `mode` (défaut : `LLM_CLIENT`)."""
+    mode = (mode or LLM_CLIENT).strip().lower()
+    if mode == 'local':
+        return LocalClient()
+    if mode == 'replay':
+        return ReplayClient()
+    if mode in ('openai', 'record'):
+        if not api_key:
+            raise LLMConfigurationError("La clé API OpenAI n'est pas configurée.")
+        import openai
+        # Relances gérées par `create_completion`, pour pouvoir les compter
+        client = openai.OpenAI(api_key=api_key, max_retries=0)
+        return RecordingClient(client) if mode == 'record' else client
+    raise LLMConfigurationError(f"LLM_CLIENT inconnu : `{mode}` (openai, record, replay ou local).")
@@ -0,0 +1,182 @@
+# llm_metrics.py
+"""
+Mesure des appels à l'IA : jetons (prompt et réponse), latence, modèle, réponses servies par
+le cache et taille de chaque section du prompt (liste des modèles, schéma JSON, document...),
+par utilisateur et par connexion Odoo.
+
+Chaque appel est écrit sur une ligne JSON dans `LLM_METRICS_LOG` et dans le logger
+`llm_metrics`. `summary()` agrège ce journal par connexion, utilisateur et opération, pour
+repérer les bases dont le schéma fait exploser la taille des prompts :
+
+    python llm_metrics.py --days 7
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+from disk_cache import CACHE_ROOT
+
+LLM_METRICS_LOG = os.getenv("LLM_METRICS_LOG", os.path.join(CACHE_ROOT, "llm_metrics.jsonl"))
+# Au-delà, le journal est renommé en `.1` (une seule archive conservée)
+LLM_METRICS_MAX_BYTES = int(os.getenv("LLM_METRICS_MAX_BYTES", str(50 * 1024 * 1024)))
+
+logger = logging.getLogger("llm_metrics")
+_lock = threading.Lock()
+
+
+def _write(record):
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    logger.info(line)
+    # La mesure ne doit jamais faire échouer l'appel mesuré
+    try:
+        with _lock:
+            os.makedirs(os.path.dirname(LLM_METRICS_LOG) or '.', exist_ok=True)
+            if os.path.exists(LLM_METRICS_LOG) and os.path.getsize(LLM_METRICS_LOG) > LLM_METRICS_MAX_BYTES:
+                os.replace(LLM_METRICS_LOG, f"{LLM_METRICS_LOG}.1")
+            with open(LLM_METRICS_LOG, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+    except OSError as e:
+        logger.warning(f"Journal des appels à l'IA inaccessible ({e}).")
+
+
+class CallMetrics:
+    """Mesures d'un appel à l'IA, complétées pendant l'appel (voir `track`)."""
+
+    def __init__(self, record):
+        self.record = record
+        self.started = time.monotonic()
+
+    def cache_hit(self, hit=True):
+        self.record['cache_hit'] = bool(hit)
+
+    def retry(self, error):
+        """Compte une relance de l'appel après l'erreur transitoire `error`."""
+        self.record['retries'] += 1
+        self.record['last_retry_error'] = f"{type(error).__name__}: {error}"
+
+    def first_token(self):
+        """Note le délai avant le premier fragment d'une réponse reçue en flux."""
+        if 'first_token_s' not in self.record:
+            self.record['first_token_s'] = round(time.monotonic() - self.started, 3)
+
+    def usage(self, usage):
+        """Reporte les jetons de l'objet `usage` renvoyé par l'API (s'il est présent)."""
+        if usage is None:
+            return
+        for name in ('prompt_tokens', 'completion_tokens', 'total_tokens'):
+            self.record[name] = getattr(usage, name, None)
+
+
+@contextmanager
+def track(operation, model, user=None, connection=None, sections=None):
+    """
+    Mesure un appel à l'IA, ou sa réponse servie par le cache : le bloc reçoit un `CallMetrics`
+    à compléter, écrit dans le journal à la sortie du bloc avec sa durée, y compris en cas
+    d'erreur. `sections` : {nom: texte} des parties du prompt, dont seule la taille est conservée.
+    """
+    metrics = CallMetrics({
+        'ts': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'operation': operation,
+        'model': model,
+        'user': user,
+        'connection': connection,
+        'cache_hit': False,
+        'retries': 0,
+        'sections': {name: len(text or '') for name, text in (sections or {}).items()},
+        'prompt_tokens': None,
+        'completion_tokens': None,
+        'total_tokens': None,
+    })
+    try:
+        yield metrics
+    except Exception as e:
+        metrics.record['error'] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        metrics.record['latency_s'] = round(time.monotonic() - metrics.started, 3)
+        _write(metrics.record)
+
+
+def load(path=None, since=None):
+    """Journal des appels sous forme de DataFrame (une colonne `section_<nom>` par section du prompt)."""
+    records = []
+    for candidate in (f"{path or LLM_METRICS_LOG}.1", path or LLM_METRICS_LOG):
+        try:
+            with open(candidate, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            continue
+    for record in records:
+        for name, size in (record.pop('sections', None) or {}).items():
+            record[f"section_{name}"] = size
+    df = pd.DataFrame(records)
+    if df.empty:
+        return df
+    df['ts'] = pd.to_datetime(df['ts'], utc=True)
+    if since is not None:
+        df = df[df['ts'] >= since]
+    return df
+
+
+def summary(path=None, since=None):
+    """
+    Vue agrégée par connexion, utilisateur et opération : nombre d'appels, part servie par le
+    cache, relances, jetons, latences (moyenne, p95) et taille maximale de chaque section du prompt,
+    triée par jetons de prompt décroissants.
+    """
+    df = load(path, since)
+    if df.empty:
+        return df
+    df['user'] = df['user'].fillna('?')
+    df['connection'] = df['connection'].fillna('?')
+    df['cache_hit'] = df['cache_hit'].fillna(False).astype(bool)
+    if 'retries' not in df:
+        df['retries'] = 0
+    called = df[~df['cache_hit']]
+    keys = ['connection', 'user', 'operation']
+    aggregated = df.groupby(keys).agg(
+        calls=('operation', 'size'), cache_hits=('cache_hit', 'sum'), retries=('retries', 'sum')
+    )
+    aggregated = aggregated.join(called.groupby(keys).agg(
+        prompt_tokens=('prompt_tokens', 'sum'),
+        completion_tokens=('completion_tokens', 'sum'),
+        avg_prompt_tokens=('prompt_tokens', 'mean'),
+        latency_avg_s=('latency_s', 'mean'),
+        latency_p95_s=('latency_s', lambda values: values.quantile(0.95)),
+    ))
+    sections = [column for column in df.columns if column.startswith('section_')]
+    if sections:
+        aggregated = aggregated.join(df.groupby(keys)[sections].max().add_prefix('max_'))
+    if 'error' in df:
+        aggregated = aggregated.join(df.groupby(keys)['error'].count().rename('errors'))
+    return aggregated.sort_values('prompt_tokens', ascending=False, na_position='last').reset_index()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthèse des appels à l'IA (jetons, latence, taille des prompts).")
+    parser.add_argument('--log', default=None, help=f"Journal à analyser (défaut : {LLM_METRICS_LOG}).")
+    parser.add_argument('--days', type=float, default=None, help="Ne garder que les N derniers jours.")
+    args = parser.parse_args()
+
+    since = datetime.now(timezone.utc) - timedelta(days=args.days) if args.days else None
+    table = summary(args.log, since)
+    if table.empty:
+        print("Aucun appel enregistré.")
+        return
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(table.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
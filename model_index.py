@@ -0,0 +1,114 @@
+# model_index.py
+"""
+Présélection locale des modèles Odoo pertinents pour une demande (étape 1 de `ai_services.get_ai_plan`).
+
+Index BM25 sur le nom technique, le libellé et les champs (noms et libellés) de chaque modèle,
+construit une fois par catalogue (voir `schema_cache.get_model_catalog`) et gardé en mémoire :
+seuls les `MODEL_SHORTLIST_SIZE` meilleurs candidats sont proposés à l'IA au lieu de la liste
+complète des modèles de la base.
+"""
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+
+MODEL_SHORTLIST_SIZE = int(os.getenv("MODEL_SHORTLIST_SIZE", "40"))
+# Part minimale des mots de la demande retrouvés dans les candidats pour se fier à la présélection
+MODEL_SHORTLIST_MIN_COVERAGE = float(os.getenv("MODEL_SHORTLIST_MIN_COVERAGE", "0.5"))
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Les mots du nom et du libellé du modèle comptent plus que ceux de ses champs
+NAME_WEIGHT = 3
+# Index gardés en mémoire (un par catalogue)
+MAX_CACHED_INDEXES = 8
+
+# Mots vides (français, anglais) et mots du formulaire guidé, sans rapport avec les modèles
+STOP_WORDS = {
+    'le', 'la', 'les', 'un', 'une', 'des', 'du', 'de', 'd', 'l', 'et', 'ou', 'en', 'au', 'aux', 'a',
+    'par', 'pour', 'sur', 'dans', 'avec', 'sans', 'que', 'qui', 'est', 'ce', 'ces', 'cet', 'cette',
+    'je', 'veux', 'fais', 'chaque', 'tous', 'toutes', 'uniquement', 'leur', 'leurs', 'son', 'sa', 'ses',
+    'the', 'of', 'and', 'or', 'for', 'to', 'in', 'on', 'an', 'by', 'with', 'per', 'each', 'all',
+    'titre', 'rapport', 'sujet', 'principal', 'colonne', 'suivante', 'applique', 'filtre',
+    'calcul', 'trie', 'resultat', 'optionnel', 'aucun',
+}
+
+
+def tokenize(text):
+    """Mots en minuscules sans accents, au singulier approximatif (`factures` -> `facture`)."""
+    text = unicodedata.normalize('NFKD', str(text or '')).encode('ascii', 'ignore').decode('ascii').lower()
+    tokens = []
+    for token in re.findall(r'[a-z0-9]+', text):
+        if len(token) > 4 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        if len(token) > 1 and token not in STOP_WORDS and not token.isdigit():
+            tokens.append(token)
+    return tokens
+
+
+class ModelIndex:
+    """Index BM25 d'un catalogue {modèle: [libellé du modèle, description de chaque champ...]}."""
+
+    def __init__(self, catalog):
+        self.models = list(catalog)
+        self.postings = {}
+        self.lengths = []
+        for position, model_name in enumerate(self.models):
+            texts = catalog[model_name] or ['']
+            counts = Counter(tokenize(f"{model_name} {texts[0]}") * NAME_WEIGHT)
+            for text in texts[1:]:
+                counts.update(tokenize(text))
+            self.lengths.append(sum(counts.values()))
+            for token, count in counts.items():
+                self.postings.setdefault(token, []).append((position, count))
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+    def search(self, text, top_k):
+        """(meilleurs modèles [(modèle, score)], part des mots de `text` retrouvés dans ces modèles)."""
+        query = set(tokenize(text))
+        if not query or not self.models:
+            return [], 0.0
+        scores = {}
+        matched = {}
+        total = len(self.models)
+        for token in query:
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, count in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[position] / (self.average_length or 1))
+                scores[position] = scores.get(position, 0.0) + idf * count * (BM25_K1 + 1) / (count + norm)
+                matched.setdefault(position, set()).add(token)
+        best = sorted(scores, key=lambda position: (-scores[position], self.models[position]))[:top_k]
+        covered = set().union(*(matched[position] for position in best)) if best else set()
+        return [(self.models[position], scores[position]) for position in best], len(covered) / len(query)
+
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_index(index_key, catalog):
+    """Index du catalogue identifié par `index_key`, construit au premier appel puis gardé en mémoire."""
+    with _lock:
+        index = _indexes.get(index_key)
+        if index is not None:
+            _indexes.move_to_end(index_key)
+            return index
+    index = ModelIndex(catalog)
+    with _lock:
+        _indexes[index_key] = index
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def shortlist(index_key, catalog, text, top_k=None):
+    """
+    Modèles candidats pour la demande `text`, par pertinence décroissante, et vrai si la
+    présélection est fiable (assez de mots de la demande retrouvés dans les candidats).
+    """
+    results, coverage = get_index(index_key, catalog).search(text, top_k or MODEL_SHORTLIST_SIZE)
+    return [model_name for model_name, _ in results], bool(results) and coverage >= MODEL_SHORTLIST_MIN_COVERAGE
@@ -6,6 +6,17 @@ import pandas as pd
 from database import save_connection
 import kms_services
 import traceback
+import os
+import etl_runtime
+import odoo_client
+import extraction_cache
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Nombre maximum de modèles extraits simultanément pour une même connexion Odoo.
+# On reste volontairement bas pour ne pas saturer les workers du serveur Odoo du client.
+MAX_WORKERS_PER_CONNECTION = int(os.getenv("ODOO_MAX_WORKERS", "4"))
 
 def attempt_connection():
     """
@@ -15,6 +26,7 @@ def attempt_connection():
     url = st.session_state.url_input
     db = st.session_state.db_input
     username = st.session_state.username_input
+    protocol = st.session_state.get('protocol_input') or odoo_client.DEFAULT_PROTOCOL
     
     password_from_form = st.session_state.password_input
     saved_conn_details = st.session_state.get('conn_details', {})
@@ -49,11 +61,11 @@ def attempt_connection():
     with st.spinner("Connexion à Odoo..."):
         try:
             clean_url = url.rstrip('/')
-            common = xmlrpc.client.ServerProxy(f'{clean_url}/xmlrpc/2/common')
-            uid = common.authenticate(db, username, password_to_use, {})
+            uid = odoo_client.get_client(clean_url, db, protocol=protocol).authenticate(username, password_to_use)
 
             if uid:
-                models_proxy = xmlrpc.client.ServerProxy(f'{clean_url}/xmlrpc/2/object')
+                # Client partagé (connexions HTTP persistantes) réutilisé par tous les modules
+                models_proxy = odoo_client.get_client(clean_url, db, uid, protocol=protocol)
                 
                 # 1. On crée le nom de la connexion d'abord
                 connection_name = f"{db} ({username})"
@@ -67,14 +79,16 @@ def attempt_connection():
                     'url': url, 
                     'db': db, 
                     'username': username, 
-                    'encrypted_password': encrypted_pass_to_save
+                    'encrypted_password': encrypted_pass_to_save,
+                    'protocol': protocol
                 }
                 st.session_state.connection_success = True
 
                 # 3. On sauvegarde en base de données
                 save_connection(
                     name=connection_name, url=url, db_name=db, 
-                    username=username, encrypted_password=encrypted_pass_to_save
+                    username=username, encrypted_password=encrypted_pass_to_save,
+                    protocol=protocol
                 )
             else:
                 st.error("Échec de l'authentification. Vérifiez vos identifiants.")
@@ -83,44 +97,259 @@ def attempt_connection():
             st.error(f"Erreur de connexion : {e}")
             st.session_state.connection_success = False
 
-def get_large_dataset_paginated(models_proxy, db, uid, password, model_name, domain=[], fields=[], chunk_size=2000):
+def get_large_dataset_paginated(models_proxy, db, uid, password, model_name, domain=[], fields=[], chunk_size=2000, order=None,
+                                field_types=None, min_chunk_size=None, max_chunk_size=None):
     """
     Récupère un grand volume de données d'Odoo par lots (pagination).
     C'est un générateur qui "yield" des DataFrames Pandas pour chaque lot.
+
+    La pagination (curseur sur l'`id`, taille de lot adaptative à partir de `chunk_size`,
+    nouvel essai avec un lot plus petit après un timeout) est assurée par `etl_runtime.iter_search_read`.
     """
-    offset = 0
-    print(f"Début de la récupération paginée pour le modèle {model_name}...")
-    
-    while True:
-        try:
-            print(f"Récupération du lot : offset={offset}, limit={chunk_size}")
-            
-            records = models_proxy.execute_kw(
-                db, uid, password, model_name, 'search_read',
-                [domain],
-                {'fields': fields, 'limit': chunk_size, 'offset': offset}
+    if field_types is None:
+        field_types = etl_runtime.get_field_types(models_proxy, db, uid, password, model_name, fields)
+
+    for records in etl_runtime.iter_search_read(
+        models_proxy, db, uid, password, model_name, domain=domain, fields=fields, order=order,
+        initial_size=chunk_size, min_size=min_chunk_size, max_size=max_chunk_size
+    ):
+        yield etl_runtime.records_to_frame(records, field_types)
+
+
+def iter_compact_chunks(models_proxy, db, uid, password, model_name, fields, domain=None, chunk_size=2000,
+                        field_types=None, stats=None):
+    """
+    Lots du modèle convertis en dtypes compacts (`etl_runtime.compact_frame`) dès leur réception.
+    Si `stats` (dict) est fourni, il cumule les lignes reçues ('rows') et la taille des lots avant compaction ('raw_bytes').
+    """
+    if field_types is None:
+        field_types = etl_runtime.get_field_types(models_proxy, db, uid, password, model_name, fields)
+    for df_chunk in get_large_dataset_paginated(
+        models_proxy, db, uid, password, model_name,
+        domain=domain or [], fields=fields, chunk_size=chunk_size, field_types=field_types
+    ):
+        if df_chunk.empty:
+            continue
+        if stats is not None:
+            stats['rows'] = stats.get('rows', 0) + len(df_chunk)
+            stats['raw_bytes'] = stats.get('raw_bytes', 0) + etl_runtime.frame_memory_bytes(df_chunk)
+        yield etl_runtime.compact_frame(df_chunk, field_types)
+
+
+def _sample_fact_model(models_fields, schema):
+    """Modèle du plan qui référence (many2one) le plus d'autres modèles du plan : la table de faits."""
+    def outgoing_links(model_name):
+        fields_meta = schema.get(model_name, {})
+        return sum(
+            1 for field in models_fields[model_name]
+            if fields_meta.get(field, {}).get('type') in etl_runtime.MANY2ONE_TYPES
+            and fields_meta[field].get('relation') in models_fields
+            and fields_meta[field].get('relation') != model_name
+        )
+    return max(models_fields, key=outgoing_links)
+
+
+def extract_sample(models_proxy, db, uid, password, models_fields, schema, domains=None, sample_size=200, fact_model=None,
+                   aggregations=None):
+    """
+    Échantillon cohérent du plan pour tester `transform_data` en quelques secondes :
+    les `sample_size` premiers enregistrements du modèle principal (`fact_model`, par défaut celui
+    qui référence le plus d'autres modèles du plan), puis, de proche en proche, les enregistrements
+    des autres modèles qu'il référence (many2one) ou qui le référencent.
+    Les modèles sans lien avec les précédents sont limités à leurs `sample_size` premiers enregistrements.
+    Les modèles de `aggregations` sont agrégés en entier par Odoo : leur résultat est déjà réduit.
+    Retourne {modèle: DataFrame} compacté comme une extraction complète.
+    """
+    domains = domains or {}
+    aggregated = {
+        model_name: etl_runtime.extract_aggregation(
+            models_proxy, db, uid, password, model_name, spec, domains.get(model_name),
+            etl_runtime.field_types_from_schema(schema.get(model_name))
+        )
+        for model_name, spec in (aggregations or {}).items() if model_name in models_fields
+    }
+    all_models = list(models_fields)
+    models_fields = {m: fields for m, fields in models_fields.items() if m not in aggregated}
+    if not models_fields:
+        return aggregated
+    fact_model = fact_model if fact_model in models_fields else _sample_fact_model(models_fields, schema)
+    records_by_model = {}
+
+    def relations(model_name):
+        fields_meta = schema.get(model_name, {})
+        for field in models_fields[model_name]:
+            meta = fields_meta.get(field, {})
+            if meta.get('type') in etl_runtime.MANY2ONE_TYPES and meta.get('relation') in models_fields:
+                yield field, meta['relation']
+
+    def fetch(model_name, extra_domain, limit):
+        records_by_model[model_name] = models_proxy.execute_kw(
+            db, uid, password, model_name, 'search_read', [list(domains.get(model_name, [])) + extra_domain],
+            {'fields': models_fields[model_name], 'limit': limit, 'order': 'id asc'}
+        )
+
+    fetch(fact_model, [], sample_size)
+    while len(records_by_model) < len(models_fields):
+        progressed = False
+        for model_name in models_fields:
+            if model_name in records_by_model:
+                continue
+            # Enregistrements référencés par les modèles déjà échantillonnés
+            referenced_ids = {
+                record[field][0]
+                for source, records in records_by_model.items()
+                for field, target in relations(source) if target == model_name
+                for record in records if record.get(field)
+            }
+            if referenced_ids:
+                fetch(model_name, [('id', 'in', sorted(referenced_ids))], len(referenced_ids))
+                progressed = True
+                continue
+            # Enregistrements qui référencent les modèles déjà échantillonnés (lignes d'une facture...)
+            for field, target in relations(model_name):
+                if target in records_by_model:
+                    target_ids = [record['id'] for record in records_by_model[target]]
+                    fetch(model_name, [(field, 'in', target_ids)], sample_size * 10)
+                    progressed = True
+                    break
+        if not progressed:
+            fetch(next(m for m in models_fields if m not in records_by_model), [], sample_size)
+
+    sample = dict(aggregated)
+    indexed_models = {target for _, _, target in etl_runtime.join_graph(models_fields, schema)}
+    for model_name, fields in models_fields.items():
+        field_types = etl_runtime.field_types_from_schema(schema.get(model_name))
+        sample[model_name] = etl_runtime.compact_frame(
+            etl_runtime.records_to_frame(records_by_model[model_name], field_types, columns=fields), field_types
+        )
+        if model_name in indexed_models:
+            sample[model_name] = etl_runtime.index_by_id(sample[model_name])
+    return {model_name: sample[model_name] for model_name in all_models}
+
+
+def _extract_model(url, db, uid, password, protocol, model_name, fields, domain, chunk_size, field_types, frames, progress_queue, stop_event,
+                   cache_key=None, aggregation=None):
+    """
+    Extrait l'intégralité d'un modèle dans un thread du pool et le range dans `frames`
+    (`etl_runtime.ModelFrames` : en mémoire ou sur disque selon le budget mémoire).
+    Tous les threads partagent le client de la connexion et son pool de connexions HTTP.
+    Chaque lot est converti en dtypes compacts dès sa réception (`etl_runtime.compact_frame`).
+    Avec `cache_key`, les lots sont lus depuis (ou enregistrés dans) `extraction_cache`.
+    Avec `aggregation`, seul le résultat agrégé par Odoo est extrait (`etl_runtime.extract_aggregation`).
+    Retourne (lignes, octets avant compaction, octets après compaction, servi depuis le cache).
+    """
+    models_proxy = odoo_client.get_client(url, db, uid, protocol=protocol)
+    if field_types is None:
+        field_types = etl_runtime.get_field_types(models_proxy, db, uid, password, model_name, fields)
+    stats = {'rows': 0, 'raw_bytes': 0}
+
+    if aggregation:
+        df = etl_runtime.extract_aggregation(models_proxy, db, uid, password, model_name, aggregation, domain, field_types)
+        rows, compact_bytes, _ = frames.collect(model_name, [df], field_types, columns=list(df.columns))
+        return rows, 0, compact_bytes, False
+
+    # Une seule consultation du cache : l'entrée ouverte reste lisible même si elle expire ensuite
+    cached_entry = extraction_cache.default_cache.open(cache_key) if cache_key is not None else None
+    from_cache = cached_entry is not None
+
+    def compact_chunks():
+        if from_cache:
+            source = extraction_cache.default_cache.read(cached_entry)
+        else:
+            source = iter_compact_chunks(
+                models_proxy, db, uid, password, model_name, fields,
+                domain=domain, chunk_size=chunk_size, field_types=field_types, stats=stats
             )
+            if cache_key is not None:
+                source = extraction_cache.default_cache.store(cache_key, source, field_types)
+        received = 0
+        for df_chunk in source:
+            if stop_event.is_set():
+                return
+            received += len(df_chunk)
+            progress_queue.put((model_name, received, False))
+            yield df_chunk
 
-            if not records:
-                print("Fin de la récupération : plus de données.")
-                break
+    rows, compact_bytes, _ = frames.collect(model_name, compact_chunks(), field_types, columns=fields)
+    return rows, stats['raw_bytes'], compact_bytes, from_cache
 
-            processed_data = []
-            for record in records:
-                new_record = {}
-                for field, value in record.items():
-                    if isinstance(value, list) and len(value) == 2 and isinstance(value[0], int):
-                        new_record[field] = value[0]
-                    elif isinstance(value, (dict, list)):
-                        new_record[field] = str(value)
-                    else:
-                        new_record[field] = value
-                processed_data.append(new_record)
 
-            yield pd.DataFrame(processed_data)
+def extract_models_concurrently(url, db, uid, password, models_fields, domains=None, chunk_size=2000,
+                                max_workers=None, on_progress=None, protocol=None, schema=None, memory_report=None,
+                                memory_budget=None, cache_connection_key=None, cache_hits=None, aggregations=None,
+                                indexed_models=None):
+    """
+    Extrait plusieurs modèles Odoo en parallèle avec un pool de threads borné.
+    `on_progress(model_name, rows, done)` est toujours appelé depuis le thread appelant
+    (indispensable pour mettre à jour les widgets Streamlit).
+    `schema` ({modèle: {champ: métadonnées}}, voir `schema_cache.get_fields`) évite un `fields_get` par modèle.
+    Si `memory_report` (dict) est fourni, il reçoit {modèle: (octets avant, octets après compaction)}.
+    `memory_budget` (octets, défaut : ODOO_MEMORY_BUDGET_MB) borne la mémoire occupée par les données
+    extraites : les modèles qui le dépassent sont écrits en Parquet et chargés à la demande.
+    Retourne un `etl_runtime.ModelFrames` ({nom_du_modèle: DataFrame}, dans l'ordre du plan) attendu
+    par `ai_services.run_ai_code` ; appeler sa méthode `close()` une fois la transformation terminée.
+    `cache_connection_key` (voir `schema_cache.connection_key`) active le cache disque des extractions
+    (`extraction_cache`) ; `cache_hits` (liste) reçoit alors les modèles servis sans appel à Odoo.
+    `aggregations` ({modèle: {"groupby": [...], "aggregates": [...]}}) : modèles dont seul le résultat
+    agrégé par Odoo (`read_group`) est extrait ; ils ne passent ni par le cache ni par `memory_report`.
+    Les modèles de `indexed_models` (par défaut les cibles des many2one du plan, voir `etl_runtime.join_graph`)
+    sont indexés par id pour `etl_runtime.lookup`.
+    """
+    domains = domains or {}
+    schema = schema or {}
+    aggregations = aggregations or {}
+    max_workers = max(1, min(max_workers or MAX_WORKERS_PER_CONNECTION, len(models_fields) or 1))
+    progress_queue = queue.Queue()
+    stop_event = threading.Event()
+    if indexed_models is None:
+        indexed_models = {target for _, _, target in etl_runtime.join_graph(models_fields, schema)}
+    frames = etl_runtime.ModelFrames(models_fields, memory_budget=memory_budget, indexed_models=indexed_models)
 
-            offset += chunk_size
+    def drain_progress():
+        while True:
+            try:
+                model_name, rows, done = progress_queue.get_nowait()
+            except queue.Empty:
+                return
+            if on_progress:
+                on_progress(model_name, rows, done)
 
-        except Exception as e:
-            print(f"Une erreur est survenue lors de la récupération du lot à l'offset {offset}: {e}")
-            raise e
\ No newline at end of file
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="odoo-extract")
+    try:
+        futures = {
+            executor.submit(
+                _extract_model, url, db, uid, password, protocol, model_name, fields,
+                domains.get(model_name, []), chunk_size,
+                etl_runtime.field_types_from_schema(schema[model_name]) if model_name in schema else None,
+                frames, progress_queue, stop_event,
+                extraction_cache.extraction_key(cache_connection_key, model_name, fields, domains.get(model_name, []))
+                if cache_connection_key and model_name not in aggregations else None,
+                aggregations.get(model_name)
+            ): model_name
+            for model_name, fields in models_fields.items()
+        }
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+            drain_progress()
+            for future in done:
+                model_name = futures[future]
+                rows, raw_bytes, compact_bytes, from_cache = future.result()
+                if from_cache:
+                    if cache_hits is not None:
+                        cache_hits.append(model_name)
+                elif memory_report is not None and model_name not in aggregations:
+                    memory_report[model_name] = (raw_bytes, compact_bytes)
+                progress_queue.put((model_name, rows, True))
+        drain_progress()
+    except BaseException:
+        # Erreur d'un modèle ou arrêt du script Streamlit : les threads encore actifs s'arrêtent au
+        # lot suivant ; on attend qu'ils aient fini d'écrire dans `frames` avant de supprimer son
+        # répertoire de travail
+        stop_event.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+        frames.close()
+        raise
+    executor.shutdown(wait=True)
+
+    return frames
@@ -0,0 +1,209 @@
+# odoo_client.py
+"""
+Client RPC Odoo partagé par toute l'application.
+
+Une seule session HTTP (keep-alive + pool de connexions) est ouverte par serveur Odoo et
+un seul client par connexion (url, db, uid) : les appels de `odoo.py`, `ai_services.py`
+et des threads d'extraction réutilisent les mêmes connexions TCP/TLS au lieu d'en ouvrir
+une nouvelle à chaque `ServerProxy`.
+
+Deux protocoles sont disponibles, au choix pour chaque connexion : XML-RPC (`/xmlrpc/2/*`)
+et JSON-RPC (`/jsonrpc`), plus compact et beaucoup plus rapide à décoder en Python.
+
+Ce fichier est aussi recopié tel quel dans le `main.py` généré par `gcp.py` :
+il ne doit dépendre que de la bibliothèque standard et de `requests`.
+"""
+import itertools
+import json
+import os
+import threading
+import time
+import xmlrpc.client
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# --- Configuration (surchargeable par variables d'environnement) ---
+CONNECT_TIMEOUT = float(os.getenv("ODOO_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.getenv("ODOO_RPC_TIMEOUT", "120"))
+POOL_SIZE = int(os.getenv("ODOO_POOL_SIZE", "8"))
+DEFAULT_PROTOCOL = os.getenv("ODOO_RPC_PROTOCOL", "xmlrpc")
+
+
+class PooledTransport(xmlrpc.client.Transport):
+    """Transport XML-RPC qui passe par une `requests.Session` (connexions persistantes et réutilisées)."""
+
+    def __init__(self, session, scheme, timeout):
+        super().__init__()
+        self.session = session
+        self.scheme = scheme
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def last_response_bytes(self):
+        """Taille (en octets) de la dernière réponse reçue par le thread courant."""
+        return getattr(self._local, 'response_bytes', 0)
+
+    def request(self, host, handler, request_body, verbose=False):
+        url = f"{self.scheme}://{host}{handler}"
+        response = self.session.post(
+            url, data=request_body, headers={'Content-Type': 'text/xml'}, timeout=self.timeout
+        )
+        if response.status_code != 200:
+            raise xmlrpc.client.ProtocolError(url, response.status_code, response.reason, dict(response.headers))
+        self._local.response_bytes = len(response.content)
+        parser, unmarshaller = self.getparser()
+        parser.feed(response.content)
+        parser.close()
+        return unmarshaller.close()
+
+
+class XmlRpcBackend:
+    """Backend XML-RPC : services `common` et `object` exposés sous `/xmlrpc/2/`."""
+
+    def __init__(self, url, session, timeout):
+        self.transport = PooledTransport(session, urlsplit(url).scheme or 'http', timeout)
+        self._proxies = {
+            service: xmlrpc.client.ServerProxy(f'{url}/xmlrpc/2/{service}', transport=self.transport)
+            for service in ('common', 'object')
+        }
+
+    @property
+    def last_response_bytes(self):
+        return self.transport.last_response_bytes
+
+    def call(self, service, method, *args):
+        return getattr(self._proxies[service], method)(*args)
+
+
+class JsonRpcBackend:
+    """Backend JSON-RPC : un seul point d'entrée `/jsonrpc`, mêmes services et mêmes arguments."""
+
+    def __init__(self, url, session, timeout):
+        self.endpoint = f'{url}/jsonrpc'
+        self.session = session
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self._local = threading.local()
+
+    @property
+    def last_response_bytes(self):
+        return getattr(self._local, 'response_bytes', 0)
+
+    def call(self, service, method, *args):
+        payload = {
+            'jsonrpc': '2.0', 'method': 'call', 'id': next(self._ids),
+            'params': {'service': service, 'method': method, 'args': args},
+        }
+        response = self.session.post(self.endpoint, json=payload, timeout=self.timeout)
+        if response.status_code != 200:
+            raise xmlrpc.client.ProtocolError(self.endpoint, response.status_code, response.reason, dict(response.headers))
+        self._local.response_bytes = len(response.content)
+        body = json.loads(response.content)
+        if body.get('error'):
+            # Même type d'erreur qu'en XML-RPC pour que les appelants n'aient qu'un cas à gérer
+            error = body['error']
+            message = (error.get('data') or {}).get('message') or error.get('message')
+            raise xmlrpc.client.Fault(error.get('code', 0), message)
+        return body.get('result')
+
+
+BACKENDS = {'xmlrpc': XmlRpcBackend, 'jsonrpc': JsonRpcBackend}
+
+
+class OdooClient:
+    """
+    Client Odoo pour une connexion (url, db, uid) et un protocole donné.
+    `execute_kw` a la même signature que `ServerProxy.execute_kw` : le client peut remplacer
+    directement un proxy `xmlrpc/2/object` existant. Il est utilisable depuis plusieurs threads.
+    """
+
+    def __init__(self, url, db, uid, session, timeout, protocol=DEFAULT_PROTOCOL):
+        if protocol not in BACKENDS:
+            raise ValueError(f"Protocole RPC inconnu : {protocol}. Valeurs possibles : {', '.join(BACKENDS)}.")
+        self.url = url
+        self.db = db
+        self.uid = uid
+        self.protocol = protocol
+        self.session = session
+        self.backend = BACKENDS[protocol](url, session, timeout)
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def _timed(self, name, service, method, *args):
+        start = time.perf_counter()
+        error = False
+        try:
+            return self.backend.call(service, method, *args)
+        except Exception:
+            error = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                stat = self._stats.setdefault(name, {'calls': 0, 'errors': 0, 'total_s': 0.0, 'max_s': 0.0, 'bytes': 0})
+                stat['calls'] += 1
+                stat['errors'] += int(error)
+                stat['total_s'] += elapsed
+                stat['max_s'] = max(stat['max_s'], elapsed)
+                stat['bytes'] += 0 if error else self.backend.last_response_bytes
+
+    @property
+    def last_response_bytes(self):
+        """Taille (en octets) de la dernière réponse reçue par le thread courant."""
+        return self.backend.last_response_bytes
+
+    def authenticate(self, username, password):
+        """Authentifie l'utilisateur et retourne son uid (False en cas d'échec)."""
+        return self._timed('authenticate', 'common', 'authenticate', self.db, username, password, {})
+
+    def execute_kw(self, db, uid, password, model, method, args, kwargs=None):
+        return self._timed(method, 'object', 'execute_kw', db, uid, password, model, method, args, kwargs or {})
+
+    def stats(self):
+        """Compteurs de latence par méthode RPC : nombre d'appels, erreurs, temps total/moyen/max, octets reçus."""
+        with self._stats_lock:
+            return {
+                name: {**stat, 'avg_ms': round(1000 * stat['total_s'] / stat['calls'], 1) if stat['calls'] else 0.0}
+                for name, stat in self._stats.items()
+            }
+
+
+# --- Registre des sessions et des clients (partagés par tout le processus) ---
+_sessions = {}
+_clients = {}
+_registry_lock = threading.Lock()
+
+
+def _get_session(url, pool_size):
+    session = _sessions.get((url, pool_size))
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _sessions[(url, pool_size)] = session
+    return session
+
+
+def get_client(url, db, uid=None, protocol=None, connect_timeout=None, read_timeout=None, pool_size=None):
+    """
+    Retourne le client partagé pour (url, db, uid, protocole, délais, taille du pool), en le
+    créant au premier appel : des délais ou une taille de pool différents donnent un autre client.
+    Le client sans uid sert uniquement à l'authentification ; tous les clients d'un même
+    serveur (et d'une même taille de pool) partagent la même session HTTP.
+    """
+    url = url.rstrip('/')
+    protocol = protocol or DEFAULT_PROTOCOL
+    timeout = (connect_timeout or CONNECT_TIMEOUT, read_timeout or READ_TIMEOUT)
+    pool_size = pool_size or POOL_SIZE
+    key = (url, db, uid, protocol, timeout, pool_size)
+    with _registry_lock:
+        client = _clients.get(key)
+        if client is None:
+            session = _get_session(url, pool_size)
+            client = OdooClient(url, db, uid, session, timeout, protocol=protocol)
+            _clients[key] = client
+        return client
@@ -7,6 +7,7 @@ import json
 import traceback
 import xmlrpc.client
 import os
+import time
 
 # Import des modules locaux
 import database as db
@@ -15,6 +16,10 @@ import ai_services
 import gcp
 import utils
 import kms_services
+import schema_cache
+import extraction_cache
+import code_analysis
+import etl_runtime
 
 # --- CONFIGURATION DE LA PAGE ---
 st.set_page_config(layout="wide", page_title="Odoo AI Transformer - App", page_icon="🚀")
@@ -56,11 +61,13 @@ with st.sidebar:
                 st.session_state.url_input = selected_conn_data['url']
                 st.session_state.db_input = selected_conn_data['db_name']
                 st.session_state.username_input = selected_conn_data['username']
+                st.session_state.protocol_input = selected_conn_data.get('protocol', 'xmlrpc')
                 st.session_state.conn_details = selected_conn_data
         else:
             st.session_state.url_input = ""
             st.session_state.db_input = ""
             st.session_state.username_input = ""
+            st.session_state.protocol_input = "xmlrpc"
             st.session_state.conn_details = {}
         st.session_state.selected_connection = selected_name
         # Réinitialiser le flot à chaque changement de connexion
@@ -74,8 +81,17 @@ with st.sidebar:
     st.text_input("Base de données", key='db_input')
     st.text_input("Utilisateur (email)", key='username_input')
     st.text_input("Mot de passe / Clé API", type="password", key='password_input', help="Laissez vide si vous utilisez une connexion sauvegardée.")
+    st.selectbox("Protocole RPC", ["xmlrpc", "jsonrpc"], key='protocol_input', help="JSON-RPC produit des réponses plus compactes et plus rapides à décoder sur les gros volumes.")
     st.button("Se connecter", on_click=odoo.attempt_connection)
 
+    if st.session_state.get('connection_success') and hasattr(st.session_state.get('models_proxy'), 'stats'):
+        with st.expander("📡 Statistiques des appels Odoo"):
+            rpc_stats = st.session_state.models_proxy.stats()
+            if rpc_stats:
+                st.dataframe(pd.DataFrame.from_dict(rpc_stats, orient='index')[['calls', 'errors', 'avg_ms', 'max_s', 'bytes']])
+            else:
+                st.caption("Aucun appel Odoo pour le moment.")
+
 # --- INTERFACE PRINCIPALE ---
 st.title("🚀 Application Odoo AI Data Transformer")
 
@@ -93,6 +109,12 @@ else:
         st.warning("⚠️ **Avertissement de sécurité :** Cette application exécute du code généré par une IA. Vérifiez toujours le code avant de l'exécuter dans un environnement de production.", icon="🛡️")
         
         st.header("1. Décrire l'objectif de l'extraction")
+        if st.button("🔄 Rafraîchir le schéma Odoo", help="Le schéma (modèles et champs) est mis en cache pour la connexion. Rechargez-le après l'installation d'un module ou l'ajout de champs personnalisés."):
+            schema_cache.invalidate(schema_cache.connection_key(
+                st.session_state.conn_details['url'], st.session_state.conn_details['db'], st.session_state.uid
+            ))
+            st.session_state.models = {}
+            st.success("Le schéma Odoo sera rechargé lors de la prochaine génération de plan.")
         with st.form(key="prompt_form"):
             st.subheader("Formulaire Guidé pour l'IA")
             title = st.text_input("Titre du rapport", help="Ex: 'Analyse des ventes trimestrielles'")
@@ -101,6 +123,10 @@ else:
             filters = st.text_area("Filtres et conditions", height=100, help="Ex: 'uniquement les factures de l'année 2024'")
             calculations = st.text_area("Calculs ou agrégations (Optionnel)", height=100, help="Ex: 'somme des ventes par commercial'")
             sorting = st.text_input("Tri des résultats (Optionnel)", help="Ex: 'par date décroissante'")
+            regenerate = st.checkbox(
+                "🔁 Régénérer le plan", key="regenerate_plan_input",
+                help="Une demande identique sur le même schéma réutilise le plan déjà généré, sans appel à l'IA. Cochez pour en demander un nouveau."
+            )
             submitted = st.form_submit_button("🤖 Générer le plan de transformation")
 
         if submitted:
@@ -110,14 +136,22 @@ else:
                 user_prompt = f"Titre du rapport: {title}\nLe sujet principal est: {subject}\nJe veux les colonnes suivantes: {columns}\nApplique ces filtres: {filters}\nFais ces calculs: {calculations}\nEt trie les résultats par: {sorting}"
                 st.session_state.user_prompt_for_viz = user_prompt
                 with st.spinner("Génération du plan de transformation..."):
-                    ai_plan = ai_services.get_ai_plan(user_prompt)
+                    ai_plan = ai_services.get_ai_plan(user_prompt, use_cache=not regenerate)
                 if ai_plan:
                     st.session_state.ai_models_fields = ai_plan.get('models_and_fields')
                     st.session_state.ai_python_code = ai_plan.get('python_code')
+                    st.session_state.ai_domains = ai_plan.get('domains') or {}
+                    st.session_state.ai_aggregations = ai_plan.get('aggregations') or {}
+                    st.session_state.ai_joins = ai_plan.get('joins') or []
+                    st.session_state.ai_streaming_fact_model = ai_plan.get('streaming_fact_model')
+                    st.session_state.ai_pruned_fields = ai_plan.get('pruned_fields') or {}
                     st.session_state.transformed_df = None
                     st.session_state.gcp_code_generated = False
                     st.session_state.viz_guide = None
-                    st.success("Plan de transformation généré avec succès !")
+                    if ai_plan.get('from_cache'):
+                        st.success("Plan de transformation réutilisé depuis le cache (demande identique déjà traitée).")
+                    else:
+                        st.success("Plan de transformation généré avec succès !")
         
         if st.session_state.get('ai_python_code'):
             st.divider()
@@ -125,53 +159,203 @@ else:
             with st.expander("🔍 Plan de transformation de l'IA", expanded=True):
                 st.write("**L'IA a généré le plan suivant :**")
                 st.json(st.session_state.ai_models_fields)
+                if st.session_state.get('ai_pruned_fields'):
+                    st.write("**Champs proposés par l'IA mais inutilisés par le code (non extraits) :**")
+                    st.json(st.session_state.ai_pruned_fields)
+                if st.session_state.get('ai_domains'):
+                    st.write("**Filtres appliqués directement dans Odoo :**")
+                    st.json(st.session_state.ai_domains)
+                if st.session_state.get('ai_aggregations'):
+                    st.write("**Agrégations calculées directement par Odoo (seul le résultat est extrait) :**")
+                    st.json(st.session_state.ai_aggregations)
+                if st.session_state.get('ai_joins'):
+                    st.write("**Relations many2one disponibles pour `lookup` (modèles liés indexés par id) :**")
+                    st.markdown('\n'.join(f"- `{model}.{field}` → `{target}`" for model, field, target in st.session_state.ai_joins))
                 st.code(st.session_state.ai_python_code, language='python')
 
+            streaming_candidate, streaming_blockers = code_analysis.streaming_fact_model(
+                st.session_state.ai_python_code, st.session_state.ai_models_fields,
+                st.session_state.get('ai_streaming_fact_model'),
+                st.session_state.get('ai_aggregations')
+            )
+            if streaming_candidate:
+                st.checkbox(
+                    f"🌊 Exécution en flux sur `{streaming_candidate}`",
+                    value=True, key="streaming_input",
+                    help="La transformation est ligne à ligne : elle est appliquée à chaque lot du modèle principal dès sa réception, sans attendre la fin de l'extraction ni charger tout le modèle en mémoire."
+                )
+            elif st.session_state.get('ai_streaming_fact_model'):
+                st.caption(f"Exécution en flux impossible : {', '.join(streaming_blockers)}.")
+            streaming_model = streaming_candidate if st.session_state.get('streaming_input') else None
+
+            cache_col, refresh_col = st.columns([3, 1])
+            with cache_col:
+                st.checkbox(
+                    "♻️ Réutiliser les données déjà extraites",
+                    value=True, key="use_extraction_cache_input",
+                    help=f"Les données brutes d'un modèle (mêmes champs, mêmes filtres) sont conservées {extraction_cache.EXTRACTION_CACHE_TTL // 60} minutes : modifier le code de transformation ne relance pas l'extraction."
+                )
+            with refresh_col:
+                if st.button("🔄 Rafraîchir les données"):
+                    extraction_cache.default_cache.invalidate(schema_cache.connection_key(
+                        st.session_state.conn_details['url'], st.session_state.conn_details['db'], st.session_state.uid
+                    ))
+                    st.success("Les données seront extraites à nouveau depuis Odoo.")
+
+            preview_col, sample_col = st.columns([3, 1])
+            with sample_col:
+                st.number_input("Taille de l'échantillon", min_value=10, max_value=5000, value=200, step=50, key="preview_size_input")
+            with preview_col:
+                preview_clicked = st.button(
+                    "🧪 Tester le code sur un échantillon",
+                    help="Extrait quelques enregistrements du modèle principal et les enregistrements liés des autres modèles, puis exécute le code de l'IA : les erreurs apparaissent en quelques secondes, avant l'extraction complète."
+                )
+            if preview_clicked:
+                preview_df = None
+                with st.spinner("Extraction d'un échantillon et test du code de l'IA..."):
+                    preview_start = time.perf_counter()
+                    try:
+                        sample = odoo.extract_sample(
+                            st.session_state.models_proxy, st.session_state.conn_details['db'], st.session_state.uid,
+                            st.session_state.password_to_use, st.session_state.ai_models_fields,
+                            schema_cache.get_fields(
+                                st.session_state.models_proxy, st.session_state.conn_details['db'], st.session_state.uid,
+                                st.session_state.password_to_use,
+                                schema_cache.connection_key(st.session_state.conn_details['url'], st.session_state.conn_details['db'], st.session_state.uid),
+                                list(st.session_state.ai_models_fields)
+                            ),
+                            domains=st.session_state.get('ai_domains'),
+                            sample_size=int(st.session_state.preview_size_input),
+                            fact_model=st.session_state.get('ai_streaming_fact_model'),
+                            aggregations=st.session_state.get('ai_aggregations')
+                        )
+                    except Exception as e:
+                        sample = None
+                        st.error(f"Erreur durant l'extraction de l'échantillon : {e}")
+                    if sample is not None:
+                        preview_df = ai_services.run_ai_code(st.session_state.ai_python_code, sample)
+                if isinstance(preview_df, pd.DataFrame):
+                    sample_rows = ', '.join(f"`{m}` : {len(df)}" for m, df in sample.items())
+                    st.success(f"Le code s'exécute sans erreur sur l'échantillon ({sample_rows}) en {time.perf_counter() - preview_start:.1f} s — {len(preview_df)} lignes produites.")
+                    st.write("**Schéma du résultat :**")
+                    st.dataframe(pd.DataFrame({
+                        'Type': preview_df.dtypes.astype(str),
+                        'Valeurs renseignées': preview_df.notna().sum()
+                    }))
+                    st.dataframe(preview_df.head(20))
+                elif preview_df is not None:
+                    st.error(f"Le code de l'IA doit retourner un DataFrame (type obtenu : {type(preview_df).__name__}).")
+
             if st.button("▶️ Exécuter le plan (Extraction + Transformation)"):
                 dataframes = {}
-                st.info("Démarrage de l'extraction optimisée des données Odoo...")
+                memory_report = {}
+                cache_hits = []
+                conn_key = schema_cache.connection_key(st.session_state.conn_details['url'], st.session_state.conn_details['db'], st.session_state.uid)
+                plan_schema = schema_cache.get_fields(
+                    st.session_state.models_proxy, st.session_state.conn_details['db'], st.session_state.uid,
+                    st.session_state.password_to_use, conn_key, list(st.session_state.ai_models_fields)
+                )
+                st.info("Démarrage de l'extraction optimisée des données Odoo (modèles extraits en parallèle)...")
                 try:
                     total_models = len(st.session_state.ai_models_fields)
-                    model_count = 0
-                    for model_name, fields in st.session_state.ai_models_fields.items():
-                        model_count += 1
-                        st.write(f"---")
+                    progress_bars = {}
+                    for model_count, model_name in enumerate(st.session_state.ai_models_fields, start=1):
                         st.write(f"**Modèle {model_count}/{total_models} : `{model_name}`**")
-                        list_of_chunks = []
-                        total_rows_for_model = 0
-                        progress_bar = st.progress(0, text=f"Initialisation de l'extraction pour `{model_name}`...")
-                        
-                        data_generator = odoo.get_large_dataset_paginated(
-                            models_proxy=st.session_state.models_proxy, 
-                            db=st.session_state.conn_details['db'], 
-                            uid=st.session_state.uid, 
-                            password=st.session_state.password_to_use,
-                            model_name=model_name, 
-                            domain=[], 
-                            fields=fields, 
-                            chunk_size=2000
-                        )
-                        
-                        for i, df_chunk in enumerate(data_generator):
-                            if not df_chunk.empty:
-                                list_of_chunks.append(df_chunk)
-                                total_rows_for_model += len(df_chunk)
-                                progress_bar.progress(max(0.0, (i % 50) / 49.0), text=f"Extraction de `{model_name}`... {total_rows_for_model} lignes reçues.")
-                        
-                        progress_bar.progress(1.0, text=f"Extraction de `{model_name}` terminée. {total_rows_for_model} lignes au total.")
-                        
-                        if list_of_chunks:
-                            dataframes[model_name] = pd.concat(list_of_chunks, ignore_index=True)
+                        progress_bars[model_name] = st.progress(0, text=f"Initialisation de l'extraction pour `{model_name}`...")
+
+                    chunk_counters = {model_name: 0 for model_name in progress_bars}
+
+                    def update_progress(model_name, rows, done):
+                        if done:
+                            progress_bars[model_name].progress(1.0, text=f"Extraction de `{model_name}` terminée. {rows} lignes au total.")
                         else:
-                            dataframes[model_name] = pd.DataFrame(columns=fields)
-                    st.success("Toutes les données brutes ont été extraites avec succès.")
+                            chunk_counters[model_name] += 1
+                            progress_bars[model_name].progress(max(0.0, (chunk_counters[model_name] % 50) / 49.0), text=f"Extraction de `{model_name}`... {rows} lignes reçues.")
+
+                    # En flux, le modèle principal n'est pas extrait ici : il est lu pendant la transformation
+                    dataframes = odoo.extract_models_concurrently(
+                        url=st.session_state.conn_details['url'],
+                        db=st.session_state.conn_details['db'],
+                        uid=st.session_state.uid,
+                        password=st.session_state.password_to_use,
+                        models_fields={m: f for m, f in st.session_state.ai_models_fields.items() if m != streaming_model},
+                        domains=st.session_state.get('ai_domains'),
+                        chunk_size=2000,
+                        on_progress=update_progress,
+                        protocol=st.session_state.conn_details.get('protocol'),
+                        memory_report=memory_report,
+                        schema=plan_schema,
+                        cache_connection_key=conn_key if st.session_state.get('use_extraction_cache_input') else None,
+                        cache_hits=cache_hits,
+                        aggregations=st.session_state.get('ai_aggregations'),
+                        # Cibles calculées sur le plan complet : le modèle principal traité en flux en fait partie
+                        indexed_models={target for _, _, target in etl_runtime.join_graph(st.session_state.ai_models_fields, plan_schema)}
+                    )
+                    if streaming_model:
+                        st.success("Les modèles secondaires ont été extraits ; le modèle principal est traité en flux.")
+                    else:
+                        st.success("Toutes les données brutes ont été extraites avec succès.")
+                    if cache_hits:
+                        st.caption(f"♻️ Servis depuis le cache, sans appel à Odoo : {', '.join(f'`{m}`' for m in cache_hits)}")
+                    if memory_report:
+                        with st.expander("🧮 Empreinte mémoire des données extraites"):
+                            memory_df = pd.DataFrame(
+                                [(model_name, raw / 1024**2, compact / 1024**2) for model_name, (raw, compact) in memory_report.items()],
+                                columns=['Modèle', 'Avant (Mo)', 'Après typage (Mo)']
+                            ).set_index('Modèle')
+                            memory_df['Gain'] = (memory_df['Avant (Mo)'] / memory_df['Après typage (Mo)']).round(1).astype(str) + 'x'
+                            memory_df['Stockage'] = ['disque (Parquet)' if dataframes.is_spilled(m) else 'mémoire' for m in memory_df.index]
+                            st.dataframe(memory_df.round(2))
                 except Exception as e:
                     st.error(f"Erreur durant l'extraction des données Odoo : {e}")
                     st.stop()
                 
-                if dataframes:
+                if streaming_model:
+                    first_results = st.empty()
+                    fact_domain = st.session_state.get('ai_domains', {}).get(streaming_model) or []
+                    fact_field_types = etl_runtime.field_types_from_schema(plan_schema.get(streaming_model))
+                    fact_chunks = odoo.iter_compact_chunks(
+                        st.session_state.models_proxy, st.session_state.conn_details['db'], st.session_state.uid,
+                        st.session_state.password_to_use, streaming_model,
+                        st.session_state.ai_models_fields[streaming_model],
+                        domain=fact_domain, field_types=fact_field_types
+                    )
+                    if st.session_state.get('use_extraction_cache_input'):
+                        fact_chunks = extraction_cache.default_cache.chunks(
+                            extraction_cache.extraction_key(conn_key, streaming_model, st.session_state.ai_models_fields[streaming_model], fact_domain),
+                            fact_chunks, fact_field_types
+                        )
+
+                    def show_stream_progress(rows_read, result_chunk, rows_out):
+                        progress_bars[streaming_model].progress(
+                            max(0.0, (rows_read // 2000 % 50) / 49.0),
+                            text=f"Flux `{streaming_model}` : {rows_read} lignes lues, {rows_out} lignes produites."
+                        )
+                        if rows_out == len(result_chunk):
+                            first_results.dataframe(result_chunk.head(100))
+
+                    with st.spinner("Extraction et transformation en flux du modèle principal..."):
+                        try:
+                            result_df = ai_services.run_ai_code_streaming(
+                                st.session_state.ai_python_code, dataframes, streaming_model,
+                                fact_chunks,
+                                fact_columns=st.session_state.ai_models_fields[streaming_model],
+                                on_result=show_stream_progress
+                            )
+                        finally:
+                            dataframes.close()
+                            first_results.empty()
+                    if result_df is not None:
+                        progress_bars[streaming_model].progress(1.0, text=f"Flux `{streaming_model}` terminé.")
+                        st.session_state.transformed_df = result_df
+                        st.success("Transformation par l'IA réussie !")
+                elif dataframes:
                     with st.spinner("Exécution du code de transformation de l'IA..."):
-                        result_df = ai_services.run_ai_code(st.session_state.ai_python_code, dataframes)
+                        try:
+                            result_df = ai_services.run_ai_code(st.session_state.ai_python_code, dataframes)
+                        finally:
+                            # Libère les DataFrames et les fichiers Parquet temporaires de l'extraction
+                            dataframes.close()
                         if result_df is not None:
                             st.session_state.transformed_df = result_df
                             st.success("Transformation par l'IA réussie !")
@@ -184,6 +368,30 @@ else:
             st.subheader("Aperçu du résultat de la transformation :")
             st.dataframe(st.session_state.transformed_df)
             st.text_input("Nom de base pour les fichiers et la vue GCP :", key="gcp_file_name_input")
+            # Seules les lignes modifiées du modèle principal sont relues : le code doit être ligne à
+            # ligne et les dimensions (cibles des `lookup`) sont toujours rechargées entièrement
+            fact_model, fact_model_blockers = code_analysis.streaming_fact_model(
+                st.session_state.ai_python_code, st.session_state.ai_models_fields,
+                st.session_state.get('ai_streaming_fact_model'),
+                st.session_state.get('ai_aggregations')
+            )
+            if not fact_model:
+                incremental_mode = False
+                st.caption(f"Mode incrémental indisponible : {', '.join(fact_model_blockers)}.")
+            else:
+                incremental_mode = st.checkbox(
+                    "⚡ Mode incrémental",
+                    key="gcp_incremental_input",
+                    help="La Cloud Function ne récupère que les enregistrements du modèle principal modifiés depuis sa dernière exécution (filigrane `write_date`) et écrit des fichiers delta que la vue BigQuery replie sur le dernier chargement complet. Les enregistrements supprimés dans Odoo restent dans la vue jusqu'au prochain chargement complet, et la modification d'une dimension (partenaire, produit...) ne met pas à jour les lignes déjà chargées qui y font référence."
+                )
+            if incremental_mode:
+                st.caption(f"Modèle extrait en incrémental : `{fact_model}`. Les autres modèles sont rechargés entièrement à chaque exécution.")
+                result_columns = list(st.session_state.transformed_df.columns)
+                st.selectbox(
+                    "Colonne identifiant une ligne du résultat (clé de fusion dans BigQuery)",
+                    result_columns, index=result_columns.index('id') if 'id' in result_columns else 0,
+                    key="gcp_key_column_input"
+                )
             
             if st.button("✅ Valider et Générer le code GCP"):
                 file_name_prefix = st.session_state.gcp_file_name_input
@@ -200,6 +408,8 @@ else:
                             project_id = os.getenv("PROJECT_ID", "odoo-ai-transformer") 
                             dataset_id = re.sub(r'[^a-zA-Z0-9_]', '_', st.session_state.conn_details.get('db', 'odoo_dataset'))
                             view_name = f"v_{file_name_prefix}"
+                            incremental_models = [fact_model] if incremental_mode else []
+                            key_column = st.session_state.gcp_key_column_input if incremental_models else None
                             
                             st.subheader("A. Cloud Function (`main.py`)")
                             function_code = gcp.generate_gcp_function_code(
@@ -209,9 +419,16 @@ else:
                                 file_name_prefix=file_name_prefix, 
                                 model_fields_dict=st.session_state.ai_models_fields, 
                                 ai_python_code=st.session_state.ai_python_code,
-                                license_key=license_key
+                                license_key=license_key,
+                                incremental_models=incremental_models,
+                                model_domains=st.session_state.get('ai_domains'),
+                                model_aggregations=st.session_state.get('ai_aggregations'),
+                                streaming_fact_model=fact_model,
+                                protocol=st.session_state.conn_details.get('protocol') or 'xmlrpc'
                             )
                             st.code(function_code, language="python")
+                            if incremental_models:
+                                st.info("Pour forcer un rechargement complet, appelez la fonction avec `?full_refresh=1` (ou définissez la variable d'environnement `FULL_REFRESH=1`). Les suppressions dans Odoo ne sont propagées qu'à ce moment-là.")
 
                             st.subheader("B. Commande gcloud (création du secret Odoo)")
                             decrypted_password = kms_services.decrypt_password(st.session_state.conn_details['encrypted_password'])
@@ -220,10 +437,10 @@ else:
                             st.warning("⚠️ Clé API exposée ! N'exécutez cette commande que dans un terminal sécurisé et une seule fois.", icon="🔒")
 
                             st.subheader("C. Dépendances (`requirements.txt`)")
-                            st.code("pandas\ngoogle-cloud-storage\ngoogle-cloud-secret-manager\nrequests", language="text")
+                            st.code("pandas\npyarrow\ngoogle-cloud-storage\ngoogle-cloud-secret-manager\nrequests", language="text")
 
                             st.subheader("D. Vue BigQuery (`view.sql`)")
-                            st.code(gcp.generate_bigquery_view_code(project_id, dataset_id, view_name, file_name_prefix), language="sql")
+                            st.code(gcp.generate_bigquery_view_code(project_id, dataset_id, view_name, file_name_prefix, key_column=key_column), language="sql")
                         
                         st.success("Artefacts GCP générés.")
                         st.session_state.gcp_code_generated = True
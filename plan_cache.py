@@ -0,0 +1,39 @@
+# plan_cache.py
+"""
+Cache persistant des réponses de l'IA utilisées pour générer les plans de transformation.
+
+Les clés sont des empreintes du contenu de la demande (connexion, demande et document aux
+espaces près, consignes système, liste des modèles ou schéma ciblé) : une demande identique
+est servie instantanément, sans appel à l'IA. Une modification du schéma Odoo ou des
+consignes change l'empreinte, l'ancienne entrée finit alors évincée (TTL et LRU).
+"""
+import hashlib
+import json
+import os
+import unicodedata
+
+from disk_cache import JsonDiskCache
+
+PLAN_CACHE_TTL = int(os.getenv("PLAN_CACHE_TTL", str(7 * 24 * 3600)))
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "500"))
+
+_cache = JsonDiskCache('plans', ttl_seconds=PLAN_CACHE_TTL, max_entries=PLAN_CACHE_MAX_ENTRIES)
+
+
+def normalize_text(text):
+    """Texte libre comparé aux espaces et à la forme Unicode près (la casse est significative)."""
+    return ' '.join(unicodedata.normalize('NFC', text or '').split())
+
+
+def content_key(conn_key, step, *parts):
+    """Empreinte d'une étape de génération (`step`) pour une connexion et un contenu donnés."""
+    payload = json.dumps([conn_key, step, *parts], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def get(key):
+    return _cache.get(key)
+
+
+def store(key, value):
+    _cache.set(key, value)
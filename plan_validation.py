@@ -0,0 +1,155 @@
+# plan_validation.py
+"""
+Validation du plan renvoyé par l'IA contre le schéma Odoo réel, avant toute extraction.
+"""
+import etl_runtime
+
+DOMAIN_OPERATORS = {
+    '=', '!=', '>', '>=', '<', '<=', '=?', '=like', '=ilike', 'like', 'not like', 'ilike', 'not ilike',
+    'in', 'not in', 'child_of', 'parent_of', 'any', 'not any',
+}
+LOGICAL_OPERATORS = {'&': 2, '|': 2, '!': 1}
+
+
+def _validate_field_path(path, model_name, schema):
+    """Vérifie un chemin de champ (`partner_id.country_id.code`) en suivant les relations connues."""
+    current_model = model_name
+    for position, field_name in enumerate(path.split('.')):
+        fields = schema.get(current_model)
+        if fields is None:
+            # Modèle lié absent du schéma chargé : on ne peut pas vérifier plus loin
+            return None
+        meta = fields.get(field_name)
+        if meta is None:
+            return f"le champ `{field_name}` n'existe pas sur `{current_model}`"
+        if position == 0 and meta.get('store') is False:
+            return f"le champ `{field_name}` de `{current_model}` n'est pas stocké et ne peut pas servir de filtre"
+        current_model = meta.get('relation')
+        if not current_model:
+            # Champ non relationnel : il doit être le dernier du chemin
+            if position != len(path.split('.')) - 1:
+                return f"le champ `{field_name}` de `{model_name}` n'est pas relationnel"
+            return None
+    return None
+
+
+def validate_domain(domain, model_name, schema):
+    """
+    Valide un domaine Odoo (notation préfixée) pour `model_name`.
+    `schema` : {modèle: {champ: métadonnées}} (voir `schema_cache.get_fields`).
+    Retourne la liste des erreurs (vide si le domaine est utilisable).
+    """
+    if not isinstance(domain, list):
+        return ["le domaine doit être une liste"]
+    if model_name not in schema:
+        return [f"schéma du modèle `{model_name}` indisponible"]
+
+    errors = []
+    pending = 0
+    # Lecture de droite à gauche : chaque opérateur logique consomme ses opérandes
+    for element in reversed(domain):
+        if isinstance(element, str):
+            arity = LOGICAL_OPERATORS.get(element)
+            if arity is None:
+                errors.append(f"opérateur logique inconnu `{element}`")
+                continue
+            if pending < arity:
+                errors.append(f"l'opérateur `{element}` n'a pas assez d'opérandes")
+                continue
+            pending -= arity - 1
+            continue
+        if not isinstance(element, (list, tuple)) or len(element) != 3:
+            errors.append(f"condition invalide `{element}` (attendu : [champ, opérateur, valeur])")
+            continue
+        field_path, operator, value = element
+        pending += 1
+        if not isinstance(field_path, str):
+            errors.append(f"nom de champ invalide `{field_path}`")
+            continue
+        if operator not in DOMAIN_OPERATORS:
+            errors.append(f"opérateur `{operator}` non supporté")
+        if operator in ('in', 'not in') and not isinstance(value, (list, tuple)):
+            errors.append(f"la valeur de `{field_path} {operator}` doit être une liste")
+        field_error = _validate_field_path(field_path, model_name, schema)
+        if field_error:
+            errors.append(field_error)
+    return errors
+
+
+def validate_plan_domains(domains, models_fields, schema):
+    """
+    Filtre les domaines proposés par l'IA : seuls les domaines valides de modèles présents
+    dans `models_fields` sont conservés. Retourne (domaines_valides, {modèle: erreurs}).
+    """
+    valid_domains = {}
+    rejected = {}
+    for model_name, domain in (domains or {}).items():
+        if model_name not in models_fields:
+            rejected[model_name] = ["modèle absent du plan d'extraction"]
+            continue
+        if not domain:
+            continue
+        errors = validate_domain(domain, model_name, schema)
+        if errors:
+            rejected[model_name] = errors
+        else:
+            valid_domains[model_name] = [list(element) if isinstance(element, tuple) else element for element in domain]
+    return valid_domains, rejected
+
+
+NUMERIC_TYPES = ('integer', 'float', 'monetary')
+UNGROUPABLE_TYPES = ('one2many', 'many2many', 'text', 'html', 'binary', 'json', 'properties')
+
+
+def validate_aggregation(spec, model_name, schema):
+    """
+    Valide une agrégation {"groupby": [...], "aggregates": [...]} pour `model_name`
+    (voir `etl_runtime.parse_aggregation`). Retourne la liste des erreurs.
+    """
+    if not isinstance(spec, dict) or not spec.get('aggregates') and not spec.get('groupby'):
+        return ["l'agrégation doit contenir `groupby` et/ou `aggregates`"]
+    fields = schema.get(model_name)
+    if fields is None:
+        return [f"schéma du modèle `{model_name}` indisponible"]
+
+    errors = []
+    for entry in spec.get('groupby') or []:
+        field, _, granularity = str(entry).partition(':')
+        meta = fields.get(field)
+        if meta is None:
+            errors.append(f"le champ de regroupement `{field}` n'existe pas sur `{model_name}`")
+        elif meta.get('type') in UNGROUPABLE_TYPES:
+            errors.append(f"le champ `{field}` ({meta.get('type')}) ne peut pas servir de regroupement")
+        elif granularity and (granularity not in etl_runtime.DATE_GRANULARITIES or meta.get('type') not in etl_runtime.DATE_FORMATS):
+            errors.append(f"granularité `{granularity}` invalide pour `{field}`")
+    for entry in spec.get('aggregates') or []:
+        field, _, function = str(entry).partition(':')
+        meta = fields.get(field)
+        if meta is None:
+            errors.append(f"le champ agrégé `{field}` n'existe pas sur `{model_name}`")
+        elif function not in etl_runtime.AGGREGATE_FUNCTIONS:
+            errors.append(f"fonction d'agrégation `{function}` non supportée pour `{field}`")
+        elif function not in ('count', 'count_distinct') and meta.get('type') not in NUMERIC_TYPES:
+            errors.append(f"`{function}` exige un champ numérique (`{field}` est {meta.get('type')})")
+    return errors
+
+
+def validate_plan_aggregations(aggregations, models_fields, schema):
+    """Comme `validate_plan_domains`, pour les agrégations proposées par l'IA."""
+    valid_aggregations = {}
+    rejected = {}
+    for model_name, spec in (aggregations or {}).items():
+        if model_name not in models_fields:
+            rejected[model_name] = ["modèle absent du plan d'extraction"]
+            continue
+        if not spec:
+            continue
+        errors = validate_aggregation(spec, model_name, schema)
+        if errors:
+            rejected[model_name] = errors
+        else:
+            valid_aggregations[model_name] = {
+                'groupby': [str(entry) for entry in spec.get('groupby') or []],
+                'aggregates': [str(entry) for entry in spec.get('aggregates') or []],
+            }
+    return valid_aggregations, rejected
@@ -0,0 +1,150 @@
+# schema_cache.py
+"""
+Cache persistant du schéma Odoo (liste `ir.model` et définitions de champs) par connexion.
+
+Le cache survit à la session du navigateur (stockage disque, voir `disk_cache.py`), expire
+après `SCHEMA_CACHE_TTL` secondes et est invalidé dès que la liste des modules installés
+change (installation, désinstallation ou mise à jour d'un module).
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import etl_runtime
+from disk_cache import JsonDiskCache
+
+SCHEMA_CACHE_TTL = int(os.getenv("SCHEMA_CACHE_TTL", str(24 * 3600)))
+# Délai minimal entre deux vérifications de l'empreinte des modules installés
+FINGERPRINT_CHECK_INTERVAL = int(os.getenv("SCHEMA_FINGERPRINT_INTERVAL", "600"))
+
+_cache = JsonDiskCache('schema', ttl_seconds=SCHEMA_CACHE_TTL)
+# Sérialise la fusion des champs lus en parallèle (préchargement du schéma par `ai_services`)
+_fields_lock = threading.Lock()
+
+
+def connection_key(url, db, uid):
+    """Clé de cache d'une connexion Odoo (les droits d'accès dépendent de l'utilisateur)."""
+    return f"{url.rstrip('/')}|{db}|{uid}"
+
+
+def modules_fingerprint(models_proxy, db, uid, password):
+    """
+    Empreinte des modules installés. Retourne None si l'utilisateur n'a pas accès à
+    `ir.module.module` : le cache ne repose alors plus que sur son TTL.
+    """
+    try:
+        modules = models_proxy.execute_kw(
+            db, uid, password, 'ir.module.module', 'search_read',
+            [[('state', '=', 'installed')]], {'fields': ['name', 'latest_version']}
+        )
+    except Exception as e:
+        logging.warning(f"Empreinte des modules Odoo indisponible ({e}), le cache du schéma n'expirera que par TTL.")
+        return None
+    payload = sorted(f"{m['name']}:{m.get('latest_version')}" for m in modules)
+    return hashlib.sha256(json.dumps(payload).encode('utf-8')).hexdigest()
+
+
+def _load_entry(models_proxy, db, uid, password, conn_key, force_refresh=False):
+    """Retourne l'entrée de cache valide de la connexion (ou une entrée vide à remplir)."""
+    entry = None if force_refresh else _cache.get(conn_key)
+    now = time.time()
+
+    if entry and now - entry.get('checked_at', 0) > FINGERPRINT_CHECK_INTERVAL:
+        fingerprint = modules_fingerprint(models_proxy, db, uid, password)
+        if fingerprint != entry.get('fingerprint'):
+            print(f"Modules Odoo modifiés pour {conn_key} : invalidation du cache du schéma.")
+            entry = None
+        else:
+            entry['checked_at'] = now
+            _cache.set(conn_key, entry)
+
+    if not entry:
+        entry = {
+            'fingerprint': modules_fingerprint(models_proxy, db, uid, password),
+            'checked_at': now,
+            'models': None,
+            'fields': {},
+        }
+    return entry
+
+
+def get_models(models_proxy, db, uid, password, conn_key, force_refresh=False):
+    """Liste triée des noms techniques des modèles (`ir.model`), servie depuis le cache si possible."""
+    entry = _load_entry(models_proxy, db, uid, password, conn_key, force_refresh)
+    if entry['models'] is None:
+        model_data = models_proxy.execute_kw(
+            db, uid, password, 'ir.model', 'search_read', [[]], {'fields': ['model']}
+        )
+        entry['models'] = sorted([m['model'] for m in model_data if m.get('model')])
+        _cache.set(conn_key, entry)
+    return entry['models']
+
+
+def get_fields(models_proxy, db, uid, password, conn_key, model_names, force_refresh=False):
+    """
+    Définitions des champs {modèle: {champ: {type, relation, string, store, required}}}.
+    Seuls les modèles absents du cache sont demandés à Odoo, en une seule requête groupée.
+    Peut être appelée depuis plusieurs threads : les champs lus sont fusionnés dans l'entrée
+    la plus récente du cache.
+    """
+    entry = _load_entry(models_proxy, db, uid, password, conn_key, force_refresh)
+    missing = [m for m in model_names if m not in entry['fields']]
+    if missing:
+        fetched = etl_runtime.fetch_schema(models_proxy, db, uid, password, missing)
+        with _fields_lock:
+            current = _cache.get(conn_key)
+            if current and current.get('fingerprint') == entry.get('fingerprint'):
+                entry = current
+            entry['fields'].update(fetched)
+            _cache.set(conn_key, entry)
+    return {m: entry['fields'][m] for m in model_names if m in entry['fields']}
+
+
+def _user_lang(models_proxy, db, uid, password):
+    try:
+        users = models_proxy.execute_kw(db, uid, password, 'res.users', 'read', [[uid]], {'fields': ['lang']})
+        return (users[0].get('lang') if users else None) or None
+    except Exception as e:
+        logging.warning(f"Langue de l'utilisateur Odoo indisponible ({e}), libellés en anglais.")
+        return None
+
+
+def get_model_catalog(models_proxy, db, uid, password, conn_key, force_refresh=False):
+    """
+    Textes décrivant chaque modèle pour la présélection locale (`model_index`), dans la langue
+    de l'utilisateur : {'built_at', 'fingerprint', 'models': {modèle: [libellé, "champ libellé", ...]}}.
+    Volumineux, il est stocké à part du schéma et reconstruit quand les modules installés changent.
+    """
+    entry = _load_entry(models_proxy, db, uid, password, conn_key, force_refresh)
+    catalog = None if force_refresh else _cache.get(f"{conn_key}|catalog")
+    if catalog and catalog.get('fingerprint') == entry.get('fingerprint'):
+        return catalog
+
+    lang = _user_lang(models_proxy, db, uid, password)
+    context = {'lang': lang} if lang else None
+    options = {'fields': ['model', 'name']}
+    if context:
+        options['context'] = context
+    models = {
+        m['model']: [m.get('name') or '']
+        for m in models_proxy.execute_kw(db, uid, password, 'ir.model', 'search_read', [[]], options) if m.get('model')
+    }
+    for batch in etl_runtime.iter_search_read(
+        models_proxy, db, uid, password, 'ir.model.fields',
+        fields=['model', 'name', 'field_description'], initial_size=5000, context=context
+    ):
+        for field in batch:
+            if field.get('model') in models:
+                models[field['model']].append(f"{field.get('name') or ''} {field.get('field_description') or ''}")
+    catalog = {'built_at': time.time(), 'fingerprint': entry.get('fingerprint'), 'models': models}
+    _cache.set(f"{conn_key}|catalog", catalog)
+    return catalog
+
+
+def invalidate(conn_key):
+    """Supprime le schéma en cache d'une connexion (bouton « Rafraîchir le schéma »)."""
+    _cache.delete(conn_key)
+    _cache.delete(f"{conn_key}|catalog")
@@ -0,0 +1,77 @@
+import pandas as pd
+
+import etl_runtime
+
+FIELD_TYPES = {'date_order': 'datetime', 'amount': 'monetary', 'user_id': 'many2one'}
+# Autour des limites de mois et de semaine : 2024-01-31 23:30 UTC est déjà en février à Paris
+RECORDS = [
+    {'id': 1, 'date_order': '2024-01-31 23:30:00', 'amount': 10.0, 'user_id': [2, 'A']},
+    {'id': 2, 'date_order': '2024-01-15 08:00:00', 'amount': 5.0, 'user_id': [2, 'A']},
+    {'id': 3, 'date_order': '2024-02-01 00:30:00', 'amount': 7.0, 'user_id': [3, 'B']},
+    {'id': 4, 'date_order': '2024-02-04 23:30:00', 'amount': 1.0, 'user_id': [3, 'B']},
+]
+
+
+class FakeOdoo:
+    """`read_group` d'Odoo sur RECORDS : les périodes sont découpées dans le fuseau du contexte."""
+
+    def __init__(self, user_tz='Europe/Paris'):
+        self.user_tz = user_tz
+        self.contexts = []
+
+    def execute_kw(self, db, uid, password, model, method, args, kwargs=None):
+        assert method == 'read_group'
+        context = (kwargs or {}).get('context') or {}
+        self.contexts.append(context)
+        tz = context.get('tz') or self.user_tz
+        _, aggregates, groupbys = args
+        groups = {}
+        for record in RECORDS:
+            key, values = [], {}
+            for groupby in groupbys:
+                field, _, granularity = groupby.partition(':')
+                value = record[field]
+                if granularity:
+                    local = pd.Timestamp(value, tz='UTC').tz_convert(tz)
+                    start = local.tz_localize(None).to_period(etl_runtime.DATE_GRANULARITIES[granularity]).start_time
+                    value = start.tz_localize(tz).tz_convert('UTC').strftime('%Y-%m-%d %H:%M:%S')
+                key.append(value if not isinstance(value, list) else value[0])
+                values[groupby] = value
+            group = groups.setdefault(tuple(key), {**values, '__count': 0, '_records': []})
+            group['__count'] += 1
+            group['_records'].append(record)
+        result = []
+        for group in groups.values():
+            records = group.pop('_records')
+            group['__range'] = {g: {'from': group[g]} for g in groupbys if ':' in g}
+            for spec in aggregates:
+                name, _, expression = spec.partition(':')
+                field = expression[expression.index('(') + 1:-1]
+                group[name] = sum(record[field] for record in records)
+            result.append(group)
+        return result
+
+
+def local_aggregate(spec):
+    df = etl_runtime.compact_frame(etl_runtime.records_to_frame(RECORDS, FIELD_TYPES), FIELD_TYPES)
+    return etl_runtime.aggregate_frame(df, spec, FIELD_TYPES)
+
+
+def sorted_rows(df):
+    return df.sort_values(list(df.columns[:-2])).reset_index(drop=True).astype(object).values.tolist()
+
+
+def test_read_group_and_local_aggregation_give_same_periods():
+    for granularity in ('day', 'week', 'month'):
+        spec = {'groupby': [f'date_order:{granularity}', 'user_id'], 'aggregates': ['amount:sum']}
+        odoo = FakeOdoo()
+        remote = etl_runtime.read_group_frame(odoo, 'db', 1, 'pw', 'sale.order', spec, field_types=FIELD_TYPES)
+        assert odoo.contexts == [{'tz': 'UTC'}]
+        assert sorted_rows(remote) == sorted_rows(local_aggregate(spec)), granularity
+
+
+def test_month_groups_are_utc_months():
+    spec = {'groupby': ['date_order:month'], 'aggregates': ['amount:sum']}
+    result = local_aggregate(spec).set_index('date_order')
+    assert result.loc[pd.Timestamp('2024-01-01', tz='UTC'), 'amount_sum'] == 15.0
+    assert result.loc[pd.Timestamp('2024-02-01', tz='UTC'), 'amount_sum'] == 8.0
@@ -0,0 +1,145 @@
+import pytest
+
+import code_analysis
+
+PLAN = {'account.move': ['name', 'state', 'amount_total', 'invoice_date', 'partner_id'],
+        'res.partner': ['name', 'country_id', 'email']}
+
+
+def prune(code, plan=PLAN):
+    return code_analysis.prune_unused_fields(code, plan)
+
+
+def test_projection_prunes_unused_fields():
+    code = (
+        "def transform_data(dfs):\n"
+        "    moves = dfs['account.move']\n"
+        "    moves = moves[moves['state'] == 'posted']\n"
+        "    return moves[['name', 'amount_total']]\n"
+    )
+    plan, removed, reason = prune(code)
+    assert reason is None
+    assert plan['account.move'] == ['name', 'state', 'amount_total']
+    assert removed['account.move'] == ['invoice_date', 'partner_id']
+
+
+def test_pass_through_keeps_all_fields():
+    code = "def transform_data(dfs):\n    return dfs['account.move']\n"
+    plan, removed, reason = prune(code, {'account.move': ['state', 'name', 'amount_total', 'invoice_date']})
+    assert removed == {} and reason
+    assert plan['account.move'] == ['state', 'name', 'amount_total', 'invoice_date']
+
+
+def test_filtered_pass_through_keeps_all_fields():
+    code = (
+        "def transform_data(dfs):\n"
+        "    df = dfs['account.move']\n"
+        "    return df[df['state'] == 'posted']\n"
+    )
+    assert prune(code)[1] == {}
+
+
+def test_rename_keeps_all_fields():
+    code = (
+        "def transform_data(dfs):\n"
+        "    return dfs['account.move'].rename(columns={'name': 'numero'})\n"
+    )
+    assert prune(code)[1] == {}
+
+
+def test_merge_of_unprojected_frames_keeps_all_fields():
+    code = (
+        "def transform_data(dfs):\n"
+        "    moves = dfs['account.move'][['name', 'partner_id']]\n"
+        "    return moves.merge(dfs['res.partner'], left_on='partner_id', right_on='id')\n"
+    )
+    assert prune(code)[1] == {}
+    code = code.replace("moves.merge(dfs['res.partner'],", "pd.merge(moves, dfs['res.partner'],")
+    assert "pd.merge(" in code
+    assert prune(code)[1] == {}
+
+
+def test_merge_of_projected_frames_prunes():
+    code = (
+        "def transform_data(dfs):\n"
+        "    moves = dfs['account.move'][['name', 'partner_id']]\n"
+        "    partners = dfs['res.partner'][['id', 'name']]\n"
+        "    return moves.merge(partners, left_on='partner_id', right_on='id')\n"
+    )
+    plan, removed, reason = prune(code)
+    assert reason is None
+    assert removed == {'account.move': ['state', 'amount_total', 'invoice_date'],
+                       'res.partner': ['country_id', 'email']}
+
+
+def test_lookup_with_literal_fields_prunes():
+    code = (
+        "def transform_data(dfs):\n"
+        "    moves = dfs['account.move'][['name', 'partner_id']]\n"
+        "    return lookup(moves, 'partner_id', dfs['res.partner'], {'name': 'client'})\n"
+    )
+    plan, removed, _ = prune(code)
+    assert plan['res.partner'] == ['name']
+    assert 'state' in removed['account.move']
+
+
+def test_lookup_on_whole_frame_keeps_all_fields():
+    code = (
+        "def transform_data(dfs):\n"
+        "    return lookup(dfs['account.move'], 'partner_id', dfs['res.partner'], ['name'])\n"
+    )
+    assert prune(code)[1] == {}
+
+
+PROJECTED_RESULT = (
+    "    moves = moves[['name', 'amount_total']]\n"
+    "    partners = dfs['res.partner'][['id', 'name']]\n"
+    "    return moves.merge(partners, left_on='name', right_on='name')\n"
+)
+
+
+@pytest.mark.parametrize('dynamic_line', [
+    "    moves = moves[[c for c in moves.columns if c.startswith('amount')] + ['name']]\n",
+    "    moves = moves.filter(like='amount')\n",
+    "    moves = moves.filter(regex='^amount')\n",
+    "    moves = moves.select_dtypes('number').join(moves[['name']])\n",
+    "    moves['total'] = moves[f'amount_{\"total\"}']\n",
+    "    moves['total'] = moves['amount' + '_total']\n",
+    "    moves = moves.iloc[:, 0:3]\n",
+])
+def test_dynamic_columns_keep_fields_of_that_frame(dynamic_line):
+    code = "def transform_data(dfs):\n    moves = dfs['account.move']\n" + dynamic_line + PROJECTED_RESULT
+    plan, removed, reason = prune(code)
+    assert plan['account.move'] == PLAN['account.move']
+    # L'autre modèle reste élagué
+    assert removed == {'res.partner': ['country_id', 'email']}
+
+
+def test_dynamic_columns_of_unknown_frame_keep_all_fields():
+    code = (
+        "def transform_data(dfs):\n"
+        "    for name, df in dfs.items():\n"
+        "        df.columns = [f'{name}_{c}' for c in df.columns]\n"
+        "    return dfs['account.move'][['account.move_name']]\n"
+    )
+    plan, removed, reason = prune(code)
+    assert removed == {} and 'dynamiquement' in reason
+
+
+def test_column_concatenation_and_messages_are_not_dynamic():
+    code = (
+        "def transform_data(dfs):\n"
+        "    moves = dfs['account.move']\n"
+        "    print(f\"{len(moves)} factures\")\n"
+        "    moves = moves.assign(label=moves['name'] + ' - ' + moves['state'])\n"
+        "    return moves[['label', 'amount_total']]\n"
+    )
+    plan, removed, reason = prune(code, {'account.move': PLAN['account.move']})
+    assert reason is None
+    assert removed == {'account.move': ['invoice_date', 'partner_id']}
+
+
+def test_streaming_blockers_detects_aggregation():
+    code = "def transform_data(dfs):\n    return dfs['account.move'].groupby('state').sum()\n"
+    assert code_analysis.streaming_blockers(code)
+    assert code_analysis.streaming_blockers("def transform_data(dfs):\n    return dfs['m'][['a']]\n") == []
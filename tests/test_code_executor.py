@@ -0,0 +1,86 @@
+import pandas as pd
+import pytest
+
+from code_executor import TransformError, TransformPool
+
+FRAMES = {'account.move': pd.DataFrame({'id': [1, 2, 3], 'amount': [1.0, 2.0, 3.0]})}
+VALID_CODE = (
+    "def transform_data(dfs):\n"
+    "    df = dfs['account.move']\n"
+    "    return df[df['amount'] > 1.0][['id', 'amount']].reset_index(drop=True)\n"
+)
+
+
+@pytest.fixture(scope='module', params=[True, False], ids=['isolated', 'local'])
+def pool(request):
+    pool = TransformPool(max_workers=1, cpu_seconds=2, timeout_seconds=60, isolated=request.param)
+    yield pool
+    pool.shutdown()
+
+
+def test_run_returns_transformed_frame(pool):
+    result = pool.run(VALID_CODE, FRAMES)
+    assert result['id'].tolist() == [2, 3]
+    assert result['amount'].tolist() == [2.0, 3.0]
+
+
+def test_syntax_error_is_a_transform_error(pool):
+    with pytest.raises(TransformError, match='SyntaxError'):
+        pool.run('def transform_data(dfs) return 1', FRAMES)
+
+
+def test_missing_function_is_a_transform_error(pool):
+    with pytest.raises(TransformError, match="transform_data"):
+        pool.run('x = 1', FRAMES)
+
+
+def test_runtime_error_is_a_transform_error(pool):
+    with pytest.raises(TransformError, match='NameError'):
+        pool.run("def transform_data(dfs):\n    return undefined_name\n", FRAMES)
+
+
+def test_streaming_session_replaces_fact_model(pool):
+    with pool.session(VALID_CODE, FRAMES) as session:
+        batch = pd.DataFrame({'id': [10, 11], 'amount': [0.5, 9.0]})
+        assert session.run('account.move', batch)['id'].tolist() == [11]
+        assert session.run()['id'].tolist() == [2, 3]
+
+
+def test_isolated_worker_survives_errors_and_enforces_cpu_limit():
+    pool = TransformPool(max_workers=1, cpu_seconds=1, timeout_seconds=60, isolated=True)
+    try:
+        with pytest.raises(TransformError):
+            pool.run("def transform_data(dfs):\n    while True:\n        pass\n", FRAMES)
+        # Le processus tué est remplacé à la demande
+        assert pool.run(VALID_CODE, FRAMES)['id'].tolist() == [2, 3]
+    finally:
+        pool.shutdown()
+
+
+def test_isolated_worker_enforces_memory_limit():
+    pool = TransformPool(max_workers=1, max_rss_mb=256, timeout_seconds=60, isolated=True)
+    try:
+        with pytest.raises(TransformError, match='MemoryError'):
+            pool.run("def transform_data(dfs):\n    return bytearray(2 * 1024**3)\n", FRAMES)
+        # La limite est propre à chaque session : le processus reste utilisable
+        assert pool.run(VALID_CODE, FRAMES)['id'].tolist() == [2, 3]
+    finally:
+        pool.shutdown()
+
+
+def test_on_wait_interrupts_and_kills_worker():
+    class Stop(BaseException):
+        pass
+
+    def on_wait(elapsed):
+        if elapsed > 0.5:
+            raise Stop()
+
+    pool = TransformPool(max_workers=1, timeout_seconds=60, isolated=True)
+    try:
+        with pytest.raises(Stop):
+            pool.run("import time\ndef transform_data(dfs):\n    time.sleep(30)\n", FRAMES, on_wait=on_wait)
+        assert not pool._idle
+        assert pool.run(VALID_CODE, FRAMES)['id'].tolist() == [2, 3]
+    finally:
+        pool.shutdown()
@@ -0,0 +1,54 @@
+import pandas as pd
+
+import etl_runtime
+
+
+def test_compact_frame_integer_dtypes():
+    df = pd.DataFrame({'id': [1, 2, 3], 'partner_id': [7, False, 9], 'qty': [0, 3, 5]})
+    out = etl_runtime.compact_frame(df, {'partner_id': 'many2one', 'qty': 'integer'})
+    assert str(out['id'].dtype) == 'Int32'
+    assert out['partner_id'].tolist() == [7, pd.NA, 9]
+    # Un entier nul n'est pas une valeur vide
+    assert out['qty'].tolist() == [0, 3, 5]
+
+
+def test_compact_frame_many2one_empty_on_whole_page():
+    # Lot où le many2one est vide partout : Odoo renvoie False, pandas en fait un dtype bool
+    df = pd.DataFrame({'id': [1, 2], 'partner_id': [False, False]})
+    assert df['partner_id'].dtype == bool
+    out = etl_runtime.compact_frame(df, {'partner_id': 'many2one'})
+    assert str(out['partner_id'].dtype) == 'Int32'
+    assert out['partner_id'].isna().all()
+
+
+def test_compact_frame_dates_and_floats():
+    df = pd.DataFrame({
+        'id': [1, 2], 'date': ['2024-01-31', False], 'amount': [1.5, 0.0],
+        'write_date': [False, False],
+    })
+    out = etl_runtime.compact_frame(df, {'date': 'date', 'amount': 'monetary', 'write_date': 'datetime'})
+    assert str(out['date'].dtype) == 'datetime64[ns, UTC]'
+    assert out['date'].isna().tolist() == [False, True]
+    assert out['write_date'].isna().all()
+    assert out['amount'].dtype == 'float64'
+
+
+def test_compact_frame_text_and_selection_empty_on_whole_page():
+    df = pd.DataFrame({'id': [1, 2], 'name': [False, False], 'state': [False, False]})
+    out = etl_runtime.compact_frame(df, {'name': 'char', 'state': 'selection'})
+    assert out['name'].dtype != bool and out['name'].isna().all()
+    assert isinstance(out['state'].dtype, pd.CategoricalDtype) and out['state'].isna().all()
+
+
+def test_compact_frame_text_mixed_page():
+    df = pd.DataFrame({'id': [1, 2], 'name': ['a', False], 'state': ['draft', False]})
+    out = etl_runtime.compact_frame(df, {'name': 'char', 'state': 'selection'})
+    assert out['name'].isna().tolist() == [False, True]
+    assert list(out['state'].cat.categories) == ['draft']
+    # Lots vides partout et lots mixtes se concatènent sans valeur False
+    empty = etl_runtime.compact_frame(
+        pd.DataFrame({'id': [3], 'name': [False], 'state': [False]}), {'name': 'char', 'state': 'selection'}
+    )
+    both = etl_runtime.concat_frames([out, empty])
+    assert not (both['name'] == False).any()  # noqa: E712
+    assert both['name'].isna().tolist() == [False, True, True]
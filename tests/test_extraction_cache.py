@@ -0,0 +1,82 @@
+import pandas as pd
+import pyarrow as pa
+
+import etl_runtime
+from extraction_cache import ExtractionCache, extraction_key
+
+FIELD_TYPES = {'name': 'char', 'partner_id': 'many2one', 'state': 'selection', 'amount': 'monetary'}
+
+
+def page(records):
+    return etl_runtime.compact_frame(etl_runtime.records_to_frame(records, FIELD_TYPES), FIELD_TYPES)
+
+
+def mixed_pages():
+    # 2e lot : texte, many2one et selection vides partout (dtype bool avant compactage)
+    return [
+        page([{'id': 1, 'name': 'INV/1', 'partner_id': [7, 'A'], 'state': 'posted', 'amount': 10.0},
+              {'id': 2, 'name': False, 'partner_id': False, 'state': 'draft', 'amount': 0.0}]),
+        page([{'id': 3, 'name': False, 'partner_id': False, 'state': False, 'amount': 5.0}]),
+        page([{'id': 2**31 + 5, 'name': 'INV/4', 'partner_id': [8, 'B'], 'state': 'cancel', 'amount': 1.0}]),
+    ]
+
+
+def test_sink_casts_chunks_to_first_schema(tmp_path):
+    path = str(tmp_path / 'm.parquet')
+    sink = etl_runtime.ParquetChunkSink(path, FIELD_TYPES)
+    sink.write(pd.DataFrame({'id': [1], 'name': ['a'], 'flag': [True]}))
+    # Chunk non compacté : texte `False` en bool, id 64 bits, colonne absente
+    sink.write(pd.DataFrame({'id': pd.array([2**40], dtype='Int64'), 'name': [False]}))
+    sink.close()
+    df = etl_runtime.read_spilled_frame(path)
+    assert df['name'].tolist()[0] == 'a' and pd.isna(df['name'].tolist()[1])
+    assert df['id'].tolist() == [1, 2**40]
+    assert sink.schema.field('name').type == pa.string()
+
+
+def test_extraction_cache_round_trip_with_mixed_pages(tmp_path):
+    cache = ExtractionCache(root=str(tmp_path))
+    key = extraction_key('conn', 'account.move', list(FIELD_TYPES), [])
+    produced = list(cache.chunks(key, iter(mixed_pages()), FIELD_TYPES))
+    assert len(produced) == 3
+    assert cache.lookup(key)
+
+    def fail():
+        raise AssertionError("Odoo ne doit pas être interrogé")
+        yield
+
+    cached = etl_runtime.concat_frames(list(cache.chunks(key, fail(), FIELD_TYPES)))
+    expected = etl_runtime.concat_frames(produced)
+    assert cached['id'].tolist() == expected['id'].tolist()
+    assert cached['name'].isna().tolist() == [False, True, True, False]
+    assert cached['partner_id'].isna().tolist() == [False, True, True, False]
+    assert cached['state'].isna().tolist() == [False, False, True, False]
+    assert cached['amount'].tolist() == [10.0, 0.0, 5.0, 1.0]
+
+
+def test_interrupted_extraction_is_not_cached(tmp_path):
+    cache = ExtractionCache(root=str(tmp_path))
+    key = extraction_key('conn', 'account.move', list(FIELD_TYPES), [])
+
+    def broken():
+        yield mixed_pages()[0]
+        raise RuntimeError("coupure réseau")
+
+    try:
+        list(cache.chunks(key, broken(), FIELD_TYPES))
+    except RuntimeError:
+        pass
+    assert cache.lookup(key) is None
+
+
+def test_opened_entry_survives_eviction(tmp_path):
+    cache = ExtractionCache(root=str(tmp_path))
+    key = extraction_key('conn', 'account.move', list(FIELD_TYPES), [])
+    list(cache.store(key, iter(mixed_pages()), FIELD_TYPES))
+    entry = cache.open(key)
+    assert entry is not None
+    # Expulsion entre la consultation et la lecture
+    cache.invalidate()
+    assert cache.open(key) is None
+    frames = list(cache.read(entry))
+    assert etl_runtime.concat_frames(frames)['amount'].tolist() == [10.0, 0.0, 5.0, 1.0]
@@ -0,0 +1,62 @@
+import pytest
+
+import gcp
+
+MODELS = {'account.move': ['name', 'partner_id', 'amount_total'], 'res.partner': ['name']}
+ROW_LOCAL_CODE = (
+    "def transform_data(dfs):\n"
+    "    df = lookup(dfs['account.move'], 'partner_id', dfs['res.partner'], ['name'])\n"
+    "    return df[['id', 'name', 'partner_id_name', 'amount_total']]\n"
+)
+AGGREGATED_CODE = (
+    "def transform_data(dfs):\n"
+    "    return dfs['account.move'].groupby('partner_id', as_index=False)['amount_total'].sum()\n"
+)
+
+
+def generate(ai_python_code, incremental_models, streaming_fact_model='account.move'):
+    return gcp.generate_gcp_function_code(
+        'https://odoo.example.com', 'db', 'user', 'moves', MODELS, ai_python_code, 'LICENSE',
+        incremental_models=incremental_models, streaming_fact_model=streaming_fact_model,
+    )
+
+
+def test_incremental_mode_accepts_row_local_code():
+    code = generate(ROW_LOCAL_CODE, ['account.move'])
+    assert "INCREMENTAL_MODELS = ['account.move']" in code
+
+
+def test_incremental_mode_is_limited_to_the_fact_model():
+    # Une dimension filtrée sur `write_date` ferait perdre les jointures des lignes modifiées
+    with pytest.raises(ValueError, match='res.partner'):
+        generate(ROW_LOCAL_CODE, ['account.move', 'res.partner'])
+    with pytest.raises(ValueError, match='res.partner'):
+        generate(ROW_LOCAL_CODE, ['res.partner'])
+    with pytest.raises(ValueError):
+        generate(ROW_LOCAL_CODE, ['account.move'], streaming_fact_model=None)
+
+
+def test_incremental_mode_refuses_cross_row_code():
+    with pytest.raises(ValueError, match='groupby'):
+        generate(AGGREGATED_CODE, ['account.move'])
+    # Sans mode incrémental, le même code reste déployable
+    assert "INCREMENTAL_MODELS = []" in generate(AGGREGATED_CODE, None)
+
+
+def test_incremental_view_documents_deletions():
+    sql = gcp.generate_bigquery_view_code('project', 'dataset', 'v_moves', 'moves', key_column='id')
+    assert 'suppressions' in sql
+    assert 'PARTITION BY `id`' in sql
+
+
+def test_extraction_errors_have_their_own_label():
+    code = generate(ROW_LOCAL_CODE, None)
+    compile(code, 'main.py', 'exec')
+    assert 'ERREUR CRITIQUE (Extraction Odoo, modèle' in code
+    assert code.index('except ExtractionError') < code.index('ERREUR CRITIQUE (Transformation IA)')
+
+
+def test_watermark_is_capped_by_run_start():
+    code = generate(ROW_LOCAL_CODE, ['account.move'])
+    assert 'WATERMARK_SAFETY_LAG_SECONDS' in code
+    assert 'min(max_seen, watermark_ceiling)' in code
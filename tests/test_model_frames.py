@@ -0,0 +1,71 @@
+import os
+
+import pandas as pd
+
+import etl_runtime
+
+FIELD_TYPES = {'name': 'char', 'partner_id': 'many2one', 'state': 'selection', 'amount': 'monetary'}
+
+
+def pages():
+    def page(records):
+        return etl_runtime.compact_frame(etl_runtime.records_to_frame(records, FIELD_TYPES), FIELD_TYPES)
+
+    return [
+        page([{'id': 1, 'name': 'INV/1', 'partner_id': [7, 'A'], 'state': 'posted', 'amount': 10.0},
+              {'id': 2, 'name': False, 'partner_id': False, 'state': 'draft', 'amount': 0.0}]),
+        page([{'id': 3, 'name': False, 'partner_id': False, 'state': False, 'amount': 5.0}]),
+        page([{'id': 4, 'name': 'INV/4', 'partner_id': [8, 'B'], 'state': 'cancel', 'amount': 1.0}]),
+    ]
+
+
+def collect(tmp_path, memory_budget, indexed_models=()):
+    frames = etl_runtime.ModelFrames(['account.move'], memory_budget=memory_budget,
+                                     spill_dir=str(tmp_path), indexed_models=indexed_models)
+    result = frames.collect('account.move', pages(), FIELD_TYPES)
+    return frames, result
+
+
+def assert_same_values(left, right):
+    assert list(left.columns) == list(right.columns)
+    for column in left.columns:
+        assert left[column].astype(object).where(left[column].notna(), None).tolist() == \
+            right[column].astype(object).where(right[column].notna(), None).tolist(), column
+
+
+def test_spilled_model_matches_in_memory_model(tmp_path):
+    in_memory, (rows, _, spilled) = collect(tmp_path, memory_budget=10**9)
+    assert (rows, spilled) == (4, False)
+    assert in_memory.spill_path('account.move') is None
+
+    on_disk, (rows, _, spilled) = collect(tmp_path, memory_budget=0)
+    assert (rows, spilled) == (4, True)
+    assert on_disk.is_spilled('account.move')
+    assert os.path.exists(on_disk.spill_path('account.move'))
+    assert_same_values(on_disk['account.move'], in_memory['account.move'])
+    assert on_disk.table('account.move').num_rows == 4
+
+
+def test_model_spilled_after_first_chunks_keeps_every_row(tmp_path):
+    # Le budget tient le premier lot seulement : les lots déjà gardés sont réécrits sur disque
+    budget = etl_runtime.frame_memory_bytes(pages()[0])
+    frames, (rows, _, spilled) = collect(tmp_path, memory_budget=budget)
+    assert (rows, spilled) == (4, True)
+    assert frames['account.move']['id'].tolist() == [1, 2, 3, 4]
+    assert frames.budget.used_bytes == 0
+
+
+def test_spilled_dimension_is_indexed_for_lookup(tmp_path):
+    frames, _ = collect(tmp_path, memory_budget=0, indexed_models=['account.move'])
+    fact = pd.DataFrame({'move_id': [4, 1, 99]})
+    result = etl_runtime.lookup(fact, 'move_id', frames['account.move'], ['name'])
+    assert result['move_id_name'].tolist()[:2] == ['INV/4', 'INV/1']
+    assert pd.isna(result['move_id_name'].tolist()[2])
+
+
+def test_close_removes_spill_directory(tmp_path):
+    frames, _ = collect(tmp_path, memory_budget=0)
+    directory = frames.directory
+    assert os.listdir(directory)
+    frames.close()
+    assert not os.path.exists(directory)
@@ -0,0 +1,18 @@
+import odoo_client
+
+
+def test_get_client_is_shared_for_same_settings():
+    first = odoo_client.get_client('https://shared.example.com/', 'db', 2)
+    assert odoo_client.get_client('https://shared.example.com', 'db', 2) is first
+
+
+def test_get_client_honours_timeouts_and_pool_size_on_later_calls():
+    default = odoo_client.get_client('https://settings.example.com', 'db', 2)
+    slow = odoo_client.get_client('https://settings.example.com', 'db', 2, read_timeout=900)
+    assert slow is not default
+    assert slow.backend.transport.timeout[1] == 900
+
+    pooled = odoo_client.get_client('https://settings.example.com', 'db', 2, pool_size=32)
+    assert pooled is not default
+    adapter = pooled.session.get_adapter('https://settings.example.com')
+    assert adapter._pool_maxsize == 32